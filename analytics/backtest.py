@@ -0,0 +1,208 @@
+"""
+Rolling-origin backtests of the forecasting engines. Each series is cut at several origins; every engine is
+trained on the months before an origin and scored on the horizon after it. Prophet engines run one series per
+task in a process pool, the matrix engines fit all series of a fold at once. Per-fold scores go to
+backtest_results.csv and the per-engine comparison to backtest_summary.csv.
+
+Prophet rows time each series' fit and predict separately ("per series"). A matrix engine fits and forecasts
+every series in one step, so its rows carry a share of the fold's batch time as fit_seconds and no
+predict_seconds ("amortized"); total_seconds in the summary is the time comparable across both.
+"""
+import argparse
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from prophet import Prophet
+from config import (PROCESSED_WEATHER_COLS, FORECAST_WORKERS, FORECAST_TIMEOUT, BACKTEST_ENGINES,
+                    BACKTEST_FOLDS, BACKTEST_HORIZON, BACKTEST_MIN_TRAIN, BACKTEST_CSV, BACKTEST_SUMMARY_CSV)
+from analytics.engines import ENGINES, forecast_matrix
+from analytics.forecasting import production_series, series_groups, series_timeout, forecast_workers
+
+# Prophet engines and the weather regressors each one uses
+PROPHET_ENGINES = {
+    "prophet": [],
+    "prophet_weather": PROCESSED_WEATHER_COLS,
+}
+RESULT_COLUMNS = ["engine", "country", "production_type", "cutoff", "months", "mape", "rmse", "coverage",
+                  "fit_seconds", "predict_seconds", "timing"]
+
+
+def to_months(values):
+    return pd.PeriodIndex(pd.to_datetime(pd.Series(values).astype(str)), freq='M')
+
+
+def fold_cutoffs(months, folds=BACKTEST_FOLDS, horizon=BACKTEST_HORIZON, min_train=BACKTEST_MIN_TRAIN):
+    """
+    First test month of each fold, oldest first. The last fold's horizon ends at the last month; origins
+    that would leave fewer than min_train months of training data are dropped.
+    """
+    months = to_months(months).unique().sort_values()
+    if len(months) == 0:
+        return []
+    last = months[-1]
+    cutoffs = [last - horizon * (folds - i) + 1 for i in range(folds)]
+    return [cutoff for cutoff in cutoffs if (months < cutoff).sum() >= min_train]
+
+
+def score(actual, yhat, lower, upper):
+    # MAPE skips months with zero output; coverage is the share of actuals inside the interval
+    actual, yhat = np.asarray(actual, dtype=float), np.asarray(yhat, dtype=float)
+    nonzero = actual != 0
+    mape = np.mean(np.abs((actual[nonzero] - yhat[nonzero]) / actual[nonzero])) * 100 if nonzero.any() else np.nan
+    rmse = np.sqrt(np.mean((actual - yhat) ** 2))
+    coverage = np.mean((actual >= np.asarray(lower)) & (actual <= np.asarray(upper)))
+    return {"months": len(actual), "mape": mape, "rmse": rmse, "coverage": coverage}
+
+
+def prophet_model(weather_cols):
+    model = Prophet()
+    for col in weather_cols:
+        model.add_regressor(col)
+    return model
+
+
+def backtest_prophet_series(task):
+    """
+    Runs in a worker process: every fold of one series for one Prophet engine. Future weather repeats the last
+    training value, as in forecasting.fit_prophet_with_weather. Returns (rows, errors).
+    """
+    engine, (country, production_type), group, cutoffs, horizon, timeout = task
+    weather_cols = PROPHET_ENGINES[engine]
+    months = to_months(group["ds"])
+    rows, errors = [], []
+    for cutoff in cutoffs:
+        train = group[months < cutoff]
+        test = group[(months >= cutoff) & (months < cutoff + horizon)]
+        if len(train) < 2 or test.empty:
+            continue
+        try:
+            with series_timeout(timeout):
+                start = time.perf_counter()
+                model = prophet_model(weather_cols).fit(train[["ds", "y"] + weather_cols])
+                fitted = time.perf_counter()
+                future = test[["ds"]].copy()
+                for col in weather_cols:
+                    future[col] = train[col].iloc[-1]
+                forecast = model.predict(future)
+                predicted = time.perf_counter()
+        except Exception as e:
+            errors.append(f"{engine} {country} / {production_type} @ {cutoff}: {type(e).__name__}: {e}")
+            continue
+        rows.append({"engine": engine, "country": country, "production_type": production_type,
+                     "cutoff": str(cutoff),
+                     **score(test["y"], forecast["yhat"], forecast["yhat_lower"], forecast["yhat_upper"]),
+                     "fit_seconds": fitted - start, "predict_seconds": predicted - fitted, "timing": "per series"})
+    return rows, errors
+
+
+def backtest_matrix(df, engine, cutoffs, horizon=BACKTEST_HORIZON, weather_cols=PROCESSED_WEATHER_COLS):
+    """
+    Scores a matrix engine on every fold. The engine fits and forecasts all series in one step, so the fold's
+    wall time is shared evenly across its scored series as fit_seconds, which sum to the batch time.
+    """
+    months = to_months(df["month"])
+    rows = []
+    for cutoff in cutoffs:
+        train = df[months < cutoff]
+        test = df[(months >= cutoff) & (months < cutoff + horizon)].dropna(subset=["value_gwh"])
+        start = time.perf_counter()
+        forecast = forecast_matrix(train, engine, periods=horizon, weather_cols=weather_cols)
+        elapsed = time.perf_counter() - start
+        if forecast is None or test.empty:
+            continue
+        test = test.assign(ds=to_months(test["month"]).to_timestamp(),
+                           country=test["country"].astype(str), production_type=test["production_type"].astype(str))
+        scored = test.merge(forecast, on=["country", "production_type", "ds"])
+        groups = scored.groupby(["country", "production_type"])
+        for (country, production_type), group in groups:
+            rows.append({"engine": engine, "country": country, "production_type": production_type,
+                         "cutoff": str(cutoff),
+                         **score(group["value_gwh"], group["yhat"], group["yhat_lower"], group["yhat_upper"]),
+                         "fit_seconds": elapsed / groups.ngroups, "predict_seconds": np.nan, "timing": "amortized"})
+    return rows
+
+
+def summarize(results):
+    # One row per engine, most accurate first
+    summary = results.groupby("engine").agg(
+        forecasts=("cutoff", "size"),
+        mape=("mape", "mean"),
+        median_mape=("mape", "median"),
+        rmse=("rmse", "mean"),
+        coverage=("coverage", "mean"),
+        fit_seconds=("fit_seconds", "sum"),
+        # Matrix engines have no separate predict time
+        predict_seconds=("predict_seconds", lambda seconds: seconds.sum(min_count=1)),
+        timing=("timing", "first"),
+    )
+    # Fit plus predict: the only time comparable between per-series and amortized rows
+    summary.insert(summary.columns.get_loc("timing"), "total_seconds",
+                   summary["fit_seconds"] + summary["predict_seconds"].fillna(0))
+    summary.insert(0, "series", results.drop_duplicates(["engine", "country", "production_type"]).groupby("engine").size())
+    return summary.sort_values("mape").reset_index()
+
+
+def run_backtest(df=None, engines=BACKTEST_ENGINES, folds=BACKTEST_FOLDS, horizon=BACKTEST_HORIZON,
+                 min_train=BACKTEST_MIN_TRAIN, max_workers=FORECAST_WORKERS, timeout=FORECAST_TIMEOUT,
+                 output_csv=BACKTEST_CSV, summary_csv=BACKTEST_SUMMARY_CSV):
+    """
+    Backtests each engine on every production series of the merged data (df, or the merged store) and
+    returns (results, summary). Output paths of None skip writing.
+    """
+    unknown = [engine for engine in engines if engine not in PROPHET_ENGINES and engine not in ENGINES]
+    if unknown:
+        raise ValueError(f"Unknown engines: {', '.join(unknown)}")
+    weather_cols = PROCESSED_WEATHER_COLS
+    df = production_series(df, columns=["country", "month", "production_type", "value_gwh"] + weather_cols)
+    cutoffs = fold_cutoffs(df["month"], folds, horizon, min_train)
+    if not cutoffs:
+        print("Not enough history to backtest.")
+        return None, None
+    print(f"Backtesting {', '.join(engines)} on folds starting {', '.join(str(cutoff) for cutoff in cutoffs)}")
+
+    tasks = [(engine, key, group, cutoffs, horizon, timeout)
+             for engine in engines if engine in PROPHET_ENGINES
+             for key, group in sorted(series_groups(df, PROPHET_ENGINES[engine]).items())]
+    rows, errors = [], []
+    workers = forecast_workers(len(tasks), max_workers)
+    if workers == 1:
+        outputs = [backtest_prophet_series(task) for task in tasks]
+    elif tasks:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(backtest_prophet_series, task) for task in tasks]
+            outputs = [future.result() for future in as_completed(futures)]
+    else:
+        outputs = []
+    for task_rows, task_errors in outputs:
+        rows.extend(task_rows)
+        errors.extend(task_errors)
+    for engine in engines:
+        if engine in ENGINES:
+            rows.extend(backtest_matrix(df, engine, cutoffs, horizon, weather_cols))
+    for error in errors:
+        print(f"Backtest failed for {error}")
+
+    results = pd.DataFrame(rows, columns=RESULT_COLUMNS).sort_values(
+        ["engine", "country", "production_type", "cutoff"], ignore_index=True)
+    summary = summarize(results)
+    if output_csv:
+        results.to_csv(output_csv, index=False)
+    if summary_csv:
+        summary.to_csv(summary_csv, index=False)
+        print(f"Saved backtest comparison to {summary_csv}")
+    print(summary.to_string(index=False))
+    return results, summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rolling-origin backtest of the forecasting engines.")
+    parser.add_argument("--engines", nargs="+", default=BACKTEST_ENGINES,
+                        choices=list(PROPHET_ENGINES) + list(ENGINES))
+    parser.add_argument("--folds", type=int, default=BACKTEST_FOLDS)
+    parser.add_argument("--horizon", type=int, default=BACKTEST_HORIZON, help="Months forecast per fold")
+    parser.add_argument("--workers", type=int, default=FORECAST_WORKERS, help="Processes for Prophet fits (0 = one per CPU)")
+    args = parser.parse_args()
+    run_backtest(engines=args.engines, folds=args.folds, horizon=args.horizon, max_workers=args.workers)
@@ -0,0 +1,88 @@
+"""
+Carbon accounting. Emission factors start from EMISSIONS_FACTORS and can be refined per country and year in
+EMISSIONS_FACTORS_CSV (columns country, production_type, year, kg_per_mwh; a blank country or year applies to
+all). The factors are resolved once into a (country x production_type x year) array and every row picks its
+factor by categorical codes. The carbon cube is net production of each leaf type per country and month with
+its factor and emissions; it is built once per run and sliced by the reports and the dashboard.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+from config import (EMISSIONS_FACTORS, EMISSIONS_FACTORS_CSV, CARBON_CUBE_PARQUET, PRODUCTION_BALANCE, MERGED_DATA_DIR,
+                    MERGED_DATA_CSV)
+from analytics.hierarchy import leaf_series
+from ingestion.store import read_merged
+
+# Factor for production types without one
+FALLBACK_FACTOR = EMISSIONS_FACTORS.get('Electricity', 300)
+FACTOR_COLUMNS = ["country", "production_type", "year", "kg_per_mwh"]
+
+
+def load_factor_table(path=EMISSIONS_FACTORS_CSV):
+    # Static per-type factors, then any country- or year-specific rows from the CSV
+    table = pd.DataFrame({"country": None, "production_type": list(EMISSIONS_FACTORS), "year": np.nan,
+                          "kg_per_mwh": list(EMISSIONS_FACTORS.values())}, columns=FACTOR_COLUMNS)
+    if os.path.exists(path):
+        table = pd.concat([table, pd.read_csv(path, dtype={"country": object, "production_type": object})[FACTOR_COLUMNS]],
+                          ignore_index=True)
+    return table
+
+
+def lookup_factors(df, table=None):
+    """
+    kg CO2 per MWh for each row of df, by production_type and, where df has them, country and month.
+    The most specific factor wins: country and year, then country, then year, then the type alone.
+    """
+    table = load_factor_table() if table is None else table
+    countries = pd.Categorical(df['country'].astype(str) if 'country' in df.columns else np.full(len(df), ""))
+    types = pd.Categorical(df['production_type'].astype(str))
+    years = df['month'].astype(str).str[:4].astype(int) if 'month' in df.columns else pd.Series(0, index=df.index)
+    year_codes, year_values = pd.factorize(years, sort=True)
+
+    factors = np.full((len(countries.categories), len(types.categories), len(year_values)), FALLBACK_FACTOR, dtype=float)
+    year_index = {year: i for i, year in enumerate(year_values)}
+    specificity = table["country"].notna() * 2 + table["year"].notna()
+    for row in table.assign(specificity=specificity).sort_values("specificity", kind="stable").itertuples():
+        t = types.categories.get_indexer([row.production_type])[0]
+        c = countries.categories.get_indexer([row.country])[0] if pd.notna(row.country) else slice(None)
+        y = year_index.get(int(row.year), -1) if pd.notna(row.year) else slice(None)
+        # Factors for types, countries or years that df does not contain
+        if -1 in (t, c, y):
+            continue
+        factors[c, t, y] = row.kg_per_mwh
+    return factors[countries.codes, types.codes, year_codes]
+
+
+def build_carbon_cube(df, table=None):
+    """
+    Net production of every leaf production type per country and month, with kg_per_mwh and carbon_kg.
+    Aggregate types are left out so that summing the cube never counts production twice.
+    """
+    production = leaf_series(df[df['Balance'] == PRODUCTION_BALANCE])
+    cube = production[["country", "month", "production_type", "value_gwh"]].astype(
+        {"country": str, "month": str, "production_type": str})
+    cube["kg_per_mwh"] = lookup_factors(cube, table)
+    cube["carbon_kg"] = cube["value_gwh"] * 1000 * cube["kg_per_mwh"]
+    cube = cube.sort_values(["country", "month", "production_type"], ignore_index=True)
+    return cube.astype({"country": "category", "production_type": "category"})
+
+
+def write_carbon_cube(cube, path=CARBON_CUBE_PARQUET):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    cube.to_parquet(path, index=False)
+
+
+def read_carbon_cube(path=CARBON_CUBE_PARQUET):
+    return pd.read_parquet(path) if os.path.exists(path) else None
+
+
+def read_or_build_carbon_cube(path=CARBON_CUBE_PARQUET, merged_path=MERGED_DATA_DIR, merged_csv=MERGED_DATA_CSV):
+    # The cube written by the reporting stage, or one built from the merged data where it has not been written
+    # (a fresh checkout only has the committed merged_data.csv); None when neither exists
+    cube = read_carbon_cube(path)
+    if cube is None and (os.path.isdir(merged_path) or os.path.exists(merged_csv)):
+        source = merged_path if os.path.isdir(merged_path) else merged_csv
+        cube = build_carbon_cube(read_merged(source, columns=["country", "month", "Balance", "production_type",
+                                                              "value_gwh"], balances=[PRODUCTION_BALANCE]))
+    return cube
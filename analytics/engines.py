@@ -0,0 +1,216 @@
+"""
+Lightweight forecasting engines that fit every series at once. Series are stacked into a (series x months)
+matrix and each engine works on whole rows with NumPy, so hundreds of series forecast in milliseconds.
+Output matches the Prophet path: fitted history plus the forecast horizon, with an 80% interval.
+"""
+import numpy as np
+import pandas as pd
+
+SEASON = 12
+# Two-sided z score for Prophet's default 80% interval
+Z_80 = 1.2815515655446004
+# Smoothing parameters searched per series by Holt-Winters
+HW_ALPHAS = (0.1, 0.3, 0.5, 0.8)
+HW_BETAS = (0.01, 0.1)
+HW_GAMMAS = (0.05, 0.2, 0.4)
+RIDGE_ALPHA = 1.0
+
+
+def matrix_positions(df, keys=("country", "production_type")):
+    """
+    Where each row of df falls in a (series x months) matrix. Returns (series keys sorted, months as a monthly
+    PeriodIndex covering every month in df, row series codes, row month columns).
+    """
+    # Parse each distinct month once and place rows by integer codes
+    month_codes, month_labels = pd.factorize(df['month'].astype(str))
+    parsed = pd.PeriodIndex(pd.to_datetime(month_labels), freq='M')
+    ordinal = (parsed.year * 12 + parsed.month - 1).to_numpy()
+    first = ordinal.min()
+    months = pd.period_range(parsed[ordinal.argmin()], periods=ordinal.max() - first + 1, freq='M')
+    # Combine per-column codes into one integer per series; sorted codes give the keys in sorted order
+    combined = np.zeros(len(df), dtype=np.int64)
+    levels = []
+    for key in keys:
+        codes, labels = pd.factorize(df[key].astype(str), sort=True)
+        combined = combined * len(labels) + codes
+        levels.append(labels)
+    series_codes, uniques = pd.factorize(combined, sort=True)
+    parts = []
+    for labels in reversed(levels):
+        uniques, codes = np.divmod(uniques, len(labels))
+        parts.append(np.asarray(labels)[codes])
+    series_keys = list(zip(*reversed(parts)))
+    return series_keys, months, series_codes, ordinal[month_codes] - first
+
+
+def series_matrix(df, weather_cols=()):
+    """
+    Pivots long production rows into Y (series x months) and, for regressors, W (series x months x regressors).
+    Returns (keys, months, Y, W) where keys are sorted (country, production_type) tuples and months a monthly
+    PeriodIndex covering every month in df; gaps are NaN.
+    """
+    keys, months, series_codes, column = matrix_positions(df)
+    Y = np.full((len(keys), len(months)), np.nan)
+    values = df['value_gwh'].to_numpy(dtype=float)
+    observed = ~np.isnan(values)
+    Y[series_codes[observed], column[observed]] = values[observed]
+    W = None
+    if weather_cols:
+        W = np.full((len(keys), len(months), len(weather_cols)), np.nan)
+        W[series_codes, column, :] = df[list(weather_cols)].to_numpy(dtype=float)
+    return keys, months, Y, W
+
+
+def _fill_gaps(Y):
+    # Interpolate inside each series and carry the ends outward; the recursive engines need complete rows
+    return pd.DataFrame(Y).interpolate(axis=1, limit_direction='both').to_numpy()
+
+
+def seasonal_naive(Y, periods, season=SEASON):
+    """
+    Each month repeats the value from one season earlier. The interval widens with the number of seasons
+    ahead, from the spread of the year-over-year differences.
+    """
+    Y = _fill_gaps(Y)
+    n_series, n_months = Y.shape
+    season = min(season, n_months)
+    fitted = np.full_like(Y, np.nan)
+    fitted[:, season:] = Y[:, :-season]
+    horizon = np.arange(periods)
+    future = Y[:, n_months - season + horizon % season]
+    sigma = np.nanstd(Y[:, season:] - Y[:, :-season], axis=1) if n_months > season else np.zeros(n_series)
+    width = np.zeros((n_series, n_months + periods))
+    width[:, n_months:] = Z_80 * sigma[:, None] * np.sqrt(horizon // season + 1)
+    width[:, :n_months] = Z_80 * sigma[:, None]
+    return np.concatenate([fitted, future], axis=1), width
+
+
+def holt_winters(Y, periods, season=SEASON):
+    """
+    Additive Holt-Winters (ETS A,A,A). Every series is run for every (alpha, beta, gamma) on a small grid in
+    one pass over time, and each series keeps the combination with the lowest one-step squared error.
+    """
+    Y = _fill_gaps(Y)
+    n_series, n_months = Y.shape
+    if n_months < 2 * season:
+        return seasonal_naive(Y, periods, season)
+    grid = np.array([(a, b, g) for a in HW_ALPHAS for b in HW_BETAS for g in HW_GAMMAS])
+    alpha, beta, gamma = (grid[:, i][None, :] for i in range(3))
+    # Initial state from the first two seasons, broadcast over the grid: (series, grid)
+    level = np.repeat(Y[:, :season].mean(axis=1, keepdims=True), len(grid), axis=1)
+    trend = np.repeat(((Y[:, season:2 * season].mean(axis=1) - Y[:, :season].mean(axis=1)) / season)[:, None],
+                      len(grid), axis=1)
+    seasonal = np.repeat((Y[:, :season] - Y[:, :season].mean(axis=1, keepdims=True))[:, :, None], len(grid), axis=2)
+    fitted = np.empty((n_series, len(grid), n_months))
+    for t in range(n_months):
+        s = seasonal[:, t % season, :]
+        fitted[:, :, t] = level + trend + s
+        y = Y[:, t][:, None]
+        new_level = alpha * (y - s) + (1 - alpha) * (level + trend)
+        trend = beta * (new_level - level) + (1 - beta) * trend
+        seasonal[:, t % season, :] = gamma * (y - new_level) + (1 - gamma) * s
+        level = new_level
+    errors = Y[:, None, :] - fitted
+    sse = np.sum(errors[:, :, season:] ** 2, axis=2)
+    best = np.argmin(sse, axis=1)
+    rows = np.arange(n_series)
+    level, trend = level[rows, best], trend[rows, best]
+    seasonal = seasonal[rows, :, best]
+    alpha, beta, gamma = grid[best].T
+    sigma = np.sqrt(sse[rows, best] / max(n_months - season, 1))
+
+    h = np.arange(1, periods + 1)
+    future = level[:, None] + h[None, :] * trend[:, None] + seasonal[:, (n_months + h - 1) % season]
+    # Forecast variance of ETS(A,A,A): sigma^2 * (1 + sum_{j<h} c_j^2), c_j = alpha(1 + j beta) + gamma [j % m == 0]
+    j = np.arange(1, periods)
+    c = alpha[:, None] * (1 + j[None, :] * beta[:, None]) + gamma[:, None] * (j % season == 0)[None, :]
+    variance = np.concatenate([np.ones((n_series, 1)), 1 + np.cumsum(c ** 2, axis=1)], axis=1)
+    width = np.concatenate([np.repeat(Z_80 * sigma[:, None], n_months, axis=1),
+                            Z_80 * sigma[:, None] * np.sqrt(variance)], axis=1)
+    return np.concatenate([fitted[rows, best], future], axis=1), width
+
+
+def ridge(Y, periods, W=None, season=SEASON, months=None, alpha=RIDGE_ALPHA):
+    """
+    Ridge regression per series on a linear trend, month-of-year dummies and any weather regressors, solved for
+    all series at once as a batch of small normal equations. Missing months are left out of each series' fit.
+    Future weather is each country's average for that calendar month.
+    """
+    n_series, n_months = Y.shape
+    total = n_months + periods
+    start = months[0].month - 1 if months is not None else 0
+    t = np.arange(total) / max(n_months, 1)
+    month_of_year = (start + np.arange(total)) % season
+    dummies = (month_of_year[:, None] == np.arange(1, season)[None, :]).astype(float)
+    base = np.column_stack([np.ones(total), t, dummies])
+    X = np.repeat(base[None, :, :], n_series, axis=0)
+    if W is not None:
+        W_future = np.empty((n_series, periods, W.shape[2]))
+        for m in range(season):
+            history = W[:, month_of_year[:n_months] == m, :]
+            climate = np.nanmean(history, axis=1) if history.shape[1] else np.full((n_series, W.shape[2]), np.nan)
+            W_future[:, month_of_year[n_months:] == m, :] = climate[:, None, :]
+        W_all = np.concatenate([W, W_future], axis=1)
+        mean = np.nanmean(W, axis=1, keepdims=True)
+        std = np.nanstd(W, axis=1, keepdims=True)
+        std[std == 0] = 1
+        W_all = np.nan_to_num((W_all - mean) / std)
+        X = np.concatenate([X, W_all], axis=2)
+    observed = ~np.isnan(Y)
+    # Scale each series so one penalty suits series of any size
+    scale = np.nanmax(np.abs(Y), axis=1)
+    scale[~np.isfinite(scale) | (scale == 0)] = 1
+    y = np.where(observed, Y, 0) / scale[:, None]
+    Xh = X[:, :n_months, :] * observed[:, :, None]
+    penalty = alpha * np.eye(X.shape[2])
+    penalty[0, 0] = 0
+    XtX = np.einsum('stp,stq->spq', Xh, Xh) + penalty[None, :, :]
+    Xty = np.einsum('stp,st->sp', Xh, y)
+    coef = np.linalg.solve(XtX, Xty[:, :, None])[:, :, 0]
+    yhat = np.einsum('stp,sp->st', X, coef) * scale[:, None]
+    residuals = np.where(observed, Y - yhat[:, :n_months], np.nan)
+    dof = np.maximum(observed.sum(axis=1) - X.shape[2], 1)
+    sigma = np.sqrt(np.nansum(residuals ** 2, axis=1) / dof)
+    width = np.repeat(Z_80 * sigma[:, None], total, axis=1)
+    return yhat, width
+
+
+ENGINES = {
+    "seasonal_naive": seasonal_naive,
+    "holt_winters": holt_winters,
+    "ridge": ridge,
+}
+
+
+def forecast_matrix(df, engine, periods=12, weather_cols=()):
+    """
+    Forecasts every (country, production_type) series in df with one of ENGINES and returns rows of
+    country, ds, yhat, yhat_lower, yhat_upper, production_type: fitted history, then periods months ahead.
+    Weather regressors are used by the ridge engine only.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown forecasting engine '{engine}'. Choose from: {', '.join(ENGINES)}.")
+    if df.empty:
+        return None
+    keys, months, Y, W = series_matrix(df, weather_cols if engine == "ridge" else ())
+    # Same minimum as the Prophet path: at least two observed months
+    usable = np.sum(~np.isnan(Y), axis=1) >= 2
+    keys = [key for key, keep in zip(keys, usable) if keep]
+    Y = Y[usable]
+    if not keys:
+        return None
+    if engine == "ridge":
+        yhat, width = ridge(Y, periods, W[usable] if W is not None else None, months=months)
+    else:
+        yhat, width = ENGINES[engine](Y, periods)
+    ds = pd.period_range(months[0], periods=len(months) + periods, freq='M').to_timestamp()
+    n_steps = len(ds)
+    countries, types = zip(*keys)
+    return pd.DataFrame({
+        "country": np.repeat(countries, n_steps),
+        "ds": np.tile(ds, len(keys)),
+        "yhat": yhat.ravel(),
+        "yhat_lower": (yhat - width).ravel(),
+        "yhat_upper": (yhat + width).ravel(),
+        "production_type": np.repeat(types, n_steps),
+    })
@@ -0,0 +1,208 @@
+"""
+Plotly figures for the dashboard. The builders take the pipeline outputs as frames and return a figure (or None
+when the data is missing); the dashboard calls them for filtered views. After every run the pipeline builds the
+unfiltered figures once and writes them as JSON specs to FIGURES_DIR with a manifest recording the spec version,
+the Plotly version and the modification times of the outputs each figure was built from. A prebuilt figure is
+only served while all three still match.
+"""
+import json
+import os
+import tempfile
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import plotly
+import plotly.express as px
+import plotly.io as pio
+from config import (ANOMALIES_CSV, CARBON_CUBE_PARQUET, FORECAST_RESULTS_CSV, FORECAST_BY_TYPE_CSV, FIGURES_DIR,
+                    DASHBOARD_MAX_POINTS)
+from analytics.carbon import read_or_build_carbon_cube
+from analytics.utils import downsample
+
+# Bump when a builder changes so that figures from older runs are rebuilt instead of served
+FIGURES_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+
+
+def anomalies_figure(anomalies):
+    if anomalies.empty:
+        return None
+    if 'zscore' in anomalies.columns:
+        return px.bar(
+            anomalies,
+            x='month',
+            y='zscore',
+            color=anomalies['anomaly'].map({True: 'Anomaly', False: 'Normal'}),
+            barmode='group',
+            facet_col='production_type' if 'production_type' in anomalies.columns else None,
+            title='Z-Score of Power Data by Month (Anomalies Highlighted)',
+            labels={'zscore': 'Z-Score', 'month': 'Month', 'color': 'Status'}
+        )
+    anomalies_true = anomalies[anomalies['anomaly'] == True]
+    if anomalies_true.empty:
+        return None
+    anomalies_count = anomalies_true.groupby(['month', 'production_type']).size().reset_index(name='anomaly_count')
+    return px.bar(anomalies_count, x='month', y='anomaly_count', color='production_type',
+                  title='Count of Detected Anomalies in Power Data',
+                  labels={'anomaly_count': 'Anomaly Count', 'month': 'Month', 'production_type': 'Production Type'})
+
+
+def carbon_figure(cube):
+    if cube.empty:
+        return None
+    monthly = cube.groupby('month', as_index=False)['carbon_kg'].sum()
+    return px.bar(
+        monthly,
+        x='month',
+        y='carbon_kg',
+        barmode='group',
+        title='Monthly Carbon Emissions',
+        labels={'carbon_kg': 'Carbon Emissions (kg)', 'month': 'Month'}
+    )
+
+
+def forecast_total_figure(forecast_total, max_points=DASHBOARD_MAX_POINTS):
+    if 'ds' not in forecast_total.columns or 'yhat' not in forecast_total.columns:
+        return None
+    forecast_total = downsample(forecast_total, 'ds', 'yhat', max_points)
+    fig_forecast_total = px.line(
+        forecast_total,
+        x='ds',
+        y='yhat',
+        title='Total Power Forecast',
+        labels={'yhat': 'Forecasted Power (GWh)', 'ds': 'Month'}
+    )
+    if 'yhat_upper' in forecast_total.columns and 'yhat_lower' in forecast_total.columns:
+        fig_forecast_total.add_traces([
+            px.line(forecast_total, x='ds', y='yhat_upper').data[0],
+            px.line(forecast_total, x='ds', y='yhat_lower').data[0]
+        ])
+        fig_forecast_total.data[1].name = 'Upper Bound'
+        fig_forecast_total.data[2].name = 'Lower Bound'
+    return fig_forecast_total
+
+
+def forecast_type_figure(forecast_type, max_points=DASHBOARD_MAX_POINTS):
+    if not {'ds', 'yhat', 'production_type'}.issubset(forecast_type.columns):
+        return None
+    forecast_type = downsample(forecast_type, 'ds', 'yhat', max_points, by='production_type')
+    fig_forecast_type = px.line(
+        forecast_type,
+        x='ds',
+        y='yhat',
+        color='production_type',
+        title='Power Forecast by Production Type',
+        labels={'yhat': 'Forecasted Power (GWh)', 'ds': 'Month', 'production_type': 'Production Type'}
+    )
+    if 'yhat_upper' in forecast_type.columns and 'yhat_lower' in forecast_type.columns:
+        # Every bound of every type in one long frame and one px call, one trace per (type, bound)
+        bounds = forecast_type.melt(id_vars=['ds', 'production_type'], value_vars=['yhat_upper', 'yhat_lower'],
+                                    var_name='bound', value_name='value')
+        bounds['bound'] = bounds['production_type'].astype(str) + bounds['bound'].map(
+            {'yhat_upper': ' Upper Bound', 'yhat_lower': ' Lower Bound'})
+        # Upper then lower bound of each type in turn, types in order of appearance
+        bounds = bounds.iloc[np.argsort(pd.factorize(bounds['production_type'])[0], kind='stable')]
+        fig_forecast_type.add_traces(px.line(bounds, x='ds', y='value', color='bound').data)
+    return fig_forecast_type
+
+
+def forecasted_carbon_figure(forecast_total, cube, max_points=DASHBOARD_MAX_POINTS):
+    if forecast_total.empty or 'ds' not in forecast_total.columns or 'yhat' not in forecast_total.columns:
+        return None
+    # Average intensity (kg per GWh) of the cube
+    production = cube['value_gwh'].sum() if not cube.empty else 0
+    avg_carbon_intensity = cube['carbon_kg'].sum() / production if production > 0 else 0
+    forecasted_carbon = downsample(forecast_total, 'ds', 'yhat', max_points)
+    forecasted_carbon['forecasted_carbon_kg'] = forecasted_carbon['yhat'] * avg_carbon_intensity
+    return px.line(
+        forecasted_carbon,
+        x='ds',
+        y='forecasted_carbon_kg',
+        title='Forecasted Carbon Emissions',
+        labels={'forecasted_carbon_kg': 'Forecasted Carbon Emissions (kg)', 'ds': 'Month'}
+    )
+
+
+# Prebuilt figure -> (builder, pipeline outputs it reads, in the builder's argument order)
+FIGURES = {
+    'anomalies': (anomalies_figure, (ANOMALIES_CSV,)),
+    'carbon': (carbon_figure, (CARBON_CUBE_PARQUET,)),
+    'forecast_total': (forecast_total_figure, (FORECAST_RESULTS_CSV,)),
+    'forecast_type': (forecast_type_figure, (FORECAST_BY_TYPE_CSV,)),
+    'forecasted_carbon': (forecasted_carbon_figure, (FORECAST_RESULTS_CSV, CARBON_CUBE_PARQUET)),
+}
+
+
+def read_source(path):
+    # Pipeline outputs read exactly as the dashboard reads them; missing ones are empty frames
+    if path.endswith(".parquet"):
+        cube = read_or_build_carbon_cube(path)
+        return cube if cube is not None else pd.DataFrame()
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    return pd.read_csv(path)
+
+
+def source_versions(paths):
+    return {os.path.basename(path): os.path.getmtime(path) if os.path.exists(path) else None for path in paths}
+
+
+def read_manifest(output_dir=FIGURES_DIR):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_atomic(path, text):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def build_figures(output_dir=FIGURES_DIR, figures=FIGURES):
+    """
+    Builds every figure from the pipeline outputs on disk and writes <name>.json plus the manifest, which is
+    replaced last so readers never see it point at a half-written set. Returns the names that were written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    frames, entries = {}, {}
+    for name, (builder, sources) in figures.items():
+        for path in sources:
+            if path not in frames:
+                frames[path] = read_source(path)
+        fig = builder(*(frames[path] for path in sources))
+        if fig is None:
+            continue
+        write_atomic(os.path.join(output_dir, f"{name}.json"), fig.to_json())
+        entries[name] = {"file": f"{name}.json", "sources": source_versions(sources)}
+    for name in set(read_manifest(output_dir).get("figures", {})) - set(entries):
+        if os.path.exists(os.path.join(output_dir, f"{name}.json")):
+            os.remove(os.path.join(output_dir, f"{name}.json"))
+    manifest = {"version": FIGURES_VERSION, "plotly": plotly.__version__,
+                "built_at": datetime.now(timezone.utc).isoformat(timespec="seconds"), "figures": entries}
+    write_atomic(os.path.join(output_dir, MANIFEST_NAME), json.dumps(manifest, indent=2, sort_keys=True))
+    print(f"Saved {len(entries)} dashboard figures to {output_dir}")
+    return sorted(entries)
+
+
+def load_figure(name, output_dir=FIGURES_DIR, figures=FIGURES):
+    # The prebuilt figure, or None when there is none or it no longer matches this code or its sources
+    manifest = read_manifest(output_dir)
+    entry = manifest.get("figures", {}).get(name)
+    if entry is None or manifest.get("version") != FIGURES_VERSION or manifest.get("plotly") != plotly.__version__:
+        return None
+    if entry["sources"] != source_versions(figures[name][1]):
+        return None
+    try:
+        with open(os.path.join(output_dir, entry["file"]), encoding="utf-8") as f:
+            return pio.from_json(f.read())
+    except (OSError, ValueError):
+        return None
+
+
+if __name__ == "__main__":
+    build_figures()
@@ -2,97 +2,231 @@
 """
 Handles all prediction and forecasting logic, including weather-aware forecasts.
 """
+import hashlib
+import multiprocessing
+import os
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from collections import Counter
+from contextlib import contextmanager
+
 import pandas as pd
 import numpy as np
-from prophet import Prophet
-from sqlalchemy import create_engine
-from config import MERGED_DATA_CSV, FORECAST_BY_TYPE_CSV, PROCESSED_WEATHER_COLS, DB_URI, FORECAST_RESULTS_CSV
-
-def predict_by_energy_type(input_csv=MERGED_DATA_CSV, output_csv=FORECAST_BY_TYPE_CSV, periods=12):
-    df = pd.read_csv(input_csv)
-    forecasts = []
-    for energy_type, group in df.groupby("production_type"):
-        group = group.rename(columns={"month": "ds", "value_gwh": "y"})
-        group = group.dropna(subset=["y", "ds"])
-        if len(group) < 2:
-            continue
+from prophet import Prophet, __version__ as prophet_version
+from config import (MERGED_DATA_DIR, FORECAST_BY_TYPE_CSV, PROCESSED_WEATHER_COLS,
+                    FORECAST_RESULTS_CSV, PRODUCTION_BALANCE, FORECAST_WORKERS, FORECAST_TIMEOUT, FORECAST_ENGINE,
+                    FORECAST_HIERARCHICAL)
+from analytics.model_cache import cached_fit
+from analytics.engines import forecast_matrix
+from analytics.hierarchy import leaf_series, add_aggregates
+from db.engine import read_query
+from ingestion.store import read_merged
+
+def production_series(df=None, input_path=MERGED_DATA_DIR, columns=("country", "month", "production_type", "value_gwh")):
+    # Production rows of the merged data, taken from an in-memory frame or read from the store
+    columns = list(columns)
+    if df is None:
+        return read_merged(input_path, columns=columns, balances=[PRODUCTION_BALANCE])
+    return df.loc[df['Balance'] == PRODUCTION_BALANCE, columns]
+
+def fit_model(make_model, history, series=None, spec=""):
+    # Reuses or warm-starts the cached model for a named series; unnamed series are always fitted from scratch
+    if series is None:
+        return make_model().fit(history), "cold"
+    return cached_fit(series, history, make_model, spec=f"prophet {prophet_version} {spec}".strip())
+
+def predict(model, future, series=None):
+    """
+    model.predict(future) with the interval sampling seeded from the series name. Prophet draws yhat_lower and
+    yhat_upper from numpy's global generator, so without a seed a cached model would give new bounds on every
+    run and every downstream output would look changed. The caller's generator state is restored afterwards.
+    """
+    state = np.random.get_state()
+    np.random.seed(int.from_bytes(hashlib.sha256(str(series).encode("utf-8")).digest()[:4], "big"))
+    try:
+        return model.predict(future)
+    finally:
+        np.random.set_state(state)
+
+def fit_prophet(group, periods, series=None):
+    model, status = fit_model(Prophet, group[["ds", "y"]], series)
+    future = model.make_future_dataframe(periods=periods, freq='M')
+    return predict(model, future, series), status
+
+def fit_prophet_with_weather(group, periods, series=None, weather_cols=PROCESSED_WEATHER_COLS):
+    def make_model():
         model = Prophet()
-        model.fit(group[["ds", "y"]])
-        future = model.make_future_dataframe(periods=periods, freq='M')
-        forecast = model.predict(future)
-        forecast["production_type"] = energy_type
-        forecasts.append(forecast[["ds", "yhat", "yhat_lower", "yhat_upper", "production_type"]])
-    if forecasts:
-        result = pd.concat(forecasts)
+        for col in weather_cols:
+            model.add_regressor(col)
+        return model
+    model, status = fit_model(make_model, group[["ds", "y"] + weather_cols], series, spec=" ".join(weather_cols))
+    future = model.make_future_dataframe(periods=periods, freq='M')
+    for col in weather_cols:
+        history_vals = group[col].values
+        last_val = history_vals[-1]
+        n_history = len(history_vals)
+        n_future = len(future)
+        if n_future > n_history:
+            future_vals = np.concatenate([
+                history_vals,
+                np.full(n_future - n_history, last_val)
+            ])
+        else:
+            future_vals = history_vals[:n_future]
+        future[col] = future_vals
+    return predict(model, future, series), status
+
+@contextmanager
+def series_timeout(seconds):
+    # SIGALRM interrupts a fit that runs too long; it needs Unix and the main thread of the process
+    if not seconds or not hasattr(signal, "SIGALRM") or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+    def handler(signum, frame):
+        raise TimeoutError(f"fit exceeded {seconds}s")
+    previous = signal.signal(signal.SIGALRM, handler)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+
+def run_series(task):
+    # Runs in a worker process; errors are returned rather than raised so one series cannot fail the batch
+    key, fit, group, periods, timeout = task
+    try:
+        with series_timeout(timeout):
+            forecast, status = fit(group, periods, series="/".join((fit.__name__,) + key))
+    except Exception as e:
+        return key, None, f"{type(e).__name__}: {e}"
+    return key, (forecast[["ds", "yhat", "yhat_lower", "yhat_upper"]], status), None
+
+def forecast_workers(n_series, max_workers=FORECAST_WORKERS):
+    if max_workers <= 0:
+        max_workers = os.cpu_count() or 1
+    return max(1, min(max_workers, n_series))
+
+def forecast_series(groups, fit, periods=12, max_workers=FORECAST_WORKERS, timeout=FORECAST_TIMEOUT):
+    """
+    Fits one model per (country, production_type) series with fit(group, periods) and returns the forecasts
+    with country and production_type columns, sorted by series and date whatever order the fits finish in.
+    Series run in a process pool; a series that fails or exceeds timeout seconds is reported and skipped.
+    fit(group, periods, series=...) returns (forecast, cache status) for the series named series.
+    """
+    tasks = [(key, fit, group, periods, timeout) for key, group in sorted(groups.items())]
+    workers = forecast_workers(len(tasks), max_workers)
+    if workers == 1:
+        results = [run_series(task) for task in tasks]
+    else:
+        # Fresh interpreters: the pipeline calls this from a worker thread, where forking is unsafe
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {executor.submit(run_series, task): task[0] for task in tasks}
+            results = []
+            for future in as_completed(futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append((futures[future], None, f"{type(e).__name__}: {e}"))
+    forecasts, statuses = [], Counter()
+    for (country, energy_type), output, error in sorted(results, key=lambda result: result[0]):
+        if error is not None:
+            print(f"Forecast failed for {country} / {energy_type}: {error}")
+            continue
+        forecast, status = output
+        statuses[status] += 1
+        forecasts.append(forecast.assign(country=country, production_type=energy_type))
+    print(f"Fitted {len(forecasts)} of {len(tasks)} series with {workers} worker(s) "
+          f"(cached: {statuses['hit']}, warm-started: {statuses['warm']}, from scratch: {statuses['cold']}).")
+    if not forecasts:
+        return None
+    return pd.concat(forecasts, ignore_index=True)[["country", "ds", "yhat", "yhat_lower", "yhat_upper", "production_type"]]
+
+def series_groups(df, required):
+    # One training frame per (country, production_type) with at least two usable rows
+    groups = {}
+    for key, group in df.groupby(["country", "production_type"], observed=True):
+        group = group.rename(columns={"month": "ds", "value_gwh": "y"})
+        group = group.dropna(subset=["y", "ds"] + required)
+        if len(group) >= 2:
+            groups[tuple(str(part) for part in key)] = group
+    return groups
+
+def forecast_by_type(df, periods, engine, hierarchical, weather_cols=()):
+    # engine is "prophet" or one of the matrix engines in analytics.engines; hierarchical forecasts
+    # only the leaf production types and sums them into the aggregates
+    if hierarchical:
+        df = leaf_series(df)
+    if engine == "prophet":
+        fit = fit_prophet_with_weather if weather_cols else fit_prophet
+        result = forecast_series(series_groups(df, list(weather_cols)), fit, periods)
+    else:
+        result = forecast_matrix(df, engine, periods, weather_cols=weather_cols)
+    if result is not None and hierarchical:
+        result = add_aggregates(result)
+    return result
+
+def predict_by_energy_type(input_path=MERGED_DATA_DIR, output_csv=FORECAST_BY_TYPE_CSV, periods=12, df=None,
+                           engine=FORECAST_ENGINE, hierarchical=FORECAST_HIERARCHICAL):
+    df = production_series(df, input_path)
+    result = forecast_by_type(df, periods, engine, hierarchical)
+    if result is not None:
         result.to_csv(output_csv, index=False)
         print(f"Saved forecasts by energy type to {output_csv}")
+        return result
     else:
         print("No forecasts generated. Check your data.")
 
-def predict_by_energy_type_with_weather(input_csv=MERGED_DATA_CSV, output_csv=FORECAST_BY_TYPE_CSV, periods=12):
-    df = pd.read_csv(input_csv)
-    forecasts = []
+def predict_by_energy_type_with_weather(input_path=MERGED_DATA_DIR, output_csv=FORECAST_BY_TYPE_CSV, periods=12, df=None,
+                                        engine=FORECAST_ENGINE, hierarchical=FORECAST_HIERARCHICAL):
     weather_cols = PROCESSED_WEATHER_COLS
-    for energy_type, group in df.groupby("production_type"):
-        group = group.rename(columns={"month": "ds", "value_gwh": "y"})
-        group = group.dropna(subset=["y", "ds"] + weather_cols)
-        if len(group) < 2:
-            continue
-        model = Prophet()
-        for col in weather_cols:
-            model.add_regressor(col)
-        model.fit(group[["ds", "y"] + weather_cols])
-        future = model.make_future_dataframe(periods=periods, freq='M')
-        for col in weather_cols:
-            history_vals = group[col].values
-            last_val = history_vals[-1]
-            n_history = len(history_vals)
-            n_future = len(future)
-            if n_future > n_history:
-                future_vals = np.concatenate([
-                    history_vals,
-                    np.full(n_future - n_history, last_val)
-                ])
-            else:
-                future_vals = history_vals[:n_future]
-            future[col] = future_vals
-        forecast = model.predict(future)
-        forecast["production_type"] = energy_type
-        forecasts.append(forecast[["ds", "yhat", "yhat_lower", "yhat_upper", "production_type"]])
-    if forecasts:
-        result = pd.concat(forecasts)
+    df = production_series(df, input_path, columns=["country", "month", "production_type", "value_gwh"] + weather_cols)
+    result = forecast_by_type(df, periods, engine, hierarchical, weather_cols)
+    if result is not None:
         result.to_csv(output_csv, index=False)
         print(f"Saved forecasts by energy type (with weather) to {output_csv}")
+        return result
     else:
         print("No forecasts generated. Check your data.")
 
 def fetch_consumption(country="France"):
-    engine = create_engine(DB_URI)
-    query = f"""
+    query = """
         SELECT month, total_consumption_gwh
         FROM consumption_data
-        WHERE country = '{country}'
+        WHERE country = :country
         ORDER BY month
     """
-    df = pd.read_sql(query, engine)
+    df = read_query(query, {"country": country})
     df = df.rename(columns={"month": "ds", "total_consumption_gwh": "y"})
     df = df.dropna(subset=["y"])
     return df
 
-def predict_peak(df, periods=12):
-    model = Prophet()
-    model.fit(df)
+def predict_peak(df, periods=12, series=None):
+    model, status = fit_model(Prophet, df[["ds", "y"]], series)
+    print(f"Consumption model: {status}.")
     future = model.make_future_dataframe(periods=periods, freq='M')
-    forecast = model.predict(future)
+    forecast = predict(model, future, series)
     return forecast[["ds", "yhat", "yhat_lower", "yhat_upper"]]
 
-if __name__ == "__main__":
-    predict_by_energy_type()
-    predict_by_energy_type_with_weather()
+def run_forecasts(merged=None):
+    """
+    Runs every forecast and returns them as a dict. by_type holds what forecast_by_type.csv ends up containing:
+    the weather variant when it produced forecasts, otherwise the plain one.
+    """
+    by_type = predict_by_energy_type(df=merged)
+    by_type_weather = predict_by_energy_type_with_weather(df=merged)
     # National-level forecast
     df = fetch_consumption("France")
     if len(df) < 2:
         raise ValueError("Not enough data to fit the model. Check your database and data extraction.")
-    forecast = predict_peak(df)
+    forecast = predict_peak(df, series="predict_peak/France")
     forecast.to_csv(FORECAST_RESULTS_CSV, index=False)
     print(forecast.tail())
+    return {
+        "by_type": by_type_weather if by_type_weather is not None else by_type,
+        "total": forecast
+    }
+
+if __name__ == "__main__":
+    run_forecasts()
@@ -0,0 +1,47 @@
+"""
+Production-type hierarchy. Aggregates such as Electricity are not forecast themselves: their leaf types are,
+and each aggregate forecast is the sum of its leaves, so totals always add up. Leaf errors are treated as
+independent, so an aggregate's interval half-width is the root of the sum of squared leaf half-widths.
+"""
+import numpy as np
+import pandas as pd
+from config import PRODUCTION_HIERARCHY
+
+
+def aggregate_leaves(hierarchy=PRODUCTION_HIERARCHY):
+    # Aggregate -> the leaf types it sums, expanding child aggregates
+    def leaves(production_type, seen=()):
+        if production_type in seen:
+            raise ValueError(f"Production hierarchy has a cycle through '{production_type}'")
+        if production_type not in hierarchy:
+            return {production_type}
+        return set().union(*(leaves(child, seen + (production_type,)) for child in hierarchy[production_type]))
+    return {aggregate: sorted(leaves(aggregate)) for aggregate in hierarchy}
+
+
+def leaf_series(df, hierarchy=PRODUCTION_HIERARCHY):
+    # The rows of df that are not aggregates
+    return df[~df["production_type"].astype(str).isin(hierarchy)]
+
+
+def add_aggregates(forecast, hierarchy=PRODUCTION_HIERARCHY):
+    """
+    Appends one forecast per (country, aggregate) to a forecast of leaf types, summed over whichever of the
+    aggregate's leaves were forecast for that country and month. Rows come back sorted like forecast_series.
+    """
+    columns = list(forecast.columns)
+    aggregates = []
+    for aggregate, leaves in aggregate_leaves(hierarchy).items():
+        rows = forecast[forecast["production_type"].isin(leaves)]
+        if rows.empty:
+            continue
+        rows = rows.assign(upper_sq=(rows["yhat_upper"] - rows["yhat"]) ** 2,
+                           lower_sq=(rows["yhat"] - rows["yhat_lower"]) ** 2)
+        summed = rows.groupby(["country", "ds"], as_index=False)[["yhat", "upper_sq", "lower_sq"]].sum(min_count=1)
+        summed["yhat_upper"] = summed["yhat"] + np.sqrt(summed["upper_sq"])
+        summed["yhat_lower"] = summed["yhat"] - np.sqrt(summed["lower_sq"])
+        aggregates.append(summed.assign(production_type=aggregate)[columns])
+    if not aggregates:
+        return forecast
+    return pd.concat([forecast] + aggregates, ignore_index=True).sort_values(
+        ["country", "production_type", "ds"], ignore_index=True)
@@ -0,0 +1,130 @@
+"""
+On-disk cache of fitted Prophet models. Each series keeps its newest few fits as Prophet JSON, keyed by a
+hash of the training data and model spec. An unchanged series reuses its model without refitting; a series
+that only gained observations (the last cached month may have been revised, as the watermark month always
+is) is refit starting from the previous model's parameters, which converges in a fraction of the iterations.
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+from prophet.serialize import model_to_json, model_from_json
+from config import FORECAST_MODEL_DIR, FORECAST_MODEL_KEEP
+
+
+def history_hash(history, spec=""):
+    h = hashlib.sha256(spec.encode("utf-8"))
+    h.update(repr(list(history.columns)).encode("utf-8"))
+    h.update(pd.util.hash_pandas_object(history.reset_index(drop=True), index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def series_dir(cache_dir, series):
+    return os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]+", "_", series))
+
+
+def load_index(directory):
+    try:
+        with open(os.path.join(directory, "index.json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def _write_atomic(directory, name, text):
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, os.path.join(directory, name))
+
+
+def stan_init(model):
+    # Fitted parameters in the form Prophet.fit(init=...) expects
+    init = {name: model.params[name][0][0] for name in ["k", "m", "sigma_obs"]}
+    init.update({name: model.params[name][0] for name in ["delta", "beta"]})
+    return init
+
+
+def warm_start_init(previous, history, make_model):
+    # Previous parameters fit only if the new model has as many changepoints and seasonality features;
+    # both grow with the history while it is short, and Stan rejects an init of the wrong shape
+    inputs = make_model().preprocess(history)
+    init = stan_init(previous)
+    if len(init["delta"]) != inputs.S or len(init["beta"]) != inputs.K:
+        return None
+    return init
+
+
+def _load_model(directory, entry):
+    try:
+        with open(os.path.join(directory, entry["file"]), encoding="utf-8") as f:
+            return model_from_json(f.read())
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def cached_fit(series, history, make_model, spec="", cache_dir=FORECAST_MODEL_DIR, keep=FORECAST_MODEL_KEEP):
+    """
+    Returns (model, status) for history, a frame of ds, y and any regressors. make_model() builds the unfitted
+    Prophet; spec describes its configuration and is part of the key. status is "hit" when the cached model was
+    reused, "warm" when refit from the previous parameters and "cold" for a fit from scratch.
+    """
+    directory = series_dir(cache_dir, series)
+    os.makedirs(directory, exist_ok=True)
+    index = load_index(directory)
+    key = history_hash(history, spec)
+
+    for entry in index:
+        if entry["hash"] == key:
+            model = _load_model(directory, entry)
+            if model is not None:
+                entry["used"] = time.time()
+                _save_index(directory, index, keep)
+                return model, "hit"
+
+    model, status = None, "cold"
+    for entry in sorted(index, key=lambda entry: entry["used"], reverse=True):
+        rows = entry["rows"]
+        # Appended observations: everything but the previous fit's last row is unchanged
+        if entry["spec"] == spec and len(history) >= rows and history_hash(history.iloc[:rows - 1], spec) == entry["prefix"]:
+            previous = _load_model(directory, entry)
+            if previous is None:
+                continue
+            init = warm_start_init(previous, history, make_model)
+            if init is not None:
+                try:
+                    model = make_model().fit(history, init=init)
+                    status = "warm"
+                except Exception:
+                    model = None
+            break
+    if model is None:
+        model = make_model().fit(history)
+
+    name = f"{key[:16]}.json"
+    _write_atomic(directory, name, model_to_json(model))
+    index = [entry for entry in index if entry["hash"] != key]
+    index.append({"hash": key, "prefix": history_hash(history.iloc[:len(history) - 1], spec), "rows": len(history),
+                  "spec": spec, "file": name, "used": time.time()})
+    _save_index(directory, index, keep)
+    return model, status
+
+
+def _save_index(directory, index, keep):
+    # Keep the most recently used versions and delete the model files of the rest
+    index = sorted(index, key=lambda entry: entry["used"], reverse=True)
+    for entry in index[keep:]:
+        try:
+            os.remove(os.path.join(directory, entry["file"]))
+        except OSError:
+            pass
+    _write_atomic(directory, "index.json", json.dumps(index[:keep], indent=2))
+
+
+def clear_cache(cache_dir=FORECAST_MODEL_DIR):
+    shutil.rmtree(cache_dir, ignore_errors=True)
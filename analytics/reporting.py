@@ -1,35 +1,264 @@
 """
 Handles all analytics, anomaly detection, carbon tracking, and reporting logic.
 """
+import argparse
+import json
 import pandas as pd
 import numpy as np
 import os
 import shutil
-from config import EMISSIONS_FACTORS, MERGED_DATA_CSV, ANOMALIES_CSV, CARBON_REPORT_CSV, TABLEAU_EXPORT_DIR, FORECAST_BY_TYPE_CSV, PROCESSED_WEATHER_COLS
+import tempfile
+import warnings
+from numpy.lib.stride_tricks import sliding_window_view
+from analytics.engines import matrix_positions
+from analytics.carbon import lookup_factors, build_carbon_cube, write_carbon_cube
+from ingestion.store import read_merged
+from ingestion.watermarks import upsert_rows
+from config import (MERGED_DATA_DIR, ANOMALIES_CSV, CARBON_REPORT_CSV, CARBON_CUBE_PARQUET, TABLEAU_EXPORT_DIR,
+                    FORECAST_BY_TYPE_CSV, PROCESSED_WEATHER_COLS, ANOMALY_WINDOW, ANOMALY_THRESHOLD, ANOMALY_STATE_JSON,
+                    ANOMALY_DETECTORS, PRODUCTION_BALANCE)
 
-def detect_anomalies(df, window=12, threshold=3):
-    df = df.copy()
-    df['zscore'] = (df['value_gwh'] - df['value_gwh'].rolling(window).mean()) / df['value_gwh'].rolling(window).std()
-    df['anomaly'] = df['zscore'].abs() > threshold
-    return df[df['anomaly']]
+# Each (country, Balance, production_type) is a separate series for anomaly detection
+SERIES_KEYS = ["country", "Balance", "production_type"]
+ANOMALY_COLUMNS = ["country", "month", "Balance", "production_type", "value_gwh"]
+# Scales a median absolute deviation to the standard deviation of normal data
+MAD_SCALE = 1.4826
+
+def rolling_windows(Y, window):
+    # (series, months, window) view of the window ending at each month; incomplete windows contain NaN
+    padded = np.concatenate([np.full((Y.shape[0], window - 1), np.nan), Y], axis=1)
+    return sliding_window_view(padded, window, axis=1)
+
+def zscore_detector(Y, months, window):
+    windows = rolling_windows(Y, window)
+    return (Y - windows.mean(axis=2)) / windows.std(axis=2, ddof=1)
+
+def mad_detector(Y, months, window):
+    # Robust z score: distance from the rolling median in units of the rolling MAD
+    windows = rolling_windows(Y, window)
+    median = np.median(windows, axis=2)
+    mad = np.median(np.abs(windows - median[:, :, None]), axis=2) * MAD_SCALE
+    return (Y - median) / np.where(mad > 0, mad, np.nan)
+
+def shift_months(Y, months):
+    return np.concatenate([np.full((Y.shape[0], months), np.nan), Y[:, :-months]], axis=1)
+
+def seasonal_detector(Y, months, window, season=12, years=3):
+    """
+    Change from the median of the same calendar month over the previous years, less the series' typical change
+    over the preceding season, as a robust z score over the series' history. Regular winter peaks cancel out,
+    and a one-off spike moves neither the baseline nor the typical change.
+    """
+    baseline = np.nanmedian(np.stack([shift_months(Y, season * year) for year in range(1, years + 1)]), axis=0)
+    change = Y - baseline
+    typical = np.nanmedian(rolling_windows(shift_months(change, 1), season), axis=2)
+    residual = change - typical
+    center = np.nanmedian(residual, axis=1, keepdims=True)
+    spread = np.nanmedian(np.abs(residual - center), axis=1, keepdims=True) * MAD_SCALE
+    return (residual - center) / np.where(spread > 0, spread, np.nan)
+
+DETECTORS = {
+    "zscore": zscore_detector,
+    "mad": mad_detector,
+    "seasonal": seasonal_detector,
+}
+# Detectors that only look back window months, so they can score new months from the saved state
+ROLLING_DETECTORS = {"zscore", "mad"}
+
+def score_series(df, window=ANOMALY_WINDOW, threshold=ANOMALY_THRESHOLD, detectors=ANOMALY_DETECTORS):
+    """
+    Scores every row of df with each detector, over all series at once on a (series x month) array.
+    zscore is the strongest detector score for the row, detector the one that gave it, and anomaly whether
+    any detector exceeded threshold. Rows come back sorted by series and month.
+    """
+    unknown = [name for name in detectors if name not in DETECTORS]
+    if unknown or not detectors:
+        raise ValueError(f"Unknown anomaly detectors: {', '.join(unknown) or '(none given)'}. Choose from: {', '.join(DETECTORS)}.")
+    df = df.sort_values(SERIES_KEYS + ["month"], kind="stable").reset_index(drop=True)
+    if df.empty:
+        return df.assign(zscore=pd.Series(dtype=float), detector=pd.Series(dtype=object), anomaly=pd.Series(dtype=bool))
+    keys, months, series_codes, column = matrix_positions(df, SERIES_KEYS)
+    Y = np.full((len(keys), len(months)), np.nan)
+    Y[series_codes, column] = df["value_gwh"].to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"), warnings.catch_warnings():
+        # All-NaN months and series are expected and simply score NaN
+        warnings.simplefilter("ignore", RuntimeWarning)
+        scores = np.stack([DETECTORS[name](Y, months, window) for name in detectors])
+    magnitude = np.where(np.isnan(scores), -1, np.abs(scores))
+    strongest = magnitude.argmax(axis=0)
+    zscore = np.take_along_axis(scores, strongest[None], axis=0)[0]
+    flagged = magnitude.max(axis=0) > threshold
+    return df.assign(zscore=zscore[series_codes, column],
+                     detector=np.where(np.isnan(zscore), None, np.asarray(detectors, dtype=object)[strongest])[series_codes, column],
+                     anomaly=flagged[series_codes, column])
+
+def detect_anomalies(df, window=ANOMALY_WINDOW, threshold=ANOMALY_THRESHOLD, detectors=ANOMALY_DETECTORS):
+    df = score_series(df, window, threshold, detectors)
+    return df[df['anomaly']].reset_index(drop=True)
+
+def build_anomaly_state(df, window=ANOMALY_WINDOW, threshold=ANOMALY_THRESHOLD, detectors=ANOMALY_DETECTORS):
+    """
+    Rolling state of every series in df: its last window months and values. That is all the history needed to
+    score the following months, or to rescore the last one if it is revised.
+    """
+    recent = df.sort_values(SERIES_KEYS + ["month"], kind="stable").groupby(SERIES_KEYS, observed=True).tail(window)
+    series = {}
+    for key, group in recent.groupby(SERIES_KEYS, observed=True):
+        series[tuple(str(part) for part in key)] = {"months": group["month"].astype(str).tolist(),
+                                                     "values": group["value_gwh"].astype(float).tolist()}
+    return {"window": window, "threshold": threshold, "detectors": list(detectors), "series": series}
+
+def load_anomaly_state(path=ANOMALY_STATE_JSON):
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    series = {tuple(entry["key"]): {"months": entry["months"], "values": entry["values"]} for entry in data["series"]}
+    return {"window": data["window"], "threshold": data["threshold"], "detectors": data.get("detectors", ["zscore"]),
+            "series": series}
+
+def save_anomaly_state(state, path=ANOMALY_STATE_JSON):
+    data = dict(state, series=[{"key": list(key), **entry} for key, entry in sorted(state["series"].items())])
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def state_start_month(state):
+    # Earliest month any series of state would rescore; rows before it are never needed
+    return min((entry["months"][-1] for entry in state["series"].values()), default=None)
+
+def score_new_months(df, state):
+    """
+    Scores the rows of df from each series' last state month onwards against that series' stored values and
+    returns (scored rows, updated state, number of series without state). Earlier months are taken as final,
+    as with the ingestion watermarks; the last state month itself is rescored, since it may have been revised.
+    Series without state are not scored, and only count when they have rows from state_start_month onwards.
+    """
+    window, threshold, detectors = state["window"], state["threshold"], state["detectors"]
+    last = pd.DataFrame([key + (entry["months"][-1],) for key, entry in state["series"].items()],
+                        columns=SERIES_KEYS + ["last_month"])
+    # Drop the final months first, so only the recent rows are converted and matched against the state
+    start = state_start_month(state)
+    if start is not None:
+        df = df[df["month"].astype(str) >= start]
+    rows = df.astype({col: str for col in SERIES_KEYS + ["month"]}).merge(last, on=SERIES_KEYS, how="left")
+    unknown = rows.loc[rows["last_month"].isna(), SERIES_KEYS].drop_duplicates()
+    new = rows[rows["last_month"].notna() & (rows["month"] >= rows["last_month"])].drop(columns="last_month")
+    if new.empty:
+        return score_series(new, window, threshold, detectors), state, len(unknown)
+
+    # Stored values before the first new month of each series, flagged so they are not scored again
+    history = []
+    for key, first in new.groupby(SERIES_KEYS)["month"].min().items():
+        entry = state["series"][key]
+        kept = [(month, value) for month, value in zip(entry["months"], entry["values"]) if month < first]
+        if kept:
+            months, values = zip(*kept)
+            history.append(pd.DataFrame(dict(zip(SERIES_KEYS, key), month=months, value_gwh=values, new_row=False)))
+    combined = pd.concat(history + [new.assign(new_row=True)], ignore_index=True)
+    combined = score_series(combined, window, threshold, detectors)
+    scored = combined[combined["new_row"]][list(new.columns) + ["zscore", "detector", "anomaly"]]
+
+    series = dict(state["series"])
+    for key, group in combined.groupby(SERIES_KEYS).tail(window).groupby(SERIES_KEYS):
+        series[key] = {"months": group["month"].tolist(), "values": group["value_gwh"].astype(float).tolist()}
+    return scored.reset_index(drop=True), dict(state, series=series), len(unknown)
+
+def update_anomalies(df, rebuild=False, window=ANOMALY_WINDOW, threshold=ANOMALY_THRESHOLD, detectors=ANOMALY_DETECTORS,
+                     state_path=ANOMALY_STATE_JSON, anomalies_csv=ANOMALIES_CSV, merged_dir=MERGED_DATA_DIR):
+    """
+    Brings anomalies_csv up to date with df. With saved state for the same settings, and only rolling detectors,
+    just the new months are scored and merged in; otherwise, or with rebuild, every series is scored from scratch.
+    With df None the rows are read from merged_dir: from the state's start month onwards when scoring
+    incrementally, and in full only when everything is rescored.
+    """
+    settings = (window, threshold, list(detectors))
+    incremental = not rebuild and set(detectors) <= ROLLING_DETECTORS and os.path.exists(anomalies_csv)
+    state = load_anomaly_state(state_path) if incremental else None
+    if state is not None and (state["window"], state["threshold"], state["detectors"]) != settings:
+        state = None
+    if state is not None:
+        recent = df if df is not None else read_merged(merged_dir, columns=ANOMALY_COLUMNS,
+                                                       start_month=state_start_month(state))
+        scored, state, unknown = score_new_months(recent, state)
+        if unknown:
+            print(f"{unknown} series have no anomaly state yet; rescoring everything.")
+            state = None
+    if state is None:
+        if df is None:
+            df = read_merged(merged_dir, columns=ANOMALY_COLUMNS)
+        anomalies = detect_anomalies(df, window, threshold, detectors)
+        state = build_anomaly_state(df, window, threshold, detectors)
+        print(f"Scored {len(df)} rows of {len(state['series'])} series from scratch.")
+    else:
+        # A rescored month replaces its earlier result, whether or not it is still anomalous
+        existing = pd.read_csv(anomalies_csv)
+        anomalies = upsert_rows(existing, scored, keys=SERIES_KEYS + ["month"])
+        anomalies = anomalies[anomalies["anomaly"].astype(bool)]
+        anomalies = anomalies.sort_values(SERIES_KEYS + ["month"], kind="stable").reset_index(drop=True)
+        print(f"Scored {len(scored)} new rows incrementally.")
+    save_anomaly_state(state, state_path)
+    anomalies.to_csv(anomalies_csv, index=False)
+    return anomalies
+
+def verify_anomaly_state(df, state_path=ANOMALY_STATE_JSON, anomalies_csv=ANOMALIES_CSV):
+    # Compares the saved state and anomalies with a rebuild from df; returns a list of differences
+    state = load_anomaly_state(state_path)
+    if state is None or not os.path.exists(anomalies_csv):
+        return ["no saved anomaly state"]
+    expected = build_anomaly_state(df, state["window"], state["threshold"], state["detectors"])
+    problems = []
+    for key in sorted(set(expected["series"]) | set(state["series"])):
+        saved, rebuilt = state["series"].get(key), expected["series"].get(key)
+        if saved is None or rebuilt is None:
+            problems.append(f"{' / '.join(key)}: {'missing from' if saved is None else 'not in the data but in'} the state")
+        elif saved["months"] != rebuilt["months"] or not np.allclose(saved["values"], rebuilt["values"], equal_nan=True):
+            problems.append(f"{' / '.join(key)}: stored values differ from the data")
+    key_columns = SERIES_KEYS + ["month"]
+    saved = set(pd.read_csv(anomalies_csv)[key_columns].astype(str).itertuples(index=False, name=None))
+    rebuilt = set(detect_anomalies(df, state["window"], state["threshold"], state["detectors"])[key_columns].astype(str).itertuples(index=False, name=None))
+    problems += [f"anomaly missing: {' / '.join(row)}" for row in sorted(rebuilt - saved)]
+    problems += [f"unexpected anomaly: {' / '.join(row)}" for row in sorted(saved - rebuilt)]
+    return problems
 
-def calculate_carbon(df):
+def calculate_carbon(df, factors=None):
+    # factors is a factor table as returned by analytics.carbon.load_factor_table
     df = df.copy()
-    df['emissions_factor'] = df['production_type'].map(EMISSIONS_FACTORS).fillna(EMISSIONS_FACTORS.get('Electricity', 300))
+    df['emissions_factor'] = lookup_factors(df, factors)
     df['carbon_kg'] = df['value_gwh'] * 1000 * df['emissions_factor']
     return df
 
-def main():
-    df = pd.read_csv(MERGED_DATA_CSV)
+def main(df=None, rebuild=False, detectors=ANOMALY_DETECTORS):
+    # Without df, anomaly detection reads only the months it rescores and the carbon cube only net production
+    if df is not None:
+        df = df[ANOMALY_COLUMNS]
     # Anomaly Detection
-    anomalies = detect_anomalies(df)
-    anomalies.to_csv(ANOMALIES_CSV, index=False)
+    anomalies = update_anomalies(df, rebuild=rebuild, detectors=detectors)
     print(f"Anomalies saved to {ANOMALIES_CSV}: {len(anomalies)} records.")
-    # Carbon Tracking
-    carbon_df = calculate_carbon(df)
-    carbon_report = carbon_df.groupby('month').agg({'carbon_kg': 'sum'}).reset_index()
+    # Carbon Tracking: the cube covers net production of leaf types only, so nothing is counted twice
+    production = df if df is not None else read_merged(MERGED_DATA_DIR, columns=ANOMALY_COLUMNS,
+                                                       balances=[PRODUCTION_BALANCE])
+    cube = build_carbon_cube(production)
+    write_carbon_cube(cube)
+    carbon_report = cube.groupby('month').agg({'carbon_kg': 'sum'}).reset_index()
     carbon_report.to_csv(CARBON_REPORT_CSV, index=False)
-    print(f"Carbon report saved to {CARBON_REPORT_CSV}.")
+    print(f"Carbon report saved to {CARBON_REPORT_CSV}; carbon cube saved to {CARBON_CUBE_PARQUET}.")
+    return anomalies, carbon_report
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Anomaly detection and carbon reporting.")
+    parser.add_argument("--rebuild", action="store_true", help="Rescore every series and rebuild the anomaly state")
+    parser.add_argument("--verify", action="store_true", help="Check the anomaly state against a rebuild and exit")
+    parser.add_argument("--detectors", nargs="+", default=ANOMALY_DETECTORS, choices=list(DETECTORS))
+    args = parser.parse_args()
+    if args.verify:
+        problems = verify_anomaly_state(read_merged(MERGED_DATA_DIR, columns=ANOMALY_COLUMNS))
+        for problem in problems:
+            print(problem)
+        print("Anomaly state matches a rebuild." if not problems else f"{len(problems)} difference(s) found.")
+        raise SystemExit(1 if problems else 0)
+    main(rebuild=args.rebuild, detectors=args.detectors)
@@ -2,7 +2,14 @@ import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
-from config import EMISSIONS_FACTORS, PROCESSED_WEATHER_COLS
+from config import PROCESSED_WEATHER_COLS
+
+def parse_iea_months(values):
+    # IEA 'YY-Mon' labels repeat for every row of a month, so parse each distinct label once and map
+    values = pd.Series(values)
+    labels = pd.Series(values.dropna().unique()).astype(str)
+    periods = pd.to_datetime('20' + labels, format='%Y-%b').dt.to_period('M').astype(str)
+    return values.map(dict(zip(labels, periods))).astype(object)
 
 def clean_iea(df, countries):
     if 'Time' in df.columns:
@@ -18,10 +25,8 @@ def clean_iea(df, countries):
     if missing:
         raise ValueError(f"Missing required columns in IEA data: {missing}")
     df = df.dropna(subset=['month', 'country'])
-    def parse_custom_date(date_str):
-        return pd.to_datetime('20' + date_str, format='%Y-%b')
-    df['month'] = df['month'].apply(parse_custom_date).dt.to_period('M').astype(str)
-    df = df[df['country'].isin(countries)]
+    df = df[df['country'].isin(countries)].copy()
+    df['month'] = parse_iea_months(df['month'])
     return df
 
 def clean_weather(df, countries):
@@ -45,18 +50,6 @@ def merge_data(iea_df, weather_df):
         merged = merged.rename(columns={'Value': 'value_gwh'})
     return merged
 
-def detect_anomalies(df, window=12, threshold=3):
-    df = df.copy()
-    df['zscore'] = (df['value_gwh'] - df['value_gwh'].rolling(window).mean()) / df['value_gwh'].rolling(window).std()
-    df['anomaly'] = df['zscore'].abs() > threshold
-    return df[df['anomaly']]
-
-def calculate_carbon(df):
-    df = df.copy()
-    df['emissions_factor'] = df['production_type'].map(EMISSIONS_FACTORS).fillna(EMISSIONS_FACTORS.get('Electricity', 300))
-    df['carbon_kg'] = df['value_gwh'] * 1000 * df['emissions_factor']
-    return df
-
 def safe_mean(arr1, arr2):
     if arr1 is None or arr2 is None:
         return None
@@ -76,3 +69,38 @@ def safe_sum(arr):
         return None
     arr = np.where(arr is None, np.nan, arr).astype(float)
     return np.nansum(arr)
+
+def lttb_indices(x, y, max_points):
+    # Largest-Triangle-Three-Buckets: keeps the first and last point and, from each bucket in between,
+    # the point forming the largest triangle with the previous pick and the next bucket's average
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    selected = [0]
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+        prev_x, prev_y = x[selected[-1]], y[selected[-1]]
+        area = np.abs((prev_x - avg_x) * (y[start:end] - prev_y) - (prev_x - x[start:end]) * (avg_y - prev_y))
+        selected.append(start + int(np.argmax(area)))
+    selected.append(n - 1)
+    return np.array(selected)
+
+def downsample(df, x, y, max_points, by=None):
+    """
+    Downsamples each series (one per value of the by columns) to at most max_points rows with LTTB,
+    so chart payloads stay bounded however much history is stored. Whole rows are kept.
+    """
+    if df.empty:
+        return df
+    groups = df.groupby(by, sort=False, observed=True) if by else [(None, df)]
+    parts = []
+    for _, group in groups:
+        group = group.sort_values(x)
+        xs = group[x] if pd.api.types.is_numeric_dtype(group[x]) else pd.to_datetime(group[x]).astype('int64')
+        parts.append(group.iloc[lttb_indices(xs.to_numpy(), group[y].to_numpy(), max_points)])
+    return pd.concat(parts)
@@ -2,37 +2,118 @@
 """
 Handles all plotting and visualization logic for forecasts, analytics, and weather relationships.
 """
+import hashlib
+import json
+import multiprocessing
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
 import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import os
-from config import FORECAST_BY_TYPE_CSV, PROCESSED_WEATHER_COLS, PLOTS_DIR, FORECAST_PLOTS_DIR, ANOMALIES_CSV, CARBON_REPORT_CSV, MERGED_DATA_CSV
+from config import (FORECAST_BY_TYPE_CSV, PROCESSED_WEATHER_COLS, PLOTS_DIR, FORECAST_PLOTS_DIR, ANOMALIES_CSV, CARBON_REPORT_CSV,
+                    MERGED_DATA_DIR, CONSUMPTION_BALANCE, COUNTRIES, PLOT_WORKERS)
+from ingestion.store import read_merged
+
+# Bump when the look of the forecast plots changes so that every plot is redrawn
+FORECAST_PLOT_STYLE = 1
+FORECAST_PLOT_COLUMNS = ["ds", "yhat", "yhat_lower", "yhat_upper"]
+MANIFEST_NAME = "manifest.json"
+
+def render_forecast_plot(job):
+    # Runs in a worker process; draws on its own Agg figure so no pyplot state is shared
+    sub, title, plot_path = job
+    fig = Figure(figsize=(12, 6))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+    ax.plot(sub['ds'], sub['yhat'], label='Forecast', color='blue')
+    ax.fill_between(sub['ds'], sub['yhat_lower'], sub['yhat_upper'], color='lightblue', alpha=0.5, label='Prediction Interval')
+    ax.set_xlabel('Month')
+    ax.set_ylabel('Electricity Production (GWh)')
+    ax.set_title(title)
+    ax.legend()
+    ax.xaxis.set_major_locator(mdates.AutoDateLocator())
+    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
+    ax.tick_params(axis='x', rotation=45)
+    ax.grid()
+    fig.tight_layout()
+    fig.savefig(plot_path)
+    return plot_path
+
+def slice_hash(sub, title):
+    # Fingerprint of everything a plot is drawn from
+    digest = hashlib.sha256(f"{FORECAST_PLOT_STYLE}|{title}".encode())
+    digest.update(pd.util.hash_pandas_object(sub, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def load_manifest(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(manifest, path):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
 
-def plot_forecasts_by_type(forecast_csv=FORECAST_BY_TYPE_CSV, output_dir=FORECAST_PLOTS_DIR):
-    forecast = pd.read_csv(forecast_csv)
-    energy_types = forecast["production_type"].unique()
+def forecast_plot_jobs(forecast, output_dir):
+    """
+    One (slice, title, path) per (country, production_type), from a single groupby. Plots are named
+    forecast_<type>.png, or forecast_<country>_<type>.png when the forecast covers several countries.
+    """
+    forecast = forecast.assign(ds=pd.to_datetime(forecast["ds"]))
+    if "country" not in forecast.columns:
+        forecast["country"] = COUNTRIES[0]
+    several = forecast["country"].nunique() > 1
+    jobs = []
+    for (country, energy), sub in forecast.groupby(["country", "production_type"], observed=True):
+        name = f"forecast_{country}_{energy}.png" if several else f"forecast_{energy}.png"
+        jobs.append((sub[FORECAST_PLOT_COLUMNS].reset_index(drop=True),
+                     f'Forecasted Electricity Production for {country}: {energy}', os.path.join(output_dir, name)))
+    return jobs
+
+def plot_workers(n_plots, max_workers=PLOT_WORKERS):
+    if max_workers <= 0:
+        max_workers = os.cpu_count() or 1
+    return max(1, min(max_workers, n_plots))
+
+def plot_forecasts_by_type(forecast_csv=FORECAST_BY_TYPE_CSV, output_dir=FORECAST_PLOTS_DIR, forecast=None,
+                           max_workers=PLOT_WORKERS, force=False):
+    """
+    Draws one forecast plot per series. A manifest in output_dir keeps the hash of the data each PNG was drawn
+    from; plots whose slice is unchanged are skipped unless force is set, and plots of series no longer in the
+    forecast are removed. Returns the paths that were rendered.
+    """
+    if forecast is None:
+        forecast = pd.read_csv(forecast_csv)
     os.makedirs(output_dir, exist_ok=True)
-    for energy in energy_types:
-        sub = forecast[forecast["production_type"] == energy].copy()
-        sub["ds"] = pd.to_datetime(sub["ds"])
-        plt.figure(figsize=(12,6))
-        plt.plot(sub['ds'], sub['yhat'], label='Forecast', color='blue')
-        plt.fill_between(sub['ds'], sub['yhat_lower'], sub['yhat_upper'], color='lightblue', alpha=0.5, label='Prediction Interval')
-        plt.xlabel('Month')
-        plt.ylabel('Electricity Production (GWh)')
-        plt.title(f'Forecasted Electricity Production for France: {energy}')
-        plt.legend()
-        ax = plt.gca()
-        ax.xaxis.set_major_locator(mdates.AutoDateLocator())
-        ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m'))
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.grid()
-        plot_path = os.path.join(output_dir, f"forecast_{energy}.png")
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    previous = load_manifest(manifest_path)
+    manifest, pending = {}, []
+    for sub, title, plot_path in forecast_plot_jobs(forecast, output_dir):
+        name = os.path.basename(plot_path)
+        manifest[name] = slice_hash(sub, title)
+        if force or previous.get(name) != manifest[name] or not os.path.exists(plot_path):
+            pending.append((sub, title, plot_path))
+    for name in set(previous) - set(manifest):
+        if os.path.exists(os.path.join(output_dir, name)):
+            os.remove(os.path.join(output_dir, name))
 
-        plt.savefig(plot_path)
-        plt.close()
-        print(f"Saved plot for {energy} to {plot_path}")
+    workers = plot_workers(len(pending), max_workers)
+    if workers == 1:
+        rendered = [render_forecast_plot(job) for job in pending]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            rendered = list(executor.map(render_forecast_plot, pending, chunksize=max(1, len(pending) // (4 * workers))))
+    save_manifest(manifest, manifest_path)
+    print(f"Rendered {len(rendered)} forecast plots in {output_dir} ({len(manifest) - len(rendered)} unchanged)")
+    return rendered
 
 def plot_weather_vs_consumption(df, output_file=os.path.join(PLOTS_DIR, "weather_vs_consumption.png")):
     df = df.copy()
@@ -54,6 +135,7 @@ def plot_weather_vs_consumption(df, output_file=os.path.join(PLOTS_DIR, "weather
         ax2.legend(loc='upper right')
     plt.tight_layout()
     plt.savefig(output_file)
+    plt.close()
     #plt.show()
 
 def plot_anomalies(anomalies, output_file=os.path.join(PLOTS_DIR, "anomalies_plot.png")):
@@ -77,6 +159,7 @@ def plot_anomalies(anomalies, output_file=os.path.join(PLOTS_DIR, "anomalies_plo
     plt.tight_layout()
     plt.grid()
     plt.savefig(output_file)
+    plt.close()
     #plt.show()
 
 def plot_carbon(carbon_report, output_file=os.path.join(PLOTS_DIR, "carbon_emissions_plot.png")):
@@ -94,30 +177,44 @@ def plot_carbon(carbon_report, output_file=os.path.join(PLOTS_DIR, "carbon_emiss
     plt.tight_layout()
     plt.grid()
     plt.savefig(output_file)
+    plt.close()
     #plt.show()
 
-if __name__ == "__main__":
+def main(forecast=None, merged=None, anomalies=None, carbon_report=None):
+    """
+    Renders every plot. Frames passed in (e.g. by the pipeline runner) are used directly;
+    missing ones are read from the outputs of the previous stages.
+    """
     # Plot forecasts by type if forecast_by_type.csv exists
-    if os.path.exists(FORECAST_BY_TYPE_CSV):
-        print(f"Generating forecast plots in {FORECAST_PLOTS_DIR} from {FORECAST_BY_TYPE_CSV}")
-        plot_forecasts_by_type()
+    if forecast is not None or os.path.exists(FORECAST_BY_TYPE_CSV):
+        print(f"Generating forecast plots in {FORECAST_PLOTS_DIR}")
+        plot_forecasts_by_type(forecast=forecast)
     else:
         print(f"{FORECAST_BY_TYPE_CSV} not found. Skipping forecast plots.")
-    # Plot weather vs consumption if merged_data.csv exists
-    if os.path.exists(MERGED_DATA_CSV):
-        df = pd.read_csv(MERGED_DATA_CSV)
+    # Plot weather vs consumption if the merged dataset exists
+    if merged is not None:
+        consumption = merged.loc[merged['Balance'] == CONSUMPTION_BALANCE, ["month", "value_gwh"] + PROCESSED_WEATHER_COLS]
+        plot_weather_vs_consumption(consumption)
+    elif os.path.isdir(MERGED_DATA_DIR):
+        df = read_merged(MERGED_DATA_DIR, columns=["month", "value_gwh"] + PROCESSED_WEATHER_COLS,
+                         balances=[CONSUMPTION_BALANCE])
         plot_weather_vs_consumption(df)
     else:
-        print(f"{MERGED_DATA_CSV} not found. Skipping weather vs consumption plot.")
+        print(f"{MERGED_DATA_DIR} not found. Skipping weather vs consumption plot.")
     # Plot anomalies if anomalies.csv exists
-    if os.path.exists(ANOMALIES_CSV):
+    if anomalies is None and os.path.exists(ANOMALIES_CSV):
         anomalies = pd.read_csv(ANOMALIES_CSV)
+    if anomalies is not None:
         plot_anomalies(anomalies)
     else:
         print(f"{ANOMALIES_CSV} not found. Skipping anomalies plot.")
     # Plot carbon emissions if carbon_report.csv exists
-    if os.path.exists(CARBON_REPORT_CSV):
+    if carbon_report is None and os.path.exists(CARBON_REPORT_CSV):
         carbon_report = pd.read_csv(CARBON_REPORT_CSV)
+    if carbon_report is not None:
         plot_carbon(carbon_report)
     else:
         print(f"{CARBON_REPORT_CSV} not found. Skipping carbon emissions plot.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+"""
+Times and memory-profiles the pipeline steps on synthetic datasets of growing size and writes the results as
+JSON, one record per (size, step), so that runs from different commits can be compared with --compare.
+Each step is timed on its own (best of --repeat) and then run once more under tracemalloc for its peak Python
+allocation; memory used inside worker processes (Prophet fits) is not included.
+
+    python -m benchmarks.run --sizes 1x12x60 20x12x180 --compare benchmarks/results/<baseline>.json
+"""
+import os
+import tempfile
+
+# Prophet fits cache their models on disk: keep the benchmark's out of data/cache/models and start cold.
+# Set before config is imported here and inherited by the forecasting worker processes.
+MODEL_DIR = os.path.join(tempfile.gettempdir(), "greenpower-benchmark-models")
+os.environ["FORECAST_MODEL_DIR"] = MODEL_DIR
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import shutil
+import subprocess
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from sqlalchemy.engine import make_url
+from config import (PROCESSED_WEATHER_COLS, BENCHMARK_SIZES, BENCHMARK_ENGINES, BENCHMARK_PROPHET_MAX_SERIES,
+                    BENCHMARK_DIR, PRODUCTION_BALANCE)
+from analytics.forecasting import forecast_by_type
+from analytics.hierarchy import leaf_series
+from analytics.reporting import detect_anomalies, calculate_carbon
+from analytics.utils import clean_iea, merge_data
+from benchmarks.synthetic import synthetic_iea, synthetic_weather, country_names
+from db.db_schema import metadata
+from db.engine import create_db_engine, is_sqlite
+from db.load_to_db import split_merged, load_tables
+from db.rollups import refresh
+from ingestion.ingest_iea import read_iea_csv
+
+
+def parse_size(text):
+    countries, types, months = (int(part) for part in text.lower().split("x"))
+    return countries, types, months
+
+
+def size_label(size):
+    return "x".join(str(part) for part in size)
+
+
+def measure(func, repeat=1, memory=True):
+    # Best wall time of repeat runs, then the peak traced allocation of one more run; the steps' own
+    # progress output is dropped
+    times = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+        result = {"seconds": min(times)}
+        if memory:
+            tracemalloc.start()
+            try:
+                func()
+                result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            finally:
+                tracemalloc.stop()
+    return result
+
+
+def check_db_uri(db_uri, wipe=False):
+    # Every run drops and recreates the tables of db_uri; a server database is only wiped when asked to
+    if db_uri is not None and not is_sqlite(db_uri) and not wipe:
+        shown = make_url(db_uri).render_as_string(hide_password=True)
+        raise ValueError(f"Benchmarking into {shown} drops all of its tables; pass wipe=True (--wipe) to allow it.")
+
+
+def load_database(merged, countries, workdir, db_uri=None, wipe=False):
+    # A fresh database per run, so every repeat loads the same rows into empty tables
+    check_db_uri(db_uri, wipe)
+    if db_uri is None:
+        path = os.path.join(workdir, "benchmark.db")
+        if os.path.exists(path):
+            os.remove(path)
+        db_uri = f"sqlite:///{path}"
+    engine = create_db_engine(db_uri)
+    try:
+        metadata.drop_all(engine)
+        metadata.create_all(engine)
+        load_tables(engine, *split_merged(merged, countries))
+        refresh(engine, None)
+    finally:
+        engine.dispose()
+
+
+def cold_forecast(production, engine):
+    # Prophet's model cache would turn every run after the first into cache hits
+    shutil.rmtree(MODEL_DIR, ignore_errors=True)
+    return forecast_by_type(production, 12, engine, True)
+
+
+def benchmark_size(size, engines=BENCHMARK_ENGINES, repeat=1, memory=True, db_uri=None,
+                   prophet_max_series=BENCHMARK_PROPHET_MAX_SERIES, wipe=False):
+    """
+    Runs every step on one synthetic dataset and returns its records. Each step gets the output of the steps
+    before it, prepared outside the measurement, as it would in the pipeline.
+    """
+    countries, types, months = size
+    names = country_names(countries)
+    iea = synthetic_iea(countries, types, months)
+    weather = synthetic_weather(countries, months)
+    base = {"size": size_label(size), "countries": countries, "types": types, "months": months, "rows": len(iea)}
+    records = []
+
+    def run(step, func):
+        print(f"  {step} ...", end=" ", flush=True)
+        record = dict(base, step=step, **measure(func, repeat, memory))
+        print(f"{record['seconds']:.3f}s" + (f", {record['peak_mb']:.1f} MB" if "peak_mb" in record else ""))
+        records.append(record)
+
+    with tempfile.TemporaryDirectory(prefix="greenpower-benchmark-") as workdir:
+        csv_path = os.path.join(workdir, "iea.csv")
+        iea.to_csv(csv_path, index=False)
+        run("read_iea_csv", lambda: read_iea_csv(csv_path, names))
+        raw = read_iea_csv(csv_path, names)
+        run("clean_iea", lambda: clean_iea(raw, names))
+        cleaned = clean_iea(raw, names)
+        run("merge_data", lambda: merge_data(cleaned, weather))
+        merged = merge_data(cleaned, weather)
+        run("detect_anomalies", lambda: detect_anomalies(merged))
+        run("calculate_carbon", lambda: calculate_carbon(merged))
+
+        production = merged.loc[merged["Balance"] == PRODUCTION_BALANCE,
+                                ["country", "month", "production_type", "value_gwh"] + PROCESSED_WEATHER_COLS]
+        n_series = len(leaf_series(production)[["country", "production_type"]].drop_duplicates())
+        for engine in engines:
+            step = f"forecast_{engine}"
+            if engine == "prophet" and n_series > prophet_max_series:
+                records.append(dict(base, step=step, skipped=f"{n_series} series > {prophet_max_series}"))
+                print(f"  {step} skipped ({n_series} series)")
+                continue
+            run(step, lambda: cold_forecast(production, engine))
+        run("db_load", lambda: load_database(merged, names, workdir, db_uri, wipe))
+    return records
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Steps this fast are too noisy to call a regression
+COMPARE_MIN_SECONDS = 0.05
+
+
+def compare(results, baseline, tolerance=1.2):
+    # Per (size, step) time ratio against a baseline run; above tolerance counts as a regression
+    before = {(r["size"], r["step"]): r for r in baseline["results"] if "seconds" in r}
+    regressions = []
+    print(f"\nCompared with {baseline.get('commit') or 'baseline'}:")
+    for record in results["results"]:
+        old = before.get((record["size"], record["step"]))
+        if old is None or "seconds" not in record or not old["seconds"]:
+            continue
+        ratio = record["seconds"] / old["seconds"]
+        flag = "  SLOWER" if ratio > tolerance and record["seconds"] >= COMPARE_MIN_SECONDS else ""
+        print(f"  {record['size']:<12} {record['step']:<24} {old['seconds']:8.3f}s -> {record['seconds']:8.3f}s "
+              f"({ratio:.2f}x){flag}")
+        if flag:
+            regressions.append((record["size"], record["step"], ratio))
+    return regressions
+
+
+def run_benchmarks(sizes=BENCHMARK_SIZES, engines=BENCHMARK_ENGINES, repeat=1, memory=True, db_uri=None,
+                   output=None, wipe=False):
+    """
+    Benchmarks every size and writes the results to output (by default BENCHMARK_DIR/<commit>-<time>.json).
+    Returns the results document. A db_uri other than sqlite is refused unless wipe is set, as its tables are dropped.
+    """
+    check_db_uri(db_uri, wipe)
+    created = datetime.now(timezone.utc)
+    results = {
+        "commit": git_commit(),
+        "created_at": created.isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "repeat": repeat,
+        "results": [],
+    }
+    try:
+        for size in sizes:
+            print(f"Benchmarking {size_label(size)} (countries x types x months)")
+            results["results"].extend(benchmark_size(size, engines, repeat, memory, db_uri, wipe=wipe))
+    finally:
+        shutil.rmtree(MODEL_DIR, ignore_errors=True)
+    if output is None:
+        os.makedirs(BENCHMARK_DIR, exist_ok=True)
+        output = os.path.join(BENCHMARK_DIR, f"{results['commit'] or 'benchmark'}-{created:%Y%m%dT%H%M%S}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Saved benchmark results to {output}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline steps on synthetic data.")
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=BENCHMARK_SIZES,
+                        help="Dataset sizes as COUNTRIESxTYPESxMONTHS, e.g. 5x12x120")
+    parser.add_argument("--engines", nargs="+", default=BENCHMARK_ENGINES, help="Forecasting engines to time")
+    parser.add_argument("--repeat", type=int, default=1, help="Timed runs per step; the fastest is kept")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc run of each step")
+    parser.add_argument("--db-uri", help="Database to load into (default: a temporary sqlite file); it is wiped")
+    parser.add_argument("--wipe", action="store_true", help="Allow a non-sqlite --db-uri, whose tables are dropped")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<commit>-<time>.json)")
+    parser.add_argument("--compare", help="Earlier results file to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.2, help="Slowdown ratio reported as a regression")
+    args = parser.parse_args()
+    try:
+        check_db_uri(args.db_uri, args.wipe)
+    except ValueError as e:
+        parser.error(str(e))
+    results = run_benchmarks(args.sizes, args.engines, args.repeat, not args.no_memory, args.db_uri, args.output,
+                             wipe=args.wipe)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        raise SystemExit(1 if regressions else 0)
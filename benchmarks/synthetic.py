@@ -0,0 +1,76 @@
+"""
+Synthetic IEA- and weather-shaped datasets for benchmarks. Sizes scale by countries x production types x months;
+values follow a trend, a yearly cycle and noise, with the occasional spike for the anomaly detectors.
+The IEA frame has the columns of an IEA export, and the weather frame those of the processed weather data.
+"""
+import numpy as np
+import pandas as pd
+from config import PRODUCTION_BALANCE, CONSUMPTION_BALANCE, PROCESSED_WEATHER_COLS
+from analytics.hierarchy import aggregate_leaves
+
+# Real leaf types first; larger sizes add numbered ones
+LEAF_TYPES = aggregate_leaves()["Electricity"]
+TRADE_BALANCES = ["Total Imports", "Total Exports"]
+# Mean and yearly amplitude of each weather column
+WEATHER_SHAPES = {"avg_temp_c": (12.0, 8.0), "precip_mm": (60.0, 20.0), "wind_kmh": (15.0, 4.0)}
+
+
+def country_names(countries):
+    return [f"Country {i:03d}" for i in range(1, countries + 1)]
+
+
+def production_types(types):
+    return (LEAF_TYPES + [f"Synthetic Type {i}" for i in range(1, types - len(LEAF_TYPES) + 1)])[:types]
+
+
+def month_range(months, start="2010-01"):
+    return pd.period_range(start, periods=months, freq="M")
+
+
+def synthetic_iea(countries=1, types=12, months=120, start="2010-01", seed=0):
+    """
+    Net production of each leaf type, the Electricity total of those leaves, consumption and trade for every
+    country and month, as an IEA export (Country, Time as 'YY-Mon', Balance, Product, Value, Unit).
+    """
+    rng = np.random.default_rng(seed)
+    names, leaves, periods = country_names(countries), production_types(types), month_range(months, start)
+    t = np.arange(months)
+    # (country, type, month) values: per-series scale, trend and seasonal phase
+    scale = rng.lognormal(6, 1.5, (countries, types, 1))
+    trend = 1 + rng.normal(0, 0.003, (countries, types, 1)) * t
+    season = 1 + 0.25 * np.sin(2 * np.pi * (t + rng.integers(0, 12, (countries, types, 1))) / 12)
+    values = scale * trend * season * rng.normal(1, 0.05, (countries, types, months))
+    spikes = rng.random(values.shape) < 0.005
+    values[spikes] *= rng.choice([0.3, 2.5], spikes.sum())
+    values = np.clip(values, 0, None)
+    total = values.sum(axis=1)
+
+    labels = periods.strftime("%y-%b")
+    frames = [pd.DataFrame({
+        "Country": np.repeat(names, types * months),
+        "Time": np.tile(labels, countries * types),
+        "Balance": PRODUCTION_BALANCE,
+        "Product": np.tile(np.repeat(leaves, months), countries),
+        "Value": values.ravel(),
+    })]
+    other = {PRODUCTION_BALANCE: total, CONSUMPTION_BALANCE: total * 0.8}
+    for balance in TRADE_BALANCES:
+        other[balance] = total * rng.uniform(0.02, 0.1, (countries, 1))
+    for balance, series in other.items():
+        frames.append(pd.DataFrame({"Country": np.repeat(names, months), "Time": np.tile(labels, countries),
+                                    "Balance": balance, "Product": "Electricity", "Value": series.ravel()}))
+    return pd.concat(frames, ignore_index=True).assign(Unit="GWh")
+
+
+def synthetic_weather(countries=1, months=120, start="2010-01", seed=0):
+    # Processed monthly weather: country, month as 'YYYY-MM' and PROCESSED_WEATHER_COLS
+    rng = np.random.default_rng(seed + 1)
+    periods = month_range(months, start)
+    cycle = np.cos(2 * np.pi * (periods.month.to_numpy() - 7) / 12)
+    weather = pd.DataFrame({"country": np.repeat(country_names(countries), months),
+                            "month": np.tile(periods.strftime("%Y-%m"), countries)})
+    for col in PROCESSED_WEATHER_COLS:
+        mean, amplitude = WEATHER_SHAPES.get(col, (0.0, 1.0))
+        weather[col] = (mean + amplitude * np.tile(cycle, countries)
+                        + rng.normal(0, amplitude / 4 + 0.1, countries * months))
+    return weather
@@ -10,17 +10,62 @@ DATA_INPUT_DIR = os.path.join(BASE_DIR, "data", "input")
 DATA_OUTPUT_DIR = os.path.join(BASE_DIR, "data", "output")
 PLOTS_DIR = os.path.join(BASE_DIR, "plots")
 FORECAST_PLOTS_DIR = os.path.join(PLOTS_DIR, "forecasts")
+# Forecast plots render in a process pool (0 workers means one per CPU)
+PLOT_WORKERS = int(os.getenv("PLOT_WORKERS", "0"))
 
 MERGED_DATA_CSV = os.path.join(DATA_OUTPUT_DIR, "merged_data.csv")
+# Parquet dataset partitioned by country and year; the interchange format between stages
+MERGED_DATA_DIR = os.path.join(DATA_OUTPUT_DIR, "merged")
 FORECAST_BY_TYPE_CSV = os.path.join(DATA_OUTPUT_DIR, "forecast_by_type.csv")
 FORECAST_RESULTS_CSV = os.path.join(DATA_OUTPUT_DIR, "forecast_results.csv")
 ANOMALIES_CSV = os.path.join(DATA_OUTPUT_DIR, "anomalies.csv")
 CARBON_REPORT_CSV = os.path.join(DATA_OUTPUT_DIR, "carbon_report.csv")
+# Net production, emission factor and emissions per country, month and leaf production type
+CARBON_CUBE_PARQUET = os.path.join(DATA_OUTPUT_DIR, "carbon_cube.parquet")
 TABLEAU_EXPORT_DIR = os.path.join(DATA_OUTPUT_DIR, "tableau_exports")
 WEATHER_DATA_CSV = os.path.join(DATA_OUTPUT_DIR, "weather_data.csv")
 IEA_CSV = os.path.join(DATA_INPUT_DIR, "IEA_France_2023_2025.csv")
+# Optional country- and year-specific emission factors refining EMISSIONS_FACTORS (see analytics.carbon)
+EMISSIONS_FACTORS_CSV = os.path.join(DATA_INPUT_DIR, "emission_factors.csv")
+# Rows per chunk when streaming IEA exports
+IEA_CHUNKSIZE = 200_000
+PIPELINE_CACHE_DIR = os.path.join(BASE_DIR, "data", "cache", "pipeline")
+WATERMARKS_JSON = os.path.join(DATA_OUTPUT_DIR, "watermarks.json")
+# Bumped whenever the database or pipeline outputs change; the dashboard cache keys on it
+RUN_MARKER_JSON = os.path.join(DATA_OUTPUT_DIR, "run_marker.json")
+# Upper bound on how long the dashboard serves cached data, in seconds
+DASHBOARD_CACHE_TTL = 600
+# Rows per page of the raw data table, and points per chart series after downsampling
+DASHBOARD_PAGE_SIZE = 100
+DASHBOARD_MAX_POINTS = 400
+# Plotly figures prebuilt by the pipeline for the dashboard's unfiltered views, with a manifest
+FIGURES_DIR = os.path.join(DATA_OUTPUT_DIR, "figures")
+
+# Shared connection pool (db.engine); statements running longer than the timeout are cancelled
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_RECYCLE = 1800
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+# Database bulk loading: tables load concurrently, one pooled connection each
+DB_LOAD_WORKERS = 3
+# Turn the tables into TimescaleDB hypertables partitioned by month (requires the extension)
+DB_TIMESCALE = os.getenv("DB_TIMESCALE", "0").lower() in ("1", "true", "yes")
+DB_CHUNK_INTERVAL = "1 year"
 
 COUNTRIES = ["France"]
+# IEA Balance rows used for production and consumption series
+PRODUCTION_BALANCE = "Net Electricity Production"
+CONSUMPTION_BALANCE = "Final Consumption (Calculated)"
+# IEA aggregate production types and the types they sum; a child may itself be an aggregate. Combustible
+# Renewables counts towards both fuel and renewable totals, as in the IEA data.
+PRODUCTION_HIERARCHY = {
+    "Electricity": ["Nuclear", "Total Combustible Fuels", "Hydro", "Geothermal", "Solar", "Wind", "Other Renewables",
+                    "Not Specified"],
+    "Total Combustible Fuels": ["Coal, Peat and Manufactured Gases", "Oil and Petroleum Products", "Natural Gas",
+                                "Combustible Renewables", "Other Combustible Non-Renewables"],
+    "Total Renewables (Hydro, Geo, Solar, Wind, Other)": ["Hydro", "Geothermal", "Solar", "Wind", "Other Renewables",
+                                                          "Combustible Renewables"],
+}
 LOCATIONS = {
     "France": {"lat": 48.8566, "lon": 2.3522}
 }
@@ -28,6 +73,20 @@ WEATHER_API_BASE = "https://archive-api.open-meteo.com/v1/archive"
 START_YEAR = 2010
 END_YEAR = 2025
 
+# Weather ingestion tuning: adjacent months are merged into one archive request
+# and requests for all locations share a pooled session and worker pool.
+WEATHER_TIMEZONE = "Europe/Paris"
+WEATHER_BATCH_MONTHS = 12
+WEATHER_MAX_WORKERS = 8
+WEATHER_MAX_RETRIES = 3
+WEATHER_BACKOFF_FACTOR = 0.5
+WEATHER_TIMEOUT = 30
+
+# On-disk cache of archive responses. Offline mode serves fetch_weather from the cache only.
+WEATHER_CACHE_DIR = os.path.join(BASE_DIR, "data", "cache", "weather")
+WEATHER_CACHE_MAX_BYTES = 256 * 1024 * 1024
+WEATHER_OFFLINE = os.getenv("WEATHER_OFFLINE", "0").lower() in ("1", "true", "yes")
+
 # Emissions factors in kg CO2e per MWh (example values, adjust as needed)
 EMISSIONS_FACTORS = {
     'Coal, Peat and Manufactured Gases': 820,
@@ -45,6 +104,42 @@ EMISSIONS_FACTORS = {
     'Not Specified': 300,  # fallback
 }
 
+# Forecasting: Prophet fits run in a process pool, one series per (country, production_type).
+# 0 workers means one per CPU; a series taking longer than the timeout (seconds) is skipped.
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", "0"))
+FORECAST_TIMEOUT = 300
+# Fitted Prophet models, keyed by series and training data; older versions beyond the newest few are evicted
+FORECAST_MODEL_DIR = os.getenv("FORECAST_MODEL_DIR", os.path.join(BASE_DIR, "data", "cache", "models"))
+FORECAST_MODEL_KEEP = 2
+# "prophet", or a matrix engine fitting all series at once: "seasonal_naive", "holt_winters" or "ridge"
+FORECAST_ENGINE = os.getenv("FORECAST_ENGINE", "prophet")
+# Fit only the leaf production types and sum them into the PRODUCTION_HIERARCHY aggregates
+FORECAST_HIERARCHICAL = os.getenv("FORECAST_HIERARCHICAL", "1").lower() in ("1", "true", "yes")
+# Rolling-origin backtests (analytics.backtest): folds of BACKTEST_HORIZON months each, ending at the last month,
+# with at least BACKTEST_MIN_TRAIN months of training data before the first
+BACKTEST_ENGINES = ["prophet", "prophet_weather", "seasonal_naive", "holt_winters", "ridge"]
+BACKTEST_FOLDS = 3
+BACKTEST_HORIZON = 12
+BACKTEST_MIN_TRAIN = 24
+BACKTEST_CSV = os.path.join(DATA_OUTPUT_DIR, "backtest_results.csv")
+BACKTEST_SUMMARY_CSV = os.path.join(DATA_OUTPUT_DIR, "backtest_summary.csv")
+# Benchmarks (benchmarks.run): synthetic datasets of (countries, production types, months); Prophet is only
+# benchmarked up to BENCHMARK_PROPHET_MAX_SERIES series as it fits one model per series
+BENCHMARK_SIZES = [(1, 12, 60), (5, 12, 120), (20, 12, 180), (50, 24, 240)]
+BENCHMARK_ENGINES = ["prophet", "seasonal_naive", "holt_winters", "ridge"]
+BENCHMARK_PROPHET_MAX_SERIES = 24
+BENCHMARK_DIR = os.path.join(BASE_DIR, "benchmarks", "results")
+
+# Anomaly detection: rolling z score over the last ANOMALY_WINDOW months of each series. The incremental
+# scorer keeps each series' recent values in the state file and scores only months newer than it.
+ANOMALY_WINDOW = 12
+ANOMALY_THRESHOLD = 3
+ANOMALY_STATE_JSON = os.path.join(BASE_DIR, "data", "cache", "anomaly_state.json")
+# Detectors run by analytics.reporting, comma separated: "zscore" (rolling mean/std), "mad" (rolling median/MAD)
+# and "seasonal" (residual after trend and month-of-year effect). Only the rolling detectors score incrementally,
+# so the default pairs zscore with the robust mad; seasonal rescores every series on each run and is opt-in.
+ANOMALY_DETECTORS = [name.strip() for name in os.getenv("ANOMALY_DETECTORS", "zscore,mad").split(",") if name.strip()]
+
 # Weather columns for API requests (raw Open-Meteo variable names)
 WEATHER_COLS = [
     "temperature_2m_max",
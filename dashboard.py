@@ -2,168 +2,317 @@ import streamlit as st
 import plotly.express as px
 import pandas as pd
 import os
-from sqlalchemy import create_engine
-
-# Load DB URI from config.py
-try:
-    from config import DB_URI
-except ImportError:
-    DB_URI = os.getenv('DB_URI')
-
-def get_power_data():
-    engine = create_engine(DB_URI)
-    query = "SELECT * FROM power_data;"
-    df = pd.read_sql(query, engine)
-    return df
+import time
+from config import (ANOMALIES_CSV, CARBON_REPORT_CSV, CARBON_CUBE_PARQUET, FORECAST_RESULTS_CSV, FORECAST_BY_TYPE_CSV,
+                    MERGED_DATA_CSV, FIGURES_DIR, DASHBOARD_CACHE_TTL, DASHBOARD_PAGE_SIZE, DASHBOARD_MAX_POINTS)
+from analytics.utils import downsample
+from analytics.carbon import read_or_build_carbon_cube
+from analytics import figures
+from analytics.figures import FIGURES, load_figure
+from db.engine import get_engine
+from db.queries import read_filtered, read_power_page, read_filter_options, POWER_KEYS
+from pipeline.run_marker import run_marker_version
+
+st.set_page_config(page_title='GreenPower Dashboard', layout='wide', page_icon=':bar_chart:')
+
+# Data and figures are cached across reruns. Database results are keyed on the run marker the loader and
+# pipeline publish, CSV outputs on their modification time, and the TTL bounds staleness either way.
+# Sidebar filters are passed down as a (countries, production_types, start_month, end_month) tuple and
+# applied in SQL; chart series are downsampled to DASHBOARD_MAX_POINTS before they reach Plotly.
+# Unfiltered views of the pipeline outputs use the figures the pipeline prebuilt (analytics.figures).
 
-def get_consumption_data():
-    engine = create_engine(DB_URI)
-    query = "SELECT * FROM consumption_data;"
-    df = pd.read_sql(query, engine)
+@st.cache_resource
+def db_engine():
+    return get_engine()
+
+def month_labels(df):
+    # The tables store month as a date; the CSV outputs use 'YYYY-MM' labels
+    df['month'] = pd.to_datetime(df['month']).dt.strftime('%Y-%m')
     return df
 
-def get_weather_data():
-    engine = create_engine(DB_URI)
-    query = "SELECT * FROM weather_data;"
-    df = pd.read_sql(query, engine)
+def filter_kwargs(filters, production_types=True):
+    countries, types, start_month, end_month = filters
+    kwargs = {'countries': countries, 'start_month': start_month, 'end_month': end_month}
+    if production_types:
+        kwargs['production_types'] = types
+    return kwargs
+
+def filter_frame(df, filters):
+    # Same filters for the CSV outputs, which are small enough to filter in pandas
+    countries, types, start_month, end_month = filters
+    if countries and 'country' in df.columns:
+        df = df[df['country'].isin(countries)]
+    if types and 'production_type' in df.columns:
+        df = df[df['production_type'].isin(types)]
+    if 'month' in df.columns:
+        if start_month is not None:
+            df = df[df['month'] >= start_month.strftime('%Y-%m')]
+        if end_month is not None:
+            df = df[df['month'] <= end_month.strftime('%Y-%m')]
     return df
 
-anomalies = pd.read_csv('data/output/anomalies.csv')
-carbon_report = pd.read_csv('data/output/carbon_report.csv')
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def load_filtered(table, version, filters, production_types=True, order_by='country, month'):
+    # version is only part of the cache key
+    df = read_filtered(table, order_by=order_by, engine=db_engine(), **filter_kwargs(filters, production_types))
+    return month_labels(df) if 'month' in df.columns else df
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def load_power_page(version, filters, after):
+    return read_power_page(after=after, limit=DASHBOARD_PAGE_SIZE, engine=db_engine(), **filter_kwargs(filters))
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def filter_options(version):
+    return read_filter_options(engine=db_engine())
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def load_csv(path, mtime):
+    return pd.read_csv(path) if mtime is not None else pd.DataFrame()
+
+def file_version(path):
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+def read_output(path):
+    return load_csv(path, file_version(path))
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def load_carbon_cube(mtime, merged_mtime):
+    # Built by the reporting stage; a deployment without it builds the cube once from the committed merged data
+    cube = read_or_build_carbon_cube(CARBON_CUBE_PARQUET)
+    return cube if cube is not None else pd.DataFrame()
+
+def carbon_version():
+    return file_version(CARBON_CUBE_PARQUET), file_version(MERGED_DATA_CSV)
+
+def carbon_slice(filters):
+    return filter_frame(load_carbon_cube(*carbon_version()), filters)
+
+def get_consumption_data(version, filters):
+    return load_filtered('consumption_data', version, filters, production_types=False)
 
-df = get_power_data()
-consumption_df = get_consumption_data()
-weather_df = get_weather_data()
+def get_weather_data(version, filters):
+    return load_filtered('weather_data', version, filters, production_types=False)
 
-fig = px.histogram(df, x='month', y='value_gwh', color='production_type', barmode='group',
-                   title='Monthly Power Production by Type',
-                   labels={'value_gwh': 'Power Produced (GWh)', 'month': 'Month', 'production_type': 'Production Type'})
+def get_rollup(table, version, filters, production_types=True):
+    # Pre-summed by db.rollups after every load
+    return load_filtered(table, version, filters, production_types)
 
-fig_consumption = px.line(consumption_df, x='month', y='total_consumption_gwh', color='country',
-                         title='Monthly Total Consumption (GWh)')
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def production_figures(version, filters):
+    monthly_type = get_rollup('rollup_monthly_type', version, filters)
+    summary = monthly_type[['country', 'month', 'production_type', 'value_gwh']]
+    if monthly_type['month'].nunique() > DASHBOARD_MAX_POINTS:
+        # Too many months to draw one bar each: fall back to the yearly rollup
+        yearly = load_filtered('rollup_yearly', version, filters[:2] + (None, None), order_by='country, year')
+        fig = px.histogram(yearly, x='year', y='value_gwh', color='production_type', barmode='group',
+                           title='Yearly Power Production by Type',
+                           labels={'value_gwh': 'Power Produced (GWh)', 'year': 'Year', 'production_type': 'Production Type'})
+        return fig, summary
+    fig = px.histogram(monthly_type, x='month', y='value_gwh', color='production_type', barmode='group',
+                       title='Monthly Power Production by Type',
+                       labels={'value_gwh': 'Power Produced (GWh)', 'month': 'Month', 'production_type': 'Production Type'})
+    return fig, summary
 
-if 'avg_temp_c' in weather_df.columns:
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def consumption_figure(version, filters):
+    consumption_df = get_consumption_data(version, filters)
+    return px.line(downsample(consumption_df, 'month', 'total_consumption_gwh', DASHBOARD_MAX_POINTS, by='country'),
+                   x='month', y='total_consumption_gwh', color='country',
+                   title='Monthly Total Consumption (GWh)')
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def weather_figure(version, filters):
+    consumption_df = get_consumption_data(version, filters)
+    weather_df = get_weather_data(version, filters)
+    if 'avg_temp_c' not in weather_df.columns:
+        return None
     merged_weather = pd.merge(consumption_df, weather_df, on=['country', 'month'], how='left')
-    fig_weather = px.scatter(merged_weather, x='avg_temp_c', y='total_consumption_gwh', color='country',
-                            title='Weather vs Consumption',
-                            labels={'avg_temp_c': 'Average Temperature (C)', 'total_consumption_gwh': 'Total Consumption (GWh)'})
-else:
-    fig_weather = None
-
-if 'zscore' in anomalies.columns:
-    fig_anomalies = px.bar(
-        anomalies,
-        x='month',
-        y='zscore',
-        color=anomalies['anomaly'].map({True: 'Anomaly', False: 'Normal'}),
-        barmode='group',
-        facet_col='production_type' if 'production_type' in anomalies.columns else None,
-        title='Z-Score of Power Data by Month (Anomalies Highlighted)',
-        labels={'zscore': 'Z-Score', 'month': 'Month', 'color': 'Status'}
-    )
-else:
-    anomalies_true = anomalies[anomalies['anomaly'] == True]
-    if not anomalies_true.empty:
-        anomalies_count = anomalies_true.groupby(['month', 'production_type']).size().reset_index(name='anomaly_count')
-        fig_anomalies = px.bar(anomalies_count, x='month', y='anomaly_count', color='production_type',
-                              title='Count of Detected Anomalies in Power Data',
-                              labels={'anomaly_count': 'Anomaly Count', 'month': 'Month', 'production_type': 'Production Type'})
+    return px.scatter(merged_weather, x='avg_temp_c', y='total_consumption_gwh', color='country',
+                      title='Weather vs Consumption',
+                      labels={'avg_temp_c': 'Average Temperature (C)', 'total_consumption_gwh': 'Total Consumption (GWh)'})
+
+def unfiltered(version, filters, dates=True):
+    # True when the sidebar selects everything, so the figures prebuilt by the pipeline apply
+    countries, types, start_month, end_month = filters
+    options = filter_options(version)
+    if types or (countries and set(countries) != set(options['countries'])):
+        return False
+    if not dates or options['first_month'] is None or start_month is None:
+        return True
+    return (start_month.strftime('%Y-%m'), end_month.strftime('%Y-%m')) == (
+        pd.Timestamp(options['first_month']).strftime('%Y-%m'), pd.Timestamp(options['last_month']).strftime('%Y-%m'))
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def load_prebuilt(name, versions):
+    # versions (the manifest's and the sources' mtimes) is only part of the cache key
+    return load_figure(name)
+
+def prebuilt_figure(name):
+    paths = (os.path.join(FIGURES_DIR, figures.MANIFEST_NAME),) + FIGURES[name][1]
+    return load_prebuilt(name, tuple(file_version(path) for path in paths))
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def anomalies_figure(mtime, filters):
+    return figures.anomalies_figure(filter_frame(load_csv(ANOMALIES_CSV, mtime), filters))
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def carbon_figure(mtime, filters):
+    return figures.carbon_figure(carbon_slice(filters))
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def forecast_total_figure(mtime):
+    return figures.forecast_total_figure(load_csv(FORECAST_RESULTS_CSV, mtime), DASHBOARD_MAX_POINTS)
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def forecast_type_figure(mtime, filters):
+    forecast_type = filter_frame(load_csv(FORECAST_BY_TYPE_CSV, mtime), filters[:2] + (None, None))
+    return figures.forecast_type_figure(forecast_type, DASHBOARD_MAX_POINTS)
+
+@st.cache_data(ttl=DASHBOARD_CACHE_TTL, show_spinner=False)
+def forecasted_carbon_figure(cube_mtime, mtime, filters):
+    return figures.forecasted_carbon_figure(load_csv(FORECAST_RESULTS_CSV, mtime), carbon_slice(filters),
+                                            DASHBOARD_MAX_POINTS)
+
+def sidebar_filters(version):
+    options = filter_options(version)
+    countries = st.sidebar.multiselect('Countries', options['countries'], default=options['countries'])
+    production_types = st.sidebar.multiselect('Production types', options['production_types'],
+                                              placeholder='All production types')
+    start_month = end_month = None
+    if options['first_month'] is not None:
+        months = list(pd.date_range(options['first_month'], options['last_month'], freq='MS').strftime('%Y-%m'))
+        start_label, end_label = st.sidebar.select_slider('Date range', options=months, value=(months[0], months[-1]))
+        start_month, end_month = pd.Timestamp(start_label).date(), pd.Timestamp(end_label).date()
+    # An empty selection means no filter
+    return tuple(countries), tuple(production_types), start_month, end_month
+
+def raw_power_table(version, filters):
+    # Keyset pagination: the stack holds the last key of every page before the current one
+    if st.session_state.get('raw_power_filters') != (version, filters):
+        st.session_state['raw_power_filters'] = (version, filters)
+        st.session_state['raw_power_cursors'] = [None]
+    cursors = st.session_state['raw_power_cursors']
+    page = load_power_page(version, filters, cursors[-1])
+    last_key = tuple(page.iloc[-1][list(POWER_KEYS)]) if not page.empty else None
+    previous_col, next_col, info_col = st.columns([1, 1, 6])
+    previous_col.button('Previous', disabled=len(cursors) == 1, on_click=cursors.pop)
+    next_col.button('Next', disabled=len(page) < DASHBOARD_PAGE_SIZE, on_click=cursors.append, args=(last_key,))
+    info_col.caption(f'Page {len(cursors)} · {DASHBOARD_PAGE_SIZE} rows per page')
+    st.dataframe(month_labels(page.copy()), use_container_width=True, hide_index=True)
+
+def overview_section(version, filters):
+    st.markdown('''<div style="font-size:18px; color:#444; background:#e3f2fd; border-radius:8px; padding:18px 24px; margin-bottom:30px; border-left: 6px solid #1976D2;">\
+<b>Welcome!</b> This dashboard provides a <b>comprehensive overview</b> of power generation, consumption, weather impact, anomalies, carbon emissions, and forecasts for energy data.<br>\
+Use the sections in the sidebar to <b>explore trends</b>, <b>detect issues</b>, and <b>support data-driven decisions</b>.<br>\
+</div>''', unsafe_allow_html=True)
+    monthly = get_rollup('rollup_monthly', version, filters, production_types=False)
+    if monthly.empty:
+        st.info('No data loaded yet.')
+        return
+    # Both the rollup and the carbon cube count leaf production types only, with the same emission factors
+    latest = monthly[monthly['month'] == monthly['month'].max()]
+    st.subheader(f"Latest month: {latest['month'].iloc[0]}")
+    production_col, consumption_col, carbon_col = st.columns(3)
+    production_col.metric('Production (GWh)', f"{latest['production_gwh'].sum():,.0f}")
+    consumption_col.metric('Consumption (GWh)', f"{latest['consumption_gwh'].sum():,.0f}")
+    cube = carbon_slice(filters)
+    latest_carbon = cube.loc[cube['month'] == latest['month'].iloc[0], 'carbon_kg'].sum() if not cube.empty else 0
+    carbon_col.metric('Carbon Emissions (t)', f"{latest_carbon / 1000:,.0f}")
+
+def production_section(version, filters):
+    fig, summary = production_figures(version, filters)
+    st.header('⚡ Power Production Distribution')
+    st.write('Visualizes the monthly distribution of power production by type. Use this to identify which energy sources contribute most to the grid and how production varies over time.')
+    st.plotly_chart(fig, use_container_width=True)
+
+    st.header('📊 Monthly Production Summary')
+    st.write('Tabular summary of total power produced each month, broken down by production type. Useful for quick comparisons and reporting.')
+    st.dataframe(summary, use_container_width=True, hide_index=True)
+
+    st.header('🗃️ Raw Power Data')
+    st.write('Full raw power data for transparency and custom analysis. Use the sidebar filters and the page buttons to explore the dataset.')
+    raw_power_table(version, filters)
+
+def consumption_section(version, filters):
+    st.header('🔌 Monthly Consumption')
+    st.write('Shows the total electricity consumption per month for each country. Track demand trends and seasonal patterns.')
+    st.plotly_chart(consumption_figure(version, filters), use_container_width=True)
+
+def weather_section(version, filters):
+    fig_weather = weather_figure(version, filters)
+    st.header('🌦️ Weather vs Consumption')
+    st.write('Examines the relationship between average temperature and electricity consumption. Helps understand how weather impacts energy demand.')
+    if fig_weather:
+        st.plotly_chart(fig_weather, use_container_width=True)
     else:
-        fig_anomalies = None
-
-carbon_summary = carbon_report if not carbon_report.empty else pd.DataFrame()
-summary = df.groupby(['month', 'production_type'])['value_gwh'].sum().reset_index()
-
-if not carbon_report.empty and 'month' in carbon_report.columns and 'carbon_kg' in carbon_report.columns:
-    fig_carbon = px.bar(
-        carbon_report,
-        x='month',
-        y='carbon_kg',
-        barmode='group',
-        title='Monthly Carbon Emissions',
-        labels={'carbon_kg': 'Carbon Emissions (kg)', 'month': 'Month'}
-    )
-else:
-    fig_carbon = None
-
-forecast_total_path = 'data/output/forecast_results.csv'
-forecast_type_path = 'data/output/forecast_by_type.csv'
-fig_forecast_total = None
-fig_forecast_type = None
-
-if os.path.exists(forecast_total_path):
-    forecast_total = pd.read_csv(forecast_total_path)
-    if 'ds' in forecast_total.columns and 'yhat' in forecast_total.columns:
-        fig_forecast_total = px.line(
-            forecast_total,
-            x='ds',
-            y='yhat',
-            title='Total Power Forecast',
-            labels={'yhat': 'Forecasted Power (GWh)', 'ds': 'Month'}
-        )
-        if 'yhat_upper' in forecast_total.columns and 'yhat_lower' in forecast_total.columns:
-            fig_forecast_total.add_traces([
-                px.line(forecast_total, x='ds', y='yhat_upper').data[0],
-                px.line(forecast_total, x='ds', y='yhat_lower').data[0]
-            ])
-            fig_forecast_total.data[1].name = 'Upper Bound'
-            fig_forecast_total.data[2].name = 'Lower Bound'
-
-if os.path.exists(forecast_type_path):
-    forecast_type = pd.read_csv(forecast_type_path)
-    if 'ds' in forecast_type.columns and 'yhat' in forecast_type.columns and 'production_type' in forecast_type.columns:
-        fig_forecast_type = px.line(
-            forecast_type,
-            x='ds',
-            y='yhat',
-            color='production_type',
-            title='Power Forecast by Production Type',
-            labels={'yhat': 'Forecasted Power (GWh)', 'ds': 'Month', 'production_type': 'Production Type'}
-        )
-        if 'yhat_upper' in forecast_type.columns and 'yhat_lower' in forecast_type.columns:
-            for prod_type in forecast_type['production_type'].unique():
-                subset = forecast_type[forecast_type['production_type'] == prod_type]
-                fig_forecast_type.add_traces([
-                    px.line(subset, x='ds', y='yhat_upper').data[0],
-                    px.line(subset, x='ds', y='yhat_lower').data[0]
-                ])
-                fig_forecast_type.data[-2].name = f'{prod_type} Upper Bound'
-                fig_forecast_type.data[-1].name = f'{prod_type} Lower Bound'
-
-fig_forecasted_carbon = None
-if 'forecast_total' in locals() and not forecast_total.empty and 'ds' in forecast_total.columns and 'yhat' in forecast_total.columns:
-    if not carbon_report.empty and 'carbon_kg' in carbon_report.columns and 'month' in carbon_report.columns:
-        if 'month' in df.columns and 'value_gwh' in df.columns:
-            merged_hist = pd.merge(
-                carbon_report, df.groupby('month')['value_gwh'].sum().reset_index(),
-                on='month', how='inner')
-            merged_hist = merged_hist[merged_hist['value_gwh'] > 0]
-            if not merged_hist.empty:
-                avg_carbon_intensity = merged_hist['carbon_kg'].sum() / merged_hist['value_gwh'].sum()
-            else:
-                avg_carbon_intensity = 0
-        else:
-            avg_carbon_intensity = 0
+        st.info('Weather data not available.')
+
+def anomalies_section(version, filters):
+    fig_anomalies = (prebuilt_figure('anomalies') if unfiltered(version, filters) else None) or \
+        anomalies_figure(file_version(ANOMALIES_CSV), filters)
+    st.header('🚨 Anomalies in Power Data')
+    st.write('Highlights unusual or unexpected values in power data using statistical anomaly detection. Use this to quickly spot data quality issues or operational outliers.')
+    if fig_anomalies:
+        st.plotly_chart(fig_anomalies, use_container_width=True)
+    else:
+        st.info('Anomaly data not available.')
+
+def carbon_section(version, filters):
+    fig_carbon = (prebuilt_figure('carbon') if unfiltered(version, filters) else None) or \
+        carbon_figure(carbon_version(), filters)
+    st.header('🌱 Carbon Emissions')
+    st.write('Displays the monthly carbon emissions associated with power production. Track progress towards sustainability and emissions reduction goals.')
+    if fig_carbon:
+        st.plotly_chart(fig_carbon, use_container_width=True)
+    else:
+        st.info('Carbon emissions data not available.')
+
+    carbon_summary = filter_frame(read_output(CARBON_REPORT_CSV), filters)
+    st.header('📋 Carbon Emissions Report')
+    st.write('Detailed table of carbon emissions data for further analysis and reporting.')
+    if not carbon_summary.empty:
+        st.dataframe(carbon_summary, use_container_width=True, hide_index=True)
+    else:
+        st.info('Carbon report not available.')
+
+def forecasts_section(version, filters):
+    st.header('🔮 Forecasts')
+    st.write('Forecasts future power production using statistical models. Includes uncertainty intervals to support planning and risk assessment.')
+    fig_forecast_total = prebuilt_figure('forecast_total') or forecast_total_figure(file_version(FORECAST_RESULTS_CSV))
+    if fig_forecast_total:
+        st.plotly_chart(fig_forecast_total, use_container_width=True)
+    else:
+        st.info('Total forecast data not available.')
+    fig_forecast_type = (prebuilt_figure('forecast_type') if unfiltered(version, filters, dates=False) else None) or \
+        forecast_type_figure(file_version(FORECAST_BY_TYPE_CSV), filters)
+    if fig_forecast_type:
+        st.plotly_chart(fig_forecast_type, use_container_width=True)
     else:
-        avg_carbon_intensity = 0
-    forecasted_carbon = forecast_total.copy()
-    forecasted_carbon['forecasted_carbon_kg'] = forecasted_carbon['yhat'] * avg_carbon_intensity
-    fig_forecasted_carbon = px.line(
-        forecasted_carbon,
-        x='ds',
-        y='forecasted_carbon_kg',
-        title='Forecasted Carbon Emissions',
-        labels={'forecasted_carbon_kg': 'Forecasted Carbon Emissions (kg)', 'ds': 'Month'}
-    )
+        st.info('Forecast by type data not available.')
+
+    st.header('🌍 Forecasted Carbon Emissions')
+    st.write('This graph estimates future carbon emissions based on forecasted power production and average historical carbon intensity. Use it to visualize the expected impact of decarbonization efforts and energy transition policies.')
+    fig_forecasted_carbon = (prebuilt_figure('forecasted_carbon') if unfiltered(version, filters) else None) or \
+        forecasted_carbon_figure(carbon_version(), file_version(FORECAST_RESULTS_CSV), filters)
+    if fig_forecasted_carbon:
+        st.plotly_chart(fig_forecasted_carbon, use_container_width=True)
+    else:
+        st.info('Forecasted carbon emissions data not available.')
+
+# Only the selected section fetches its data and builds its figures
+SECTIONS = {
+    'Overview': overview_section,
+    'Production': production_section,
+    'Consumption': consumption_section,
+    'Weather': weather_section,
+    'Anomalies': anomalies_section,
+    'Carbon': carbon_section,
+    'Forecasts': forecasts_section,
+}
 
 # --- Streamlit Layout ---
-st.set_page_config(page_title='GreenPower Dashboard', layout='wide', page_icon=':bar_chart:')
 st.markdown('<style>div.block-container{padding-top:2rem;} .stHeader {color:#2E8B57;} .st-emotion-cache-1v0mbdj {background: #f5f7fa;} .st-emotion-cache-1v0mbdj h1 {color: #2E8B57;} .st-emotion-cache-1v0mbdj h2 {color: #1976D2;} .st-emotion-cache-1v0mbdj h3 {color: #388E3C;} .st-emotion-cache-1v0mbdj h4 {color: #F57C00;} .st-emotion-cache-1v0mbdj h5 {color: #C62828;} .st-emotion-cache-1v0mbdj h6 {color: #6D4C41;} .stDataFrame {background: #f9f9f9; border-radius: 10px; box-shadow: 0 2px 8px #b2dfdb;} .stPlotlyChart {background: #fff; border-radius: 10px; box-shadow: 0 2px 8px #b2dfdb;}</style>', unsafe_allow_html=True)
 st.title('GreenPower Data Dashboard')
-st.markdown('''<div style="font-size:18px; color:#444; background:#e3f2fd; border-radius:8px; padding:18px 24px; margin-bottom:30px; border-left: 6px solid #1976D2;">\
-<b>Welcome!</b> This dashboard provides a <b>comprehensive overview</b> of power generation, consumption, weather impact, anomalies, carbon emissions, and forecasts for energy data.<br>\
-Use the visualizations and tables below to <b>explore trends</b>, <b>detect issues</b>, and <b>support data-driven decisions</b>.<br>\
-</div>''', unsafe_allow_html=True)
 
 # Add a sidebar with logo and navigation
 if os.path.exists('data/logo.png'):
@@ -171,76 +320,22 @@ if os.path.exists('data/logo.png'):
 else:
     st.sidebar.text("Logo not found")
 st.sidebar.title('GreenPower Utilities')
-st.sidebar.markdown('''---\n**Navigation**\n- Overview\n- Production\n- Consumption\n- Weather\n- Anomalies\n- Carbon\n- Forecasts\n''')
-
-# --- Section: Power Production Distribution ---
-st.header('⚡ Power Production Distribution')
-st.write('Visualizes the monthly distribution of power production by type. Use this to identify which energy sources contribute most to the grid and how production varies over time.')
-st.plotly_chart(fig, use_container_width=True)
-
-# --- Section: Monthly Production Summary ---
-st.header('📊 Monthly Production Summary')
-st.write('Tabular summary of total power produced each month, broken down by production type. Useful for quick comparisons and reporting.')
-st.dataframe(summary, use_container_width=True, hide_index=True)
-
-# --- Section: Monthly Consumption ---
-st.header('🔌 Monthly Consumption')
-st.write('Shows the total electricity consumption per month for each country. Track demand trends and seasonal patterns.')
-st.plotly_chart(fig_consumption, use_container_width=True)
-
-# --- Section: Weather vs Consumption ---
-st.header('🌦️ Weather vs Consumption')
-st.write('Examines the relationship between average temperature and electricity consumption. Helps understand how weather impacts energy demand.')
-if fig_weather:
-    st.plotly_chart(fig_weather, use_container_width=True)
-else:
-    st.info('Weather data not available.')
+st.sidebar.markdown('---')
+section = st.sidebar.radio('Navigation', list(SECTIONS))
+st.sidebar.markdown('---\n**Filters**')
 
-# --- Section: Anomalies in Power Data ---
-st.header('🚨 Anomalies in Power Data')
-st.write('Highlights unusual or unexpected values in power data using statistical anomaly detection. Use this to quickly spot data quality issues or operational outliers.')
-if fig_anomalies:
-    st.plotly_chart(fig_anomalies, use_container_width=True)
-else:
-    st.info('Anomaly data not available.')
+timings = {}
+start = time.perf_counter()
+version = run_marker_version()
+filters = sidebar_filters(version)
+timings['Filters'] = time.perf_counter() - start
 
-# --- Section: Carbon Emissions ---
-st.header('🌱 Carbon Emissions')
-st.write('Displays the monthly carbon emissions associated with power production. Track progress towards sustainability and emissions reduction goals.')
-if fig_carbon:
-    st.plotly_chart(fig_carbon, use_container_width=True)
-else:
-    st.info('Carbon emissions data not available.')
+start = time.perf_counter()
+SECTIONS[section](version, filters)
+timings[section] = time.perf_counter() - start
 
-# --- Section: Carbon Emissions Report ---
-st.header('📋 Carbon Emissions Report')
-st.write('Detailed table of carbon emissions data for further analysis and reporting.')
-if not carbon_summary.empty:
-    st.dataframe(carbon_summary, use_container_width=True, hide_index=True)
-else:
-    st.info('Carbon report not available.')
-
-# --- Section: Raw Power Data ---
-st.header('🗃️ Raw Power Data')
-st.write('Full raw power data for transparency and custom analysis. Use filters and sorting to explore the dataset.')
-st.dataframe(df, use_container_width=True, hide_index=True)
-
-# --- Section: Forecasts ---
-st.header('🔮 Forecasts')
-st.write('Forecasts future power production using statistical models. Includes uncertainty intervals to support planning and risk assessment.')
-if fig_forecast_total:
-    st.plotly_chart(fig_forecast_total, use_container_width=True)
-else:
-    st.info('Total forecast data not available.')
-if fig_forecast_type:
-    st.plotly_chart(fig_forecast_type, use_container_width=True)
-else:
-    st.info('Forecast by type data not available.')
-
-# --- Section: Forecasted Carbon Emissions ---
-st.header('🌍 Forecasted Carbon Emissions')
-st.write('This graph estimates future carbon emissions based on forecasted power production and average historical carbon intensity. Use it to visualize the expected impact of decarbonization efforts and energy transition policies.')
-if fig_forecasted_carbon:
-    st.plotly_chart(fig_forecasted_carbon, use_container_width=True)
-else:
-    st.info('Forecasted carbon emissions data not available.')
+# Debug panel: time spent building and rendering each part of this run
+if st.sidebar.checkbox('Show timings'):
+    with st.sidebar.expander('Timings', expanded=True):
+        for name, seconds in timings.items():
+            st.write(f'{name}: {seconds * 1000:.0f} ms')
@@ -1,46 +1,193 @@
-from sqlalchemy import create_engine, MetaData, Table, Column, String, Float, text
-from config import DB_URI
+import argparse
 
-engine = create_engine(DB_URI)
+from sqlalchemy import MetaData, Table, Column, String, Float, Date, Integer, Index, inspect, text, select, func
+from config import DB_TIMESCALE, DB_CHUNK_INTERVAL
+from db.engine import get_engine
+from ingestion.watermarks import load_watermarks, save_watermarks, reset_watermarks
+
+engine = get_engine()
 metadata = MetaData()
 
-# Define tables
+# Define tables. month holds the first day of the month; keys cover the (country, month) lookups
+# every reader makes, and the INCLUDE columns let Postgres answer them from the index alone.
 power_data = Table(
     "power_data", metadata,
-    Column("country", String),
-    Column("month", String),
-    Column("production_type", String),
-    Column("value_gwh", Float)
+    Column("country", String, primary_key=True),
+    Column("month", Date, primary_key=True),
+    Column("production_type", String, primary_key=True),
+    Column("value_gwh", Float),
+    # Dashboard and rollups scan a month range across countries and types
+    Index("ix_power_data_month_type", "month", "production_type", postgresql_include=["country", "value_gwh"]),
 )
 
 consumption_data = Table(
     "consumption_data", metadata,
-    Column("country", String),
-    Column("month", String),
+    Column("country", String, primary_key=True),
+    Column("month", Date, primary_key=True),
     Column("total_consumption_gwh", Float),
-    Column("household_consumption_gwh", Float)  # Optional, if you estimate household consumption
+    Column("household_consumption_gwh", Float),  # Optional, if you estimate household consumption
+    # Forecasting reads one country's consumption series in month order
+    Index("ix_consumption_data_country_month", "country", "month", postgresql_include=["total_consumption_gwh"]),
 )
 
 weather_data = Table(
     "weather_data", metadata,
-    Column("country", String),
-    Column("month", String),
+    Column("country", String, primary_key=True),
+    Column("month", Date, primary_key=True),
     Column("avg_temp_c", Float),
     Column("precip_mm", Float),
-    Column("wind_kmh", Float)
+    Column("wind_kmh", Float),
+    Index("ix_weather_data_country_month", "country", "month",
+          postgresql_include=["avg_temp_c", "precip_mm", "wind_kmh"]),
+)
+
+# Pre-aggregated rollups kept in step with the tables above by db.rollups after every load
+# Factor resolved by analytics.carbon for each (country, production_type, year) in power_data
+emission_factors = Table(
+    "emission_factors", metadata,
+    Column("country", String, primary_key=True),
+    Column("production_type", String, primary_key=True),
+    Column("year", Integer, primary_key=True),
+    Column("kg_per_mwh", Float, nullable=False),
+)
+
+rollup_monthly_type = Table(
+    "rollup_monthly_type", metadata,
+    Column("country", String, primary_key=True),
+    Column("month", Date, primary_key=True),
+    Column("production_type", String, primary_key=True),
+    Column("value_gwh", Float),
+    Column("carbon_kg", Float),
 )
 
+rollup_monthly = Table(
+    "rollup_monthly", metadata,
+    Column("country", String, primary_key=True),
+    Column("month", Date, primary_key=True),
+    Column("production_gwh", Float),
+    Column("carbon_kg", Float),
+    Column("consumption_gwh", Float),
+)
+
+rollup_yearly = Table(
+    "rollup_yearly", metadata,
+    Column("country", String, primary_key=True),
+    Column("year", Integer, primary_key=True),
+    Column("production_type", String, primary_key=True),
+    Column("value_gwh", Float),
+    Column("carbon_kg", Float),
+    Column("months", Integer),
+)
+
+# Raw monthly tables; only these are migrated and partitioned by time
+TIME_SERIES_TABLES = [power_data, consumption_data, weather_data]
+
 def drop_tables():
-    with engine.connect() as conn:
-        conn.execute(text("DROP TABLE IF EXISTS power_data CASCADE"))
-        conn.execute(text("DROP TABLE IF EXISTS consumption_data CASCADE"))
-        conn.execute(text("DROP TABLE IF EXISTS weather_data CASCADE"))
+    with engine.begin() as conn:
+        for table in reversed(metadata.sorted_tables):
+            conn.execute(text(f"DROP TABLE IF EXISTS {table.name} CASCADE"))
         print("All tables dropped.")
+    # The loaded rows are gone, so the next load has to start from scratch
+    save_watermarks(reset_watermarks(load_watermarks(), "db"), source="db")
+
+def create_hypertables(conn):
+    # Partition each table by month; the primary keys already include the time column as TimescaleDB requires
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS timescaledb"))
+    for table in TIME_SERIES_TABLES:
+        conn.execute(text(
+            "SELECT create_hypertable(:table, 'month', chunk_time_interval => CAST(:interval AS INTERVAL), "
+            "if_not_exists => TRUE, migrate_data => TRUE)"
+        ), {"table": table.name, "interval": DB_CHUNK_INTERVAL})
+    print("Hypertables created.")
 
 def create_tables():
     metadata.create_all(engine)
+    if DB_TIMESCALE and engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            create_hypertables(conn)
     print("All tables created.")
 
-if __name__ == "__main__":
-    drop_tables()
+def legacy_tables(conn):
+    # Tables created by the old schema store month as text
+    existing = inspect(conn)
+    legacy = []
+    for table in TIME_SERIES_TABLES:
+        if existing.has_table(table.name):
+            month = next(col for col in existing.get_columns(table.name) if col["name"] == "month")
+            if isinstance(month["type"], String):
+                legacy.append(table)
+    return legacy
+
+def migrate_tables():
+    """
+    Converts tables from the old schema (text month, no keys) in place: each is renamed aside, recreated with
+    the new schema and refilled with month parsed to a date. Duplicate rows left by earlier appends collapse
+    onto their key, keeping the largest value.
+    """
+    with engine.begin() as conn:
+        tables = legacy_tables(conn)
+        if not tables:
+            print("Schema is up to date, nothing to migrate.")
+            return
+        if conn.dialect.name == "postgresql":
+            month = "to_date(month, 'YYYY-MM')"
+        else:
+            month = "date(month || '-01')"
+        for table in tables:
+            conn.execute(text(f"ALTER TABLE {table.name} RENAME TO {table.name}_legacy"))
+        metadata.create_all(conn, tables=tables)
+        for table in tables:
+            keys = [col.name for col in table.primary_key.columns]
+            values = [col.name for col in table.columns if col.name not in keys]
+            select_keys = [month if key == "month" else key for key in keys]
+            conn.execute(text(
+                f"INSERT INTO {table.name} ({', '.join(keys + values)}) "
+                f"SELECT {', '.join(select_keys + [f'MAX({value})' for value in values])} "
+                f"FROM {table.name}_legacy WHERE {' AND '.join(f'{key} IS NOT NULL' for key in keys)} "
+                f"GROUP BY {', '.join(select_keys)}"
+            ))
+            conn.execute(text(f"DROP TABLE {table.name}_legacy"))
+            print(f"Migrated {table.name}.")
+    create_tables()
+
+def database_state():
+    """
+    The target database and the row count of each raw table. No rows while the db watermark is set means the
+    database was wiped or replaced since the last load, so the watermark is reset and the next load starts over.
+    """
+    with engine.connect() as conn:
+        rows = {table.name: conn.execute(select(func.count()).select_from(table)).scalar() for table in TIME_SERIES_TABLES}
+    watermarks = load_watermarks()
+    if not any(rows.values()) and watermarks.get("db"):
+        print("The database holds no loaded rows; the next load starts from scratch.")
+        save_watermarks(reset_watermarks(watermarks, "db"), source="db")
+    return {"uri": engine.url.render_as_string(hide_password=True), "rows": rows}
+
+def setup_schema(drop=False):
+    """
+    Creates the missing tables and returns database_state(). Tables left by the old schema are converted in
+    place first, so loads never run against them.
+    """
+    if drop:
+        drop_tables()
+    else:
+        with engine.connect() as conn:
+            legacy = legacy_tables(conn)
+        if legacy:
+            print(f"Migrating tables from the old schema: {', '.join(table.name for table in legacy)}.")
+            migrate_tables()
+            return database_state()
     create_tables()
+    return database_state()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create the database tables (existing tables are kept, and "
+                                                 "converted if they were created by the old schema).")
+    parser.add_argument("--drop", action="store_true", help="Drop and recreate all tables.")
+    parser.add_argument("--migrate", action="store_true",
+                        help="Only convert tables created by the old schema (text month, no keys) keeping their rows.")
+    args = parser.parse_args()
+    if args.migrate:
+        migrate_tables()
+    else:
+        setup_schema(drop=args.drop)
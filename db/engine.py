@@ -0,0 +1,48 @@
+"""
+Shared database engine. Every module goes through get_engine(), so one connection pool per database URI
+is built per process and connections stay warm across queries and dashboard renders. create_db_engine() builds
+a fresh engine with the same settings for callers that own and dispose of it, such as the benchmarks.
+"""
+from functools import lru_cache
+
+import pandas as pd
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
+from config import DB_URI, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_STATEMENT_TIMEOUT_MS
+
+
+def create_db_engine(uri=DB_URI):
+    if is_sqlite(uri):
+        # sqlite picks its own pool class per file or in-memory database
+        return create_engine(uri, pool_pre_ping=True)
+    engine = create_engine(uri, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                           pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True)
+
+    @event.listens_for(engine, "connect")
+    def set_statement_timeout(dbapi_connection, connection_record):
+        # Applied once per pooled connection rather than on every query
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"SET statement_timeout = {int(DB_STATEMENT_TIMEOUT_MS)}")
+        cursor.close()
+        dbapi_connection.commit()
+
+    return engine
+
+
+@lru_cache(maxsize=None)
+def get_engine(uri=DB_URI):
+    return create_db_engine(uri)
+
+
+def is_sqlite(uri):
+    return make_url(uri).get_backend_name() == "sqlite"
+
+
+def read_query(sql, params=None, engine=None, **kwargs):
+    """
+    Runs a parameterized query and returns a DataFrame. Values are always passed as bound parameters
+    (:name placeholders), never formatted into the SQL.
+    """
+    statement = text(sql) if isinstance(sql, str) else sql
+    with (engine or get_engine()).connect() as conn:
+        return pd.read_sql(statement, conn, params=params, **kwargs)
@@ -1,44 +1,128 @@
+import argparse
+import io
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import pandas as pd
-from sqlalchemy import create_engine
-from config import DB_URI, MERGED_DATA_CSV, COUNTRIES, WEATHER_COLS, PROCESSED_WEATHER_COLS
-
-# Load merged data
-merged = pd.read_csv(MERGED_DATA_CSV)
-
-# --- POWER DATA ---
-# Debug: Check unique values in Balance and country
-print('Unique Balance values:', merged['Balance'].unique())
-print('Unique country values:', merged['country'].unique())
-
-# Select production rows (e.g., Balance == 'Net Electricity Production')
-power = merged[
-    (merged['country'].isin(COUNTRIES)) &
-    (merged['Balance'].str.strip().str.lower() == 'net electricity production'.lower())
-][["country", "month", "production_type", "value_gwh"]]
-print('Filtered power shape:', power.shape)
-print('Sample power data:', power.head())
-
-# --- CONSUMPTION DATA ---
-# Select total consumption rows (e.g., Balance == 'Final Consumption Calculated')
-consumption = merged[
-    (merged['country'].isin(COUNTRIES)) &
-    (merged['Balance'].str.strip() == 'Final Consumption (Calculated)')
-][["country", "month", "value_gwh"]].rename(columns={'value_gwh': 'total_consumption_gwh'})
-
-# Estimate household consumption (optional, adjust ratio as needed)
-consumption['household_consumption_gwh'] = consumption['total_consumption_gwh'] * 0.3
-
-# --- WEATHER DATA ---
-# Select relevant weather columns (these may already be merged for each month)
-weather = merged[PROCESSED_WEATHER_COLS + ["country", "month"]].drop_duplicates()
-
-# --- LOAD TO DATABASE ---
-engine = create_engine(DB_URI)
-
-# Load each DataFrame to the appropriate table
-print(power.shape)
-power.to_sql("power_data", engine, if_exists="append", index=False)
-consumption.to_sql("consumption_data", engine, if_exists="append", index=False)
-weather.to_sql("weather_data", engine, if_exists="append", index=False)
-
-print("Data loaded successfully into TimescaleDB.")
+from sqlalchemy import text
+from config import (MERGED_DATA_DIR, COUNTRIES, WEATHER_COLS, PROCESSED_WEATHER_COLS, PRODUCTION_BALANCE,
+                    CONSUMPTION_BALANCE, DB_LOAD_WORKERS)
+from db.engine import get_engine
+from db.rollups import refresh
+from ingestion.store import read_merged
+from pipeline.run_marker import publish_run_marker
+from ingestion.watermarks import load_watermarks, save_watermarks, reset_watermarks, since_watermark, advance_watermark, get_watermark
+
+
+def split_merged(merged, countries=COUNTRIES):
+    # The tables key on a DATE month (first day of the month)
+    merged = merged[merged['country'].isin(countries)]
+    merged = merged.assign(month=pd.to_datetime(merged['month'].astype(str), format='%Y-%m').dt.date)
+
+    # --- POWER DATA ---
+    # Select production rows (e.g., Balance == 'Net Electricity Production')
+    power = merged[
+        merged['Balance'].str.strip().str.lower() == PRODUCTION_BALANCE.lower()
+    ][["country", "month", "production_type", "value_gwh"]].drop_duplicates(["country", "month", "production_type"], keep="last")
+
+    # --- CONSUMPTION DATA ---
+    # Select total consumption rows (e.g., Balance == 'Final Consumption (Calculated)')
+    consumption = merged[
+        merged['Balance'].str.strip() == CONSUMPTION_BALANCE
+    ][["country", "month", "value_gwh"]].drop_duplicates(["country", "month"], keep="last").rename(columns={'value_gwh': 'total_consumption_gwh'})
+
+    # Estimate household consumption (optional, adjust ratio as needed)
+    consumption['household_consumption_gwh'] = consumption['total_consumption_gwh'] * 0.3
+
+    # --- WEATHER DATA ---
+    # Select relevant weather columns (these may already be merged for each month)
+    weather = merged[PROCESSED_WEATHER_COLS + ["country", "month"]].drop_duplicates(["country", "month"], keep="last")
+    return power, consumption, weather
+
+
+def copy_rows(conn, staging, df):
+    columns = ", ".join(df.columns)
+    if conn.dialect.name == "postgresql":
+        # Stream the frame through COPY as CSV; empty fields load as NULL
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY {staging} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        finally:
+            cursor.close()
+    else:
+        # Databases without COPY (sqlite in tests) get a single executemany batch
+        placeholders = ", ".join(f":{column}" for column in df.columns)
+        records = df.astype(object).where(df.notna(), None).to_dict("records")
+        conn.execute(text(f"INSERT INTO {staging} ({columns}) VALUES ({placeholders})"), records)
+
+
+def upsert_table(engine, table, df, keys=("country", "month")):
+    """
+    Bulk-loads df into a temporary staging table, then replaces the key slices of table found in staging,
+    all in one transaction. Loading the same months twice leaves the table unchanged.
+    """
+    if df.empty:
+        return 0
+    staging = f"staging_{table}"
+    columns = ", ".join(df.columns)
+    match = " AND ".join(f"s.{key} = {table}.{key}" for key in keys)
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE TEMPORARY TABLE {staging} AS SELECT {columns} FROM {table} WHERE 1 = 0"))
+        copy_rows(conn, staging, df)
+        conn.execute(text(f"DELETE FROM {table} WHERE EXISTS (SELECT 1 FROM {staging} s WHERE {match})"))
+        conn.execute(text(f"INSERT INTO {table} ({columns}) SELECT {columns} FROM {staging}"))
+        # Temporary tables live as long as the pooled connection, so drop it before handing it back
+        conn.execute(text(f"DROP TABLE {staging}"))
+    return len(df)
+
+
+def load_tables(engine, power, consumption, weather, max_workers=DB_LOAD_WORKERS):
+    tables = {"power_data": power, "consumption_data": consumption, "weather_data": weather}
+    if engine.dialect.name == "sqlite":
+        # sqlite allows a single writer at a time
+        max_workers = 1
+    # Each table loads in its own transaction on its own pooled connection
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(upsert_table, engine, table, df): table for table, df in tables.items()}
+        for future in as_completed(futures):
+            print(f"Loaded {future.result()} rows into {futures[future]}.")
+
+
+def load(merged=None, full=False):
+    watermarks = load_watermarks()
+    if full:
+        reset_watermarks(watermarks, "db")
+    if merged is None:
+        # Load merged data, pushing the watermark down to the partition scan
+        marks = [get_watermark(watermarks, "db", country) for country in COUNTRIES]
+        start_month = min(marks) if marks and all(marks) else None
+        merged = read_merged(MERGED_DATA_DIR, columns=["country", "month", "Balance", "production_type", "value_gwh"] + PROCESSED_WEATHER_COLS,
+                             countries=COUNTRIES, start_month=start_month)
+    merged = since_watermark(merged, watermarks, "db")
+    print(f"Loading {merged['month'].nunique()} new or updated months.")
+
+    power, consumption, weather = split_merged(merged)
+    print('Filtered power shape:', power.shape)
+
+    # --- LOAD TO DATABASE ---
+    engine = get_engine()
+    load_tables(engine, power, consumption, weather)
+    # Re-sum only the months this load touched; a full load rebuilds the rollups
+    refresh(engine, None if full else set(power['month']) | set(consumption['month']))
+    save_watermarks(advance_watermark(watermarks, "db", merged[merged['country'].isin(COUNTRIES)]), source="db")
+    publish_run_marker("db")
+
+    print("Data loaded successfully into TimescaleDB.")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load the merged data into the database.")
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and reload every month.")
+    args = parser.parse_args(argv)
+    load(full=args.full)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Parameterized read queries used by the dashboard. Filters are pushed into the WHERE clause as bound
+parameters (lists expand to IN (...)), and the raw power table is read one page at a time with keyset
+pagination on its primary key.
+"""
+from sqlalchemy import text, bindparam
+from db.engine import read_query
+
+# Primary key of power_data, in the order pages are returned
+POWER_KEYS = ("country", "month", "production_type")
+
+
+def filter_clauses(countries=None, production_types=None, start_month=None, end_month=None):
+    # Returns the WHERE conditions, their parameters and the list parameters that expand to IN (...)
+    clauses, params, expanding = [], {}, []
+    if countries:
+        clauses.append("country IN :countries")
+        params["countries"] = list(countries)
+        expanding.append("countries")
+    if production_types:
+        clauses.append("production_type IN :production_types")
+        params["production_types"] = list(production_types)
+        expanding.append("production_types")
+    if start_month is not None:
+        clauses.append("month >= :start_month")
+        params["start_month"] = start_month
+    if end_month is not None:
+        clauses.append("month <= :end_month")
+        params["end_month"] = end_month
+    return clauses, params, expanding
+
+
+def _statement(sql, expanding):
+    return text(sql).bindparams(*[bindparam(name, expanding=True) for name in expanding])
+
+
+def read_filtered(table, columns="*", order_by="country, month", engine=None, **filters):
+    """
+    Reads the rows of table matching the filters (countries, production_types, start_month, end_month).
+    Only pass production_types for tables that have that column.
+    """
+    clauses, params, expanding = filter_clauses(**filters)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = f"SELECT {columns} FROM {table}{where} ORDER BY {order_by}"
+    return read_query(_statement(sql, expanding), params, engine=engine)
+
+
+def read_power_page(after=None, limit=100, engine=None, **filters):
+    """
+    Returns up to limit power_data rows following the key tuple after (country, month, production_type),
+    in key order. Pass the last row's keys of one page to get the next; the key comparison uses the
+    primary key index, so every page costs the same however deep it is.
+    """
+    clauses, params, expanding = filter_clauses(**filters)
+    if after is not None:
+        clauses.append(f"({', '.join(POWER_KEYS)}) > (:after_country, :after_month, :after_type)")
+        params.update(zip(("after_country", "after_month", "after_type"), after))
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = f"SELECT * FROM power_data{where} ORDER BY {', '.join(POWER_KEYS)} LIMIT :limit"
+    params["limit"] = limit
+    return read_query(_statement(sql, expanding), params, engine=engine)
+
+
+def read_filter_options(engine=None):
+    # Sidebar choices come from the small monthly rollup rather than the raw table
+    types = read_query("SELECT DISTINCT country, production_type FROM rollup_monthly_type", engine=engine)
+    months = read_query("SELECT MIN(month) AS first_month, MAX(month) AS last_month FROM rollup_monthly",
+                        engine=engine)
+    return {
+        "countries": sorted(types["country"].unique()),
+        "production_types": sorted(types["production_type"].unique()),
+        "first_month": months["first_month"].iloc[0],
+        "last_month": months["last_month"].iloc[0],
+    }
@@ -0,0 +1,113 @@
+"""
+Pre-aggregated rollups of the loaded tables: monthly totals by type, monthly production/carbon/consumption
+per country and yearly summaries. After each load only the months and years it touched are re-summed,
+so readers query a few hundred rows instead of aggregating power_data themselves.
+"""
+import argparse
+
+import pandas as pd
+from sqlalchemy import select, insert, delete, func, and_, extract, inspect
+from config import PRODUCTION_HIERARCHY
+from analytics.carbon import FALLBACK_FACTOR, load_factor_table, lookup_factors
+from db.db_schema import (engine, power_data, consumption_data, emission_factors, rollup_monthly_type,
+                          rollup_monthly, rollup_yearly)
+
+
+def sync_emission_factors(conn, years=None):
+    """
+    Resolves the factor of every (country, production_type, year) in power_data for the given years (all when
+    None) with analytics.carbon, so the rollups and the carbon cube use the same factors.
+    """
+    existing = inspect(conn)
+    columns = {column["name"] for column in existing.get_columns(emission_factors.name)} \
+        if existing.has_table(emission_factors.name) else set()
+    if "country" not in columns:
+        # Missing, or from before factors varied by country and year; it only holds derived rows
+        emission_factors.drop(conn, checkfirst=True)
+        emission_factors.create(conn)
+        years = None
+    year = extract("year", power_data.c.month)
+    conn.execute(delete(emission_factors).where(_in(emission_factors.c.year, years)))
+    rows = conn.execute(select(power_data.c.country, power_data.c.production_type, year).distinct()
+                        .where(_in(year, years))).all()
+    if not rows:
+        return
+    keys = pd.DataFrame(rows, columns=["country", "production_type", "year"])
+    keys["kg_per_mwh"] = lookup_factors(keys.assign(month=keys["year"].astype(int).astype(str) + "-01"),
+                                        load_factor_table())
+    conn.execute(insert(emission_factors), keys.astype({"year": int}).to_dict("records"))
+
+
+def _in(column, values):
+    # None means every row
+    return column.in_(values) if values is not None else True
+
+
+def refresh_monthly_type(conn, months):
+    conn.execute(delete(rollup_monthly_type).where(_in(rollup_monthly_type.c.month, months)))
+    factor = func.coalesce(emission_factors.c.kg_per_mwh, FALLBACK_FACTOR)
+    source = power_data.outerjoin(emission_factors, and_(
+        power_data.c.country == emission_factors.c.country,
+        power_data.c.production_type == emission_factors.c.production_type,
+        extract("year", power_data.c.month) == emission_factors.c.year))
+    query = select(
+        power_data.c.country, power_data.c.month, power_data.c.production_type,
+        func.sum(power_data.c.value_gwh), func.sum(power_data.c.value_gwh * 1000 * factor),
+    ).select_from(source).where(_in(power_data.c.month, months)).group_by(
+        power_data.c.country, power_data.c.month, power_data.c.production_type)
+    conn.execute(insert(rollup_monthly_type).from_select(
+        ["country", "month", "production_type", "value_gwh", "carbon_kg"], query))
+
+
+def refresh_monthly(conn, months):
+    conn.execute(delete(rollup_monthly).where(_in(rollup_monthly.c.month, months)))
+    by_type = rollup_monthly_type.c
+    # Aggregate types such as Electricity already include their leaves, so totals sum the leaves only
+    totals = select(
+        by_type.country, by_type.month,
+        func.sum(by_type.value_gwh).label("production_gwh"), func.sum(by_type.carbon_kg).label("carbon_kg"),
+    ).where(_in(by_type.month, months), by_type.production_type.notin_(list(PRODUCTION_HIERARCHY))).group_by(
+        by_type.country, by_type.month).subquery()
+    source = totals.outerjoin(consumption_data, and_(consumption_data.c.country == totals.c.country,
+                                                     consumption_data.c.month == totals.c.month))
+    query = select(totals.c.country, totals.c.month, totals.c.production_gwh, totals.c.carbon_kg,
+                   consumption_data.c.total_consumption_gwh).select_from(source)
+    conn.execute(insert(rollup_monthly).from_select(
+        ["country", "month", "production_gwh", "carbon_kg", "consumption_gwh"], query))
+
+
+def refresh_yearly(conn, years):
+    conn.execute(delete(rollup_yearly).where(_in(rollup_yearly.c.year, years)))
+    by_type = rollup_monthly_type.c
+    year = extract("year", by_type.month)
+    query = select(
+        by_type.country, year, by_type.production_type,
+        func.sum(by_type.value_gwh), func.sum(by_type.carbon_kg), func.count(),
+    ).where(_in(year, years)).group_by(by_type.country, year, by_type.production_type)
+    conn.execute(insert(rollup_yearly).from_select(
+        ["country", "year", "production_type", "value_gwh", "carbon_kg", "months"], query))
+
+
+def refresh_rollups(conn, months=None):
+    """
+    Re-sums the rollups for the given months (dates, first of the month) and their years, or rebuilds
+    them entirely when months is None. Runs inside the caller's transaction.
+    """
+    months = sorted(set(months)) if months is not None else None
+    years = sorted({month.year for month in months}) if months is not None else None
+    sync_emission_factors(conn, years)
+    refresh_monthly_type(conn, months)
+    refresh_monthly(conn, months)
+    refresh_yearly(conn, years)
+
+
+def refresh(db=None, months=None):
+    with (db or engine).begin() as conn:
+        refresh_rollups(conn, months)
+    print(f"Rollups refreshed for {'all' if months is None else len(set(months))} months.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the rollup tables from the loaded data.")
+    parser.parse_args()
+    refresh()
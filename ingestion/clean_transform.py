@@ -1,13 +1,52 @@
+import argparse
+import os
+import shutil
+
 import pandas as pd
-from config import COUNTRIES, MERGED_DATA_CSV, WEATHER_COLS, IEA_CSV, WEATHER_DATA_CSV
+from config import COUNTRIES, MERGED_DATA_CSV, MERGED_DATA_DIR, WEATHER_COLS, IEA_CSV, WEATHER_DATA_CSV
 from analytics.utils import clean_iea, clean_weather, merge_data
+from ingestion.ingest_iea import read_iea_csv
+from ingestion.store import write_merged, upsert_merged, read_merged, export_csv
+from ingestion.watermarks import load_watermarks, save_watermarks, reset_watermarks, since_watermark, advance_watermark
 
-if __name__ == "__main__":
-    # Example usage for batch processing
-    iea = pd.read_csv(IEA_CSV)
-    weather = pd.read_csv(WEATHER_DATA_CSV)
-    iea = clean_iea(iea, COUNTRIES)
+
+def transform(iea=None, weather=None, full=False, export=False):
+    """
+    Merges the cleaned IEA and weather frames (read from disk when not given) into the merged dataset.
+    Returns the complete merged data after the upsert.
+    """
+    full = full or not os.path.isdir(MERGED_DATA_DIR)
+    watermarks = load_watermarks()
+    if full:
+        reset_watermarks(watermarks, "iea")
+    if iea is None:
+        iea = clean_iea(read_iea_csv(IEA_CSV, COUNTRIES), COUNTRIES)
+    if weather is None:
+        weather = pd.read_csv(WEATHER_DATA_CSV)
     weather = clean_weather(weather, COUNTRIES)
+    # Only months at or after the IEA watermark are merged again and upserted
+    iea = since_watermark(iea, watermarks, "iea")
     merged = merge_data(iea, weather)
-    merged.to_csv(MERGED_DATA_CSV, index=False)
-    print(f"Merged data saved to {MERGED_DATA_CSV}")
+    print(f"Merging {iea['month'].nunique()} new or updated months.")
+    if full:
+        shutil.rmtree(MERGED_DATA_DIR, ignore_errors=True)
+        write_merged(merged)
+    else:
+        upsert_merged(merged)
+    save_watermarks(advance_watermark(watermarks, "iea", iea), source="iea")
+    print(f"Merged data saved to {MERGED_DATA_DIR}")
+    if export:
+        print(f"Merged data exported to {export_csv()}")
+    return read_merged(MERGED_DATA_DIR)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Clean IEA and weather data and merge them by country and month.")
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and rebuild the merged data.")
+    parser.add_argument("--csv", action="store_true", help=f"Also export the merged data to {MERGED_DATA_CSV}.")
+    args = parser.parse_args(argv)
+    return transform(full=args.full, export=args.csv)
+
+
+if __name__ == "__main__":
+    main()
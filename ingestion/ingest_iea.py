@@ -1,18 +1,50 @@
 import pandas as pd
-from config import IEA_CSV, COUNTRIES
+from config import IEA_CSV, COUNTRIES, IEA_CHUNKSIZE
+from analytics.utils import parse_iea_months
+
+IEA_COLUMNS = ['Country', 'country', 'Time', 'Balance', 'Product', 'Value', 'Unit']
+IEA_CATEGORICAL_COLUMNS = ['country', 'Time', 'Balance', 'Product', 'Unit']
+
+
+def read_iea_csv(path=IEA_CSV, countries=COUNTRIES, balances=None, chunksize=IEA_CHUNKSIZE):
+    """
+    Streams an IEA export chunk by chunk, keeping only rows for the given countries (and balances, if given).
+    Peak memory is bounded by the chunk size plus the filtered result, not by the size of the file.
+    """
+    reader = pd.read_csv(
+        path,
+        encoding='utf-8-sig',
+        usecols=lambda col: col in IEA_COLUMNS,
+        dtype={col: 'category' for col in IEA_COLUMNS if col != 'Value'},
+        chunksize=chunksize
+    )
+    chunks = []
+    for chunk in reader:
+        # Handle both 'Country' and 'country'
+        if 'Country' in chunk.columns:
+            chunk = chunk.rename(columns={'Country': 'country'})
+        if 'country' not in chunk.columns:
+            raise ValueError("No 'country' or 'Country' column found in IEA CSV.")
+        mask = chunk['country'].isin(countries)
+        if balances is not None:
+            mask &= chunk['Balance'].isin(balances)
+        chunk = chunk[mask]
+        chunk = chunk.assign(Value=pd.to_numeric(chunk['Value'], errors='coerce').astype('float32'))
+        chunks.append(chunk)
+    df = pd.concat(chunks, ignore_index=True)
+    # Chunks carry their own category sets, so unify them once on the (small) filtered result
+    for col in IEA_CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype(object).astype('category')
+    return df
+
 
 def load_iea_data():
-    df = pd.read_csv(IEA_CSV)
-    # Handle both 'Country' and 'country'
-    if 'Country' in df.columns:
-        df = df.rename(columns={'Country': 'country'})
-    if 'country' not in df.columns:
-        raise ValueError("No 'country' or 'Country' column found in IEA CSV.")
+    df = read_iea_csv(IEA_CSV, COUNTRIES)
     # Rename 'Time' to 'month' for clarity and consistency
     df = df.rename(columns={'Time': 'month'})
     # Convert 'month' to standard YYYY-MM format
-    df['month'] = pd.to_datetime(df['month'], format='%y-%b').dt.to_period('M').astype(str)
-    df = df[df['country'].isin(COUNTRIES)]
+    df['month'] = parse_iea_months(df['month'])
     return df
 
 if __name__ == "__main__":
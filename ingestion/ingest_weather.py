@@ -1,11 +1,21 @@
+import argparse
+import os
 from calendar import monthrange
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-from config import WEATHER_API_BASE, LOCATIONS, START_YEAR, END_YEAR, COUNTRIES, WEATHER_COLS, PROCESSED_WEATHER_COLS, WEATHER_DATA_CSV
+from config import (WEATHER_API_BASE, LOCATIONS, START_YEAR, END_YEAR, COUNTRIES, WEATHER_COLS, PROCESSED_WEATHER_COLS,
+                    WEATHER_DATA_CSV, WEATHER_TIMEZONE, WEATHER_BATCH_MONTHS, WEATHER_MAX_WORKERS, WEATHER_MAX_RETRIES,
+                    WEATHER_BACKOFF_FACTOR, WEATHER_TIMEOUT, WEATHER_CACHE_DIR, WEATHER_CACHE_MAX_BYTES, WEATHER_OFFLINE)
+from ingestion.weather_cache import cache_key, load_cached, store_cached, evict
+from ingestion.watermarks import (load_watermarks, save_watermarks, get_watermark, reset_watermarks, advance_watermark,
+                                  cap_watermark, upsert_rows)
 
 CURRENT_DATE = datetime.strptime("2025-07-13", "%Y-%m-%d")
 
@@ -51,63 +61,216 @@ def adjust_end_date(year, month, current_date):
     return end_date.strftime("%Y-%m-%d"), last_iteration
 
 
-def fetch_weather(country, lat, lon):
-    records = []
-    for year in range(START_YEAR, END_YEAR + 1):
+def month_batches(start_year=START_YEAR, end_year=END_YEAR, current_date=CURRENT_DATE, batch_months=WEATHER_BATCH_MONTHS,
+                  since=None):
+    """
+    Groups the months to fetch into (start_date, end_date) ranges of at most batch_months adjacent months.
+    The open-ended current month is always returned as its own range. Months before since (YYYY-MM) are skipped.
+    """
+    batches = []
+    pending = []
+
+    def flush():
+        if pending:
+            first_year, first_month = pending[0]
+            last_year, last_month = pending[-1]
+            end_date, _ = adjust_end_date(last_year, last_month, current_date)
+            batches.append((f"{first_year}-{first_month:02d}-01", end_date))
+            pending.clear()
+
+    for year in range(start_year, end_year + 1):
         for month in range(1, 13):
-            if should_skip_month(year, month, CURRENT_DATE):
-                print(f"Skipping {year}-{month:02d} as it is in the future.")
+            if should_skip_month(year, month, current_date):
+                continue
+            if since and f"{year}-{month:02d}" < since:
                 continue
-            start_date = f"{year}-{month:02d}-01"
-            end_date, last_iteration = adjust_end_date(year, month, CURRENT_DATE)
-            params = {
-                "latitude": lat,
-                "longitude": lon,
-                "start_date": start_date,
-                "end_date": end_date,
-                "daily": WEATHER_COLS,
-                "timezone": "Europe/Paris"
-            }
-            print(f"Requesting weather data for {country} {year}-{month:02d} from {start_date} to {end_date}...")
-            resp = requests.get(WEATHER_API_BASE, params=params)
-            data = resp.json()
-            if 'daily' not in data:
-                print(f"API error for {country} {year}-{month:02d}: {data}")
-                if last_iteration:
-                    break
+            end_date, last_iteration = adjust_end_date(year, month, current_date)
+            if last_iteration:
+                flush()
+                batches.append((f"{year}-{month:02d}-01", end_date))
+                continue
+            pending.append((year, month))
+            if len(pending) >= batch_months:
+                flush()
+    flush()
+    return batches
+
+
+def get_session(pool_size=WEATHER_MAX_WORKERS, max_retries=WEATHER_MAX_RETRIES, backoff_factor=WEATHER_BACKOFF_FACTOR):
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET"]),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def is_open_ended(end_date):
+    # A range is still open if it stops before the last day of its final month
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    return end.day < monthrange(end.year, end.month)[1]
+
+
+def fetch_range(session, country, lat, lon, start_date, end_date, base_url=WEATHER_API_BASE, timeout=WEATHER_TIMEOUT,
+                cache_dir=WEATHER_CACHE_DIR, offline=WEATHER_OFFLINE):
+    key = cache_key(lat, lon, start_date, end_date)
+    if cache_dir:
+        daily = load_cached(key, cache_dir, allow_stale=offline)
+        if daily is not None:
+            return daily
+    if offline:
+        print(f"Offline mode: no cached weather data for {country} from {start_date} to {end_date}.")
+        return None
+    params = {
+        "latitude": lat,
+        "longitude": lon,
+        "start_date": start_date,
+        "end_date": end_date,
+        "daily": WEATHER_COLS,
+        "timezone": WEATHER_TIMEZONE
+    }
+    print(f"Requesting weather data for {country} from {start_date} to {end_date}...")
+    try:
+        resp = session.get(base_url, params=params, timeout=timeout)
+        data = resp.json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"Request failed for {country} {start_date} to {end_date}: {e}")
+        return None
+    if 'daily' not in data:
+        print(f"API error for {country} {start_date} to {end_date}: {data}")
+        return None
+    if cache_dir:
+        store_cached(key, data['daily'], stale=is_open_ended(end_date), cache_dir=cache_dir)
+    return data['daily']
+
+
+def summarize_daily(country, daily):
+    # Split the daily arrays of a range response into calendar months
+    by_month = {}
+    for i, day in enumerate(daily.get("time", [])):
+        by_month.setdefault(day[:7], []).append(i)
+    records = []
+    for month in sorted(by_month):
+        idx = by_month[month]
+
+        def column(name):
+            values = daily.get(name)
+            return None if values is None else [values[i] for i in idx]
+
+        avg_temp = None
+        if 'temperature_2m_max' in daily and 'temperature_2m_min' in daily:
+            avg_temp = safe_mean(column("temperature_2m_max"), column("temperature_2m_min"))
+        precip_mm = safe_sum(column("precipitation_sum"))
+        wind_kmh = np.nanmean(np.array(column("wind_speed_10m_max") or [], dtype=float))
+        records.append({
+            "country": country,
+            "month": month,
+            "avg_temp_c": float(np.mean(avg_temp)) if avg_temp is not None else None,
+            "precip_mm": float(precip_mm) if precip_mm is not None else None,
+            "wind_kmh": float(wind_kmh) if not np.isnan(wind_kmh) else None
+        })
+    return records
+
+
+def fetch_all_weather(locations, start_year=START_YEAR, end_year=END_YEAR, current_date=CURRENT_DATE,
+                      base_url=WEATHER_API_BASE, session=None, max_workers=WEATHER_MAX_WORKERS,
+                      batch_months=WEATHER_BATCH_MONTHS, cache_dir=WEATHER_CACHE_DIR, offline=WEATHER_OFFLINE,
+                      cache_max_bytes=WEATHER_CACHE_MAX_BYTES, since=None, failed=None):
+    """
+    Fetches every location concurrently over one pooled session.
+    Completed months are served from the response cache; offline mode never touches the network.
+    since optionally maps a country to the first month (YYYY-MM) to fetch for it.
+    Batches that could not be fetched are left out of the result; when failed is a dict, the (start_date, end_date)
+    of each is appended to failed[country].
+    Returns a dict mapping country to its monthly weather DataFrame.
+    """
+    session = session or get_session(pool_size=max_workers)
+    since = since or {}
+    failed = {} if failed is None else failed
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            country: [
+                ((start_date, end_date),
+                 executor.submit(fetch_range, session, country, loc["lat"], loc["lon"], start_date, end_date, base_url,
+                                 cache_dir=cache_dir, offline=offline))
+                for start_date, end_date in month_batches(start_year, end_year, current_date, batch_months,
+                                                          since=since.get(country))
+            ]
+            for country, loc in locations.items()
+        }
+        results = {}
+        for country, country_futures in futures.items():
+            records = []
+            for batch, future in country_futures:
+                daily = future.result()
+                if daily is not None:
+                    records.extend(summarize_daily(country, daily))
                 else:
-                    continue
-            daily = data['daily']
-            # Compute processed weather columns
-            avg_temp = None
-            if 'temperature_2m_max' in daily and 'temperature_2m_min' in daily:
-                avg_temp = safe_mean(daily["temperature_2m_max"], daily["temperature_2m_min"])
-            precip_mm = safe_sum(daily.get("precipitation_sum"))
-            wind_kmh = np.nanmean(np.array(daily.get("wind_speed_10m_max", []), dtype=float))
-            records.append({
-                "country": country,
-                "month": f"{year}-{month:02d}",
-                "avg_temp_c": float(np.mean(avg_temp)) if avg_temp is not None else None,
-                "precip_mm": float(precip_mm) if precip_mm is not None else None,
-                "wind_kmh": float(wind_kmh) if not np.isnan(wind_kmh) else None
-            })
-    print(f"Fetched weather data for {country}.")
-    return pd.DataFrame(records)
-
-
-def main():
+                    failed.setdefault(country, []).append(batch)
+            print(f"Fetched weather data for {country}.")
+            results[country] = pd.DataFrame(records, columns=["country", "month"] + PROCESSED_WEATHER_COLS)
+    if cache_dir and not offline:
+        evict(cache_dir, cache_max_bytes)
+    return results
+
+
+def fetch_weather(country, lat, lon, **kwargs):
+    return fetch_all_weather({country: {"lat": lat, "lon": lon}}, **kwargs)[country]
+
+
+def advance_weather_watermarks(watermarks, new_df, failed):
+    """
+    Advances each country's weather watermark to the latest month fetched, but never past the first month of a
+    batch that failed, so the next incremental run fetches that batch again instead of leaving a gap.
+    """
+    watermarks = advance_watermark(watermarks, "weather", new_df)
+    return cap_watermark(watermarks, "weather", {country: min(batches)[0][:7] for country, batches in failed.items()})
+
+
+def ingest(full=False, offline=WEATHER_OFFLINE, use_cache=True):
     print("Starting weather data ingestion...")
-    dfs = []
-    for country, loc in LOCATIONS.items():
-        if country != "France":
-            continue
-        print(f"Processing country: {country}")
-        df = fetch_weather(country, loc["lat"], loc["lon"])
-        dfs.append(df)
-    weather_df = pd.concat(dfs, ignore_index=True)
-    print(f"Saving weather data to {WEATHER_DATA_CSV}...")
-    weather_df.to_csv(WEATHER_DATA_CSV, index=False)
+    watermarks = load_watermarks()
+    if full or not os.path.exists(WEATHER_DATA_CSV):
+        reset_watermarks(watermarks, "weather")
+    locations = {country: loc for country, loc in LOCATIONS.items() if country in COUNTRIES}
+    print(f"Processing countries: {', '.join(locations)}")
+    since = {country: get_watermark(watermarks, "weather", country) for country in locations}
+    for country, month in since.items():
+        if month:
+            print(f"Incremental fetch for {country} from watermark {month}.")
+    failed = {}
+    dfs = fetch_all_weather(locations, cache_dir=WEATHER_CACHE_DIR if use_cache else None, offline=offline,
+                            since=since, failed=failed)
+    for country, batches in failed.items():
+        print(f"{len(batches)} weather batch(es) failed for {country}; they will be fetched again on the next run.")
+    new_df = pd.concat(dfs.values(), ignore_index=True)
+    # Round-trip parsing keeps unchanged months bit-identical across runs
+    existing = None if full or not os.path.exists(WEATHER_DATA_CSV) else pd.read_csv(WEATHER_DATA_CSV, float_precision="round_trip")
+    weather_df = upsert_rows(existing, new_df).sort_values(["country", "month"], kind="stable")
+    if new_df.empty and existing is not None:
+        print("No new weather data fetched; keeping the existing file.")
+    else:
+        print(f"Saving weather data to {WEATHER_DATA_CSV} ({len(new_df)} new or updated months)...")
+        weather_df.to_csv(WEATHER_DATA_CSV, index=False)
+    save_watermarks(advance_weather_watermarks(watermarks, new_df, failed), source="weather")
     print("Weather data ingestion completed.")
+    return weather_df.reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fetch monthly weather data from the Open-Meteo archive.")
+    parser.add_argument("--offline", action="store_true", default=WEATHER_OFFLINE,
+                        help="Replay responses from the on-disk cache without touching the network.")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk response cache.")
+    parser.add_argument("--full", action="store_true", help="Ignore the watermark and refetch the whole range.")
+    args = parser.parse_args(argv)
+    return ingest(full=args.full, offline=args.offline, use_cache=not args.no_cache)
 
 
 if __name__ == "__main__":
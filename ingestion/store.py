@@ -0,0 +1,127 @@
+"""
+Columnar store for the merged IEA + weather data: a Parquet dataset partitioned by country and year.
+Readers project only the columns they need and push country, balance, type and month filters down to the scan.
+"""
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from config import MERGED_DATA_DIR, MERGED_DATA_CSV
+from ingestion.watermarks import upsert_rows
+
+MERGED_SCHEMA = pa.schema([
+    ("country", pa.string()),
+    ("month", pa.string()),
+    ("Balance", pa.string()),
+    ("production_type", pa.string()),
+    ("value_gwh", pa.float32()),
+    ("Unit", pa.string()),
+    ("avg_temp_c", pa.float64()),
+    ("precip_mm", pa.float64()),
+    ("wind_kmh", pa.float64()),
+    ("year", pa.int16()),
+])
+PARTITIONING = ds.partitioning(pa.schema([("country", pa.string()), ("year", pa.int16())]), flavor="hive")
+
+
+def _to_table(df):
+    df = df.copy()
+    df['year'] = df['month'].astype(str).str[:4].astype('int16')
+    for field in MERGED_SCHEMA:
+        if field.name not in df.columns:
+            df[field.name] = None
+        elif isinstance(df[field.name].dtype, pd.CategoricalDtype):
+            df[field.name] = df[field.name].astype(object)
+    return pa.Table.from_pandas(df[MERGED_SCHEMA.names], schema=MERGED_SCHEMA, preserve_index=False)
+
+
+def write_merged(df, root=MERGED_DATA_DIR):
+    # Only the (country, year) partitions present in df are replaced
+    ds.write_dataset(
+        _to_table(df), root,
+        format="parquet",
+        partitioning=PARTITIONING,
+        existing_data_behavior="delete_matching",
+        basename_template="part-{i}.parquet"
+    )
+
+
+def upsert_merged(new, root=MERGED_DATA_DIR):
+    # Rewrite the partitions touched by new, replacing its (country, month) slices
+    if new.empty:
+        return
+    if not os.path.isdir(root):
+        write_merged(new, root)
+        return
+    new_years = new['month'].astype(str).str[:4].astype(int)
+    existing = read_merged(root, countries=new['country'].astype(str).unique().tolist(),
+                           start_month=f"{new_years.min()}-01", end_month=f"{new_years.max()}-12")
+    touched = set(zip(new['country'].astype(str), new_years))
+    existing = existing[[pair in touched for pair in zip(existing['country'], existing['month'].str[:4].astype(int))]]
+    write_merged(upsert_rows(existing, new), root)
+
+
+def _filter_expression(countries=None, balances=None, production_types=None, start_month=None, end_month=None):
+    expr = None
+
+    def add(condition):
+        return condition if expr is None else expr & condition
+
+    if countries is not None:
+        expr = add(pc.field("country").isin(list(countries)))
+    if balances is not None:
+        expr = add(pc.field("Balance").isin(list(balances)))
+    if production_types is not None:
+        expr = add(pc.field("production_type").isin(list(production_types)))
+    # Year bounds prune whole partitions before the month predicate is applied to rows
+    if start_month is not None:
+        expr = add((pc.field("year") >= int(start_month[:4])) & (pc.field("month") >= start_month))
+    if end_month is not None:
+        expr = add((pc.field("year") <= int(end_month[:4])) & (pc.field("month") <= end_month))
+    return expr
+
+
+def _filter_frame(df, countries=None, balances=None, production_types=None, start_month=None, end_month=None):
+    mask = pd.Series(True, index=df.index)
+    if countries is not None:
+        mask &= df['country'].isin(countries)
+    if balances is not None:
+        mask &= df['Balance'].isin(balances)
+    if production_types is not None:
+        mask &= df['production_type'].isin(production_types)
+    if start_month is not None:
+        mask &= df['month'] >= start_month
+    if end_month is not None:
+        mask &= df['month'] <= end_month
+    return df[mask]
+
+
+def read_merged(path=MERGED_DATA_DIR, columns=None, countries=None, balances=None, production_types=None,
+                start_month=None, end_month=None):
+    """
+    Reads the merged data, returning only the requested columns and rows.
+    Falls back to the CSV export when path is a .csv file or the dataset has not been written yet.
+    """
+    filters = dict(countries=countries, balances=balances, production_types=production_types,
+                   start_month=start_month, end_month=end_month)
+    if path.endswith(".csv") or not os.path.isdir(path):
+        csv_path = path if path.endswith(".csv") else MERGED_DATA_CSV
+        df = _filter_frame(pd.read_csv(csv_path), **filters)
+        return df[columns].reset_index(drop=True) if columns is not None else df.reset_index(drop=True)
+    dataset = ds.dataset(path, format="parquet", schema=MERGED_SCHEMA, partitioning=PARTITIONING)
+    names = columns if columns is not None else [name for name in MERGED_SCHEMA.names if name != "year"]
+    # Sort keys are read even if not projected so the output order is deterministic
+    scan_columns = list(dict.fromkeys(list(names) + ["country", "month"]))
+    table = dataset.to_table(columns=scan_columns, filter=_filter_expression(**filters))
+    df = table.to_pandas()
+    df = df.sort_values(["country", "month"], kind="stable").reset_index(drop=True)
+    return df[names]
+
+
+def export_csv(root=MERGED_DATA_DIR, output_csv=MERGED_DATA_CSV):
+    # Human-readable export of the whole dataset
+    df = read_merged(root)
+    df.to_csv(output_csv, index=False)
+    return output_csv
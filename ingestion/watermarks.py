@@ -0,0 +1,92 @@
+"""
+Per-source high-water marks (the last month processed for each country) used for incremental pipeline runs.
+The watermark month itself is always reprocessed, since it may have been partial or provisional.
+"""
+import json
+import os
+import tempfile
+import threading
+
+import pandas as pd
+from config import WATERMARKS_JSON
+
+# Pipeline stages may run concurrently in one process, so file updates are serialized
+_lock = threading.Lock()
+
+
+def load_watermarks(path=WATERMARKS_JSON):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_watermarks(watermarks, source=None, path=WATERMARKS_JSON):
+    # With a source, only that entry is written back and marks saved by other stages are kept
+    with _lock:
+        if source is not None:
+            current = load_watermarks(path)
+            if source in watermarks:
+                current[source] = watermarks[source]
+            else:
+                current.pop(source, None)
+            watermarks = current
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(watermarks, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+
+
+def get_watermark(watermarks, source, country):
+    return watermarks.get(source, {}).get(country)
+
+
+def reset_watermarks(watermarks, source):
+    watermarks.pop(source, None)
+    return watermarks
+
+
+def since_watermark(df, watermarks, source):
+    # Keep rows at or after each country's watermark; countries without one are kept in full
+    marks = watermarks.get(source, {})
+    if not marks or df.empty:
+        return df
+    cutoff = df['country'].astype(str).map(marks)
+    keep = cutoff.isna() | (df['month'].astype(str) >= cutoff.fillna(""))
+    return df[keep.to_numpy()]
+
+
+def advance_watermark(watermarks, source, df):
+    if df.empty:
+        return watermarks
+    marks = watermarks.setdefault(source, {})
+    latest = df.groupby(df['country'].astype(str))['month'].max()
+    for country, month in latest.items():
+        month = str(month)
+        if marks.get(country) is None or month > marks[country]:
+            marks[country] = month
+    return watermarks
+
+
+def cap_watermark(watermarks, source, caps):
+    # Moves each country's watermark back to at most caps[country] (YYYY-MM) so that month is processed again
+    marks = watermarks.setdefault(source, {})
+    for country, month in caps.items():
+        if marks.get(country) is None or marks[country] > month:
+            marks[country] = month
+    return watermarks
+
+
+def upsert_rows(existing, new, keys=("country", "month")):
+    # Replace every (country, month) present in new, keep the rest of existing untouched
+    keys = list(keys)
+    if existing is None or existing.empty:
+        return new.reset_index(drop=True)
+    replaced = pd.MultiIndex.from_frame(new[keys].astype(str).drop_duplicates())
+    current = pd.MultiIndex.from_frame(existing[keys].astype(str))
+    kept = existing[~current.isin(replaced)]
+    if kept.empty:
+        return new.reset_index(drop=True)
+    return pd.concat([kept, new], ignore_index=True)
@@ -0,0 +1,69 @@
+"""
+Content-addressed on-disk cache for Open-Meteo archive responses.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+from config import WEATHER_CACHE_DIR, WEATHER_CACHE_MAX_BYTES, WEATHER_COLS, WEATHER_TIMEZONE
+
+
+def cache_key(lat, lon, start_date, end_date, variables=WEATHER_COLS, timezone=WEATHER_TIMEZONE):
+    payload = json.dumps({
+        "lat": round(float(lat), 4),
+        "lon": round(float(lon), 4),
+        "start_date": start_date,
+        "end_date": end_date,
+        "variables": sorted(variables),
+        "timezone": timezone
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _entry_path(key, cache_dir):
+    return os.path.join(cache_dir, key[:2], f"{key}.json")
+
+
+def load_cached(key, cache_dir=WEATHER_CACHE_DIR, allow_stale=False):
+    path = _entry_path(key, cache_dir)
+    try:
+        with open(path, encoding="utf-8") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if entry.get("stale") and not allow_stale:
+        return None
+    # Touch the entry so eviction drops the least recently used responses first
+    os.utime(path)
+    return entry["daily"]
+
+
+def store_cached(key, daily, stale=False, cache_dir=WEATHER_CACHE_DIR):
+    path = _entry_path(key, cache_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"stale": stale, "daily": daily}, f)
+    os.replace(tmp_path, path)
+
+
+def evict(cache_dir=WEATHER_CACHE_DIR, max_bytes=WEATHER_CACHE_MAX_BYTES):
+    entries = []
+    for root, _, files in os.walk(cache_dir):
+        for name in files:
+            if name.endswith(".json"):
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        removed += 1
+    if removed:
+        print(f"Evicted {removed} cached weather responses from {cache_dir}.")
+    return removed
@@ -0,0 +1,95 @@
+"""
+Content-hash cache for pipeline stages. A stage's fingerprint covers the hashes of its upstream results,
+the config values and input files it declares, and the source of the modules it runs. When the fingerprint
+matches the last run, the stage is skipped and its pickled result is reused.
+"""
+import hashlib
+import importlib.util
+import json
+import os
+import pickle
+import tempfile
+
+import pandas as pd
+import config
+
+
+def _update(h, obj):
+    if isinstance(obj, pd.DataFrame):
+        h.update(repr(list(obj.columns)).encode("utf-8"))
+        h.update(repr([str(dtype) for dtype in obj.dtypes]).encode("utf-8"))
+        h.update(pd.util.hash_pandas_object(obj, index=False).to_numpy().tobytes())
+    elif isinstance(obj, dict):
+        for key in sorted(obj, key=repr):
+            h.update(repr(key).encode("utf-8"))
+            _update(h, obj[key])
+    elif isinstance(obj, (list, tuple)):
+        h.update(f"seq{len(obj)}".encode("utf-8"))
+        for item in obj:
+            _update(h, item)
+    else:
+        h.update(repr(obj).encode("utf-8"))
+
+
+def hash_result(result):
+    h = hashlib.sha256()
+    _update(h, result)
+    return h.hexdigest()
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def module_hash(module_name):
+    spec = importlib.util.find_spec(module_name)
+    return file_hash(spec.origin) if spec is not None and spec.origin else None
+
+
+def stage_fingerprint(stage, input_hashes, options):
+    payload = {
+        "stage": stage.name,
+        "inputs": {dep: input_hashes[dep] for dep in stage.deps},
+        "config": {key: repr(getattr(config, key)) for key in stage.config_keys},
+        "files": {path: file_hash(path) for path in stage.files},
+        "code": {name: module_hash(name) for name in (stage.func.__module__,) + tuple(stage.modules)},
+        "options": repr(sorted(options.items())),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _paths(cache_dir, stage):
+    return os.path.join(cache_dir, f"{stage.name}.json"), os.path.join(cache_dir, f"{stage.name}.pkl")
+
+
+def load_cached_result(cache_dir, stage, fingerprint):
+    # Returns (hit, result, result_hash); declared output files must still exist for a hit
+    meta_path, result_path = _paths(cache_dir, stage)
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") != fingerprint or not all(os.path.exists(path) for path in stage.outputs):
+            return False, None, None
+        with open(result_path, "rb") as f:
+            return True, pickle.load(f), meta["result_hash"]
+    except (OSError, ValueError, KeyError, pickle.UnpicklingError, EOFError):
+        return False, None, None
+
+
+def store_result(cache_dir, stage, fingerprint, result, result_hash):
+    os.makedirs(cache_dir, exist_ok=True)
+    meta_path, result_path = _paths(cache_dir, stage)
+    for path, mode, write in [
+        (result_path, "wb", lambda f: pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)),
+        (meta_path, "w", lambda f: json.dump({"fingerprint": fingerprint, "result_hash": result_hash}, f)),
+    ]:
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,113 @@
+"""
+Minimal in-process DAG runner: stages declare their dependencies, run as soon as those have finished,
+and receive the upstream results in memory. Independent stages run in parallel on a thread pool,
+and unchanged stages can be skipped through the content-hash cache in pipeline.cache.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dataclasses import dataclass, field
+from typing import Callable
+
+from pipeline.cache import stage_fingerprint, load_cached_result, store_result, hash_result
+
+
+@dataclass
+class Stage:
+    name: str
+    title: str
+    func: Callable
+    deps: tuple = field(default_factory=tuple)
+    # Fingerprint inputs besides upstream results: config names, input files and extra code modules
+    config_keys: tuple = field(default_factory=tuple)
+    files: tuple = field(default_factory=tuple)
+    modules: tuple = field(default_factory=tuple)
+    # Files that must still exist for a cached result to be reused
+    outputs: tuple = field(default_factory=tuple)
+    # Stages reading external state (network, database DDL) always run
+    volatile: bool = False
+
+
+def topological_order(stages):
+    by_name = {stage.name: stage for stage in stages}
+    order, visiting, done = [], set(), set()
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            raise ValueError(f"Pipeline has a dependency cycle through stage '{name}'.")
+        if name not in by_name:
+            raise ValueError(f"Unknown pipeline stage '{name}'.")
+        visiting.add(name)
+        for dep in by_name[name].deps:
+            visit(dep)
+        visiting.discard(name)
+        done.add(name)
+        order.append(by_name[name])
+
+    for stage in stages:
+        visit(stage.name)
+    return order
+
+
+def run_dag(stages, max_workers=4, cache_dir=None, force=(), **options):
+    """
+    Runs every stage once its dependencies have finished and returns (results, report): stage name to result,
+    and stage name to {"status", "seconds"}. Each stage is called as func(inputs, **options), where inputs maps
+    dependency names to their results.
+
+    With a cache_dir, a stage whose fingerprint matches its last run is skipped ("hit") and its stored result
+    reused. Volatile stages always run, as do the stages named in force.
+    The first failure stops scheduling; stages already running are allowed to finish before it is re-raised.
+    """
+    pending = {stage.name: stage for stage in topological_order(stages)}
+    results, hashes, report, running = {}, {}, {}, {}
+
+    def execute(stage):
+        start = time.perf_counter()
+        fingerprint = None
+        if cache_dir is not None:
+            fingerprint = stage_fingerprint(stage, hashes, options)
+            if stage.name in force:
+                status = "forced"
+            elif stage.volatile:
+                status = "volatile"
+            else:
+                hit, result, result_hash = load_cached_result(cache_dir, stage, fingerprint)
+                if hit:
+                    print(f"\n=== Skipping: {stage.title} (unchanged, cached result reused) ===")
+                    report[stage.name] = {"status": "hit", "seconds": time.perf_counter() - start}
+                    return result, result_hash
+                status = "miss"
+        else:
+            status = "run"
+        print(f"\n=== Running: {stage.title} ===")
+        result = stage.func({dep: results[dep] for dep in stage.deps}, **options)
+        result_hash = hash_result(result)
+        if cache_dir is not None:
+            store_result(cache_dir, stage, fingerprint, result, result_hash)
+        report[stage.name] = {"status": status, "seconds": time.perf_counter() - start}
+        print(f"{stage.title} completed successfully in {report[stage.name]['seconds']:.1f}s.")
+        return result, result_hash
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        error = None
+        while pending or running:
+            if error is None:
+                for name, stage in list(pending.items()):
+                    if all(dep in results for dep in stage.deps):
+                        running[executor.submit(execute, stage)] = stage
+                        del pending[name]
+            if not running:
+                break
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage = running.pop(future)
+                try:
+                    results[stage.name], hashes[stage.name] = future.result()
+                except Exception as e:
+                    print(f"Error in {stage.title}: {e}")
+                    error = error or e
+        if error is not None:
+            raise error
+    return results, report
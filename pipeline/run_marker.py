@@ -0,0 +1,43 @@
+"""
+Run marker published after the database or the pipeline outputs change. Readers such as the dashboard
+key their caches on its version, so they refetch only when there is something new.
+"""
+import json
+import os
+import tempfile
+import threading
+import uuid
+from datetime import datetime, timezone
+
+from config import RUN_MARKER_JSON
+
+_lock = threading.Lock()
+
+
+def read_run_marker(path=RUN_MARKER_JSON):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def publish_run_marker(source, path=RUN_MARKER_JSON):
+    # A fresh version on every publish; sources records when each writer last published
+    with _lock:
+        marker = read_run_marker(path)
+        now = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        marker["version"] = uuid.uuid4().hex
+        marker["updated_at"] = now
+        marker.setdefault("sources", {})[source] = now
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(marker, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, path)
+    return marker
+
+
+def run_marker_version(path=RUN_MARKER_JSON):
+    return read_run_marker(path).get("version", "")
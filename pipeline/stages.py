@@ -0,0 +1,96 @@
+"""
+Stage definitions for the GreenPower pipeline. Each stage wraps the in-memory entry point of a module
+whose `python -m` CLI keeps working on its own.
+"""
+import os
+
+from config import (IEA_CSV, COUNTRIES, MERGED_DATA_DIR, FORECAST_BY_TYPE_CSV,
+                    FORECAST_RESULTS_CSV, ANOMALIES_CSV, CARBON_REPORT_CSV, CARBON_CUBE_PARQUET, EMISSIONS_FACTORS_CSV,
+                    FIGURES_DIR, PLOTS_DIR, FORECAST_PLOTS_DIR)
+from analytics.figures import build_figures
+from analytics.forecasting import run_forecasts
+from analytics.reporting import main as run_reporting
+from analytics.utils import clean_iea
+from analytics.visualization import main as render_plots
+from db.db_schema import setup_schema
+from db.load_to_db import load
+from ingestion.clean_transform import transform as merge_sources
+from ingestion.ingest_iea import read_iea_csv
+from ingestion.ingest_weather import ingest
+from pipeline.dag import Stage
+
+
+def fetch_power(inputs, full=False):
+    return clean_iea(read_iea_csv(IEA_CSV, COUNTRIES), COUNTRIES)
+
+
+def fetch_weather(inputs, full=False):
+    return ingest(full=full)
+
+
+def transform(inputs, full=False):
+    return merge_sources(inputs["fetch_power"], inputs["fetch_weather"], full=full)
+
+
+def create_schema(inputs, full=False):
+    # The target URI and its row counts: load_db is fingerprinted on them, so a wiped or different database is
+    # loaded again even when the merged data has not changed
+    return setup_schema(drop=full)
+
+
+def load_db(inputs, full=False):
+    load(inputs["transform"], full=full)
+
+
+def forecast(inputs, full=False):
+    return run_forecasts(inputs["transform"])
+
+
+def report(inputs, full=False):
+    return run_reporting(inputs["transform"], rebuild=full)
+
+
+def dashboard_figures(inputs, full=False):
+    # Reads the forecasting and reporting outputs from disk, as the dashboard does
+    return build_figures()
+
+
+def visualize(inputs, full=False):
+    anomalies, carbon_report = inputs["reporting"]
+    render_plots(forecast=inputs["forecasting"]["by_type"], merged=inputs["transform"],
+                 anomalies=anomalies, carbon_report=carbon_report)
+
+
+STAGES = [
+    Stage("fetch_power", "Fetch Power Data", fetch_power,
+          config_keys=("COUNTRIES",), files=(IEA_CSV,), modules=("ingestion.ingest_iea", "analytics.utils")),
+    Stage("fetch_weather", "Fetch Weather Data", fetch_weather, volatile=True),
+    Stage("transform", "Ingestion & Transformation", transform, ("fetch_power", "fetch_weather"),
+          config_keys=("COUNTRIES",),
+          modules=("ingestion.clean_transform", "ingestion.store", "ingestion.watermarks", "analytics.utils"),
+          outputs=(MERGED_DATA_DIR,)),
+    Stage("schema", "Create Schema", create_schema, volatile=True),
+    Stage("load_db", "Load to DB", load_db, ("transform", "schema"),
+          config_keys=("DB_URI", "COUNTRIES", "PRODUCTION_BALANCE", "CONSUMPTION_BALANCE", "PROCESSED_WEATHER_COLS",
+                       "EMISSIONS_FACTORS"),
+          modules=("db.load_to_db", "db.db_schema", "db.rollups")),
+    # Forecasting reads national consumption back from the database
+    Stage("forecasting", "Forecasting", forecast, ("transform", "load_db"),
+          config_keys=("DB_URI", "PRODUCTION_BALANCE", "PROCESSED_WEATHER_COLS", "FORECAST_ENGINE",
+                       "FORECAST_HIERARCHICAL", "PRODUCTION_HIERARCHY"),
+          modules=("analytics.forecasting", "analytics.model_cache", "analytics.engines", "analytics.hierarchy"),
+          outputs=(FORECAST_BY_TYPE_CSV, FORECAST_RESULTS_CSV)),
+    Stage("reporting", "Reporting", report, ("transform",),
+          config_keys=("EMISSIONS_FACTORS", "PRODUCTION_BALANCE", "PRODUCTION_HIERARCHY", "ANOMALY_WINDOW",
+                       "ANOMALY_THRESHOLD", "ANOMALY_DETECTORS"),
+          files=(EMISSIONS_FACTORS_CSV,),
+          modules=("analytics.reporting", "analytics.engines", "analytics.carbon", "analytics.hierarchy"),
+          outputs=(ANOMALIES_CSV, CARBON_REPORT_CSV, CARBON_CUBE_PARQUET)),
+    Stage("figures", "Dashboard Figures", dashboard_figures, ("forecasting", "reporting"),
+          config_keys=("DASHBOARD_MAX_POINTS",), modules=("analytics.figures", "analytics.utils"),
+          outputs=(FIGURES_DIR,)),
+    Stage("visualization", "Visualization", visualize, ("forecasting", "reporting", "transform"),
+          config_keys=("CONSUMPTION_BALANCE", "PROCESSED_WEATHER_COLS"), modules=("analytics.visualization",),
+          outputs=(FORECAST_PLOTS_DIR,) + tuple(os.path.join(PLOTS_DIR, name) for name in (
+              "weather_vs_consumption.png", "anomalies_plot.png", "carbon_emissions_plot.png"))),
+]
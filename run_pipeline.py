@@ -1,30 +1,34 @@
-import subprocess
+import argparse
 import sys
 
-steps = [
-    ("Fetch Power Data", [sys.executable, "-m", "ingestion.ingest_iea"]),
-    ("Fetch Weather Data", [sys.executable, "-m", "ingestion.ingest_weather"]),
-    ("Ingestion & Transformation", [sys.executable, "-m", "ingestion.clean_transform"]),
-    ("Create Schema", [sys.executable, "-m", "db.db_schema"]),
-    ("Load to DB", [sys.executable, "-m", "db.load_to_db"]),
-    ("Forecasting", [sys.executable, "-m", "analytics.forecasting"]),
-    ("Reporting", [sys.executable, "-m", "analytics.reporting"]),
-    ("Visualization", [sys.executable, "-m", "analytics.visualization"]),
-]
+from config import PIPELINE_CACHE_DIR
+from pipeline.dag import run_dag
+from pipeline.run_marker import publish_run_marker
+from pipeline.stages import STAGES
 
 
-def run_step(name, cmd):
-    print(f"\n=== Running: {name} ===")
-    print(f"Command: {cmd}")
+if __name__ == "__main__":
+    stage_names = [stage.name for stage in STAGES]
+    parser = argparse.ArgumentParser(description="Run the GreenPower pipeline.")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore watermarks and the stage cache and rebuild every stage from scratch.")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Maximum number of independent stages run in parallel.")
+    parser.add_argument("--force", action="append", default=[], choices=stage_names, metavar="STAGE",
+                        help=f"Recompute a stage even if its inputs are unchanged (repeatable). One of: {', '.join(stage_names)}")
+    parser.add_argument("--no-cache", action="store_true", help="Run every stage without the stage cache.")
+    args = parser.parse_args()
+    force = stage_names if args.full else args.force
     try:
-        result = subprocess.run(cmd, check=True)
-        print(f"{name} completed successfully.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error in {name}: {e}")
+        results, report = run_dag(STAGES, max_workers=args.workers, full=args.full, force=force,
+                                  cache_dir=None if args.no_cache else PIPELINE_CACHE_DIR)
+    except Exception:
         sys.exit(1)
-
-
-if __name__ == "__main__":
-    for name, cmd in steps:
-        run_step(name, cmd)
+    # Tell readers such as the dashboard that the outputs may have changed
+    publish_run_marker("pipeline")
+    print("\nStage summary:")
+    for stage in STAGES:
+        print(f"  {stage.title:<28} {report[stage.name]['status']:<9} {report[stage.name]['seconds']:.1f}s")
+    hits = sum(entry["status"] == "hit" for entry in report.values())
+    print(f"Cache: {hits} hit(s), {len(report) - hits} stage(s) executed.")
     print("\nPipeline execution complete.")
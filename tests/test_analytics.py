@@ -3,8 +3,19 @@ import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 import pytest
 import pandas as pd
-from analytics.utils import merge_data
-from analytics.reporting import calculate_carbon
+import time
+import numpy as np
+from analytics.utils import merge_data, downsample
+from analytics.reporting import calculate_carbon, detect_anomalies, update_anomalies, verify_anomaly_state, score_series
+from analytics.forecasting import forecast_series
+from analytics.model_cache import cached_fit, load_index, series_dir
+from analytics.engines import forecast_matrix
+from analytics.backtest import run_backtest
+from analytics.hierarchy import add_aggregates, aggregate_leaves
+from analytics.carbon import build_carbon_cube
+from analytics.visualization import plot_forecasts_by_type
+from analytics.figures import build_figures, load_figure, forecast_type_figure
+from prophet import Prophet
 
 def test_merge_data():
     # Test merging two DataFrames on country and month
@@ -20,3 +31,212 @@ def test_calculate_carbon():
     carbon_df = calculate_carbon(df)
     assert 'carbon_kg' in carbon_df.columns
     assert carbon_df['carbon_kg'].iloc[0] > 0
+
+def test_incremental_anomalies_match_a_rebuild(tmp_path):
+    # Series are scored separately; new and revised months scored from the saved state agree with a full rescore
+    months = pd.period_range('2020-01', periods=36, freq='M').strftime('%Y-%m')
+    rng = np.random.default_rng(0)
+    df = pd.concat([pd.DataFrame({'country': 'France', 'month': months, 'Balance': 'Net Electricity Production',
+                                  'production_type': production_type, 'value_gwh': base + rng.normal(0, 1, 36)})
+                    for production_type, base in [('Solar', 10.0), ('Nuclear', 1000.0)]], ignore_index=True)
+    df.loc[(df['production_type'] == 'Solar') & (df['month'] == '2022-06'), 'value_gwh'] = 40.0
+    assert detect_anomalies(df)[['production_type', 'month']].values.tolist() == [['Solar', '2022-06']]
+    paths = dict(state_path=str(tmp_path / 'state.json'), anomalies_csv=str(tmp_path / 'anomalies.csv'))
+    update_anomalies(df[df['month'] < '2022-03'], **paths)
+    revised = df.copy()
+    revised.loc[revised['month'] == '2022-02', 'value_gwh'] += 5
+    anomalies = update_anomalies(revised[revised['month'] >= '2022-02'], **paths)
+    assert verify_anomaly_state(revised, **paths) == []
+    assert anomalies[['production_type', 'month']].values.tolist() == detect_anomalies(revised)[['production_type', 'month']].values.tolist()
+
+    # Read from the merged store instead, the incremental run gets the same result from the recent months only
+    from ingestion.store import write_merged, upsert_merged
+    root = str(tmp_path / 'merged')
+    write_merged(df[df['month'] < '2022-03'], root)
+    update_anomalies(None, rebuild=True, merged_dir=root, **paths)
+    upsert_merged(revised[revised['month'] >= '2022-02'], root)
+    from_store = update_anomalies(None, merged_dir=root, **paths)
+    assert from_store[['production_type', 'month']].values.tolist() == detect_anomalies(revised)[['production_type', 'month']].values.tolist()
+    assert verify_anomaly_state(revised, **paths) == []
+
+def test_seasonal_detector_ignores_regular_peaks():
+    # Winter peaks recur every year and are not flagged by the seasonal detector; a one-off spike is
+    months = pd.period_range('2015-01', periods=96, freq='M')
+    rng = np.random.default_rng(1)
+    values = 100 + 60 * (months.month == 1) + rng.normal(0, 2, 96)
+    values[70] += 40
+    df = pd.DataFrame({'country': 'France', 'month': months.strftime('%Y-%m'), 'Balance': 'Final Consumption (Calculated)',
+                       'production_type': 'Electricity', 'value_gwh': values})
+    seasonal = detect_anomalies(df, detectors=['seasonal'])
+    assert seasonal['month'].tolist() == [str(months[70])]
+    assert seasonal['detector'].tolist() == ['seasonal']
+    assert len(detect_anomalies(df, detectors=['zscore'])) > 1
+    scored = score_series(df, detectors=['zscore', 'mad', 'seasonal'])
+    assert list(scored.columns) == list(df.columns) + ['zscore', 'detector', 'anomaly']
+    with pytest.raises(ValueError):
+        score_series(df, detectors=['nope'])
+
+def test_downsample_bounds_each_series():
+    # Each series keeps at most max_points rows, including its first and last point and its peak
+    df = pd.DataFrame({'ds': list(pd.date_range('2000-01-01', periods=500, freq='D')) * 2,
+                       'y': np.concatenate([np.sin(np.arange(500) / 10), np.arange(500.0)]),
+                       'production_type': ['Solar'] * 500 + ['Wind'] * 500})
+    df.loc[250, 'y'] = 10.0
+    small = downsample(df, 'ds', 'y', 50, by='production_type')
+    assert small.groupby('production_type').size().tolist() == [50, 50]
+    solar = small[small['production_type'] == 'Solar']
+    assert solar['ds'].iloc[0] == df['ds'].iloc[0] and solar['ds'].iloc[-1] == df['ds'].iloc[499]
+    assert solar['y'].max() == 10.0
+    assert len(downsample(df, 'ds', 'y', 5000, by='production_type')) == len(df)
+
+def _fake_fit(group, periods, series=None):
+    # Stand-in for a Prophet fit: fails or stalls on request, otherwise echoes the history
+    if group['y'].iloc[0] < 0:
+        raise ValueError("bad series")
+    if group['y'].iloc[0] == 0:
+        time.sleep(5)
+    return group.assign(yhat=group['y'], yhat_lower=group['y'], yhat_upper=group['y']), "cold"
+
+def test_forecast_series_isolates_failures_and_orders_output():
+    # A failing and a stalled series are skipped; the rest come back sorted by country and type
+    ds = pd.date_range('2023-01-01', periods=3, freq='MS')
+    groups = {
+        ('Spain', 'Wind'): pd.DataFrame({'ds': ds, 'y': [3.0, 4.0, 5.0]}),
+        ('France', 'Solar'): pd.DataFrame({'ds': ds, 'y': [1.0, 2.0, 3.0]}),
+        ('France', 'Coal'): pd.DataFrame({'ds': ds, 'y': [-1.0, 2.0, 3.0]}),
+        ('France', 'Hydro'): pd.DataFrame({'ds': ds, 'y': [0.0, 2.0, 3.0]}),
+    }
+    result = forecast_series(groups, _fake_fit, max_workers=1, timeout=0.5)
+    assert result[['country', 'production_type']].drop_duplicates().values.tolist() == [['France', 'Solar'], ['Spain', 'Wind']]
+    assert list(result.columns) == ['country', 'ds', 'yhat', 'yhat_lower', 'yhat_upper', 'production_type']
+
+@pytest.mark.parametrize('engine', ['seasonal_naive', 'holt_winters', 'ridge'])
+def test_forecast_matrix_engines(engine):
+    # Every series gets its history plus the horizon; a clean seasonal series is forecast closely
+    months = pd.period_range('2019-01', periods=48, freq='M')
+    season = 100 + 20 * np.sin(2 * np.pi * months.month / 12)
+    rows = []
+    for country in ['France', 'Spain']:
+        for production_type in ['Solar', 'Wind']:
+            rows.append(pd.DataFrame({'country': country, 'month': months.strftime('%Y-%m'),
+                                      'production_type': production_type, 'value_gwh': season,
+                                      'avg_temp_c': season / 10}))
+    df = pd.concat(rows, ignore_index=True)
+    df.loc[5, 'value_gwh'] = np.nan
+    result = forecast_matrix(df, engine, periods=12, weather_cols=['avg_temp_c'])
+    assert list(result.columns) == ['country', 'ds', 'yhat', 'yhat_lower', 'yhat_upper', 'production_type']
+    assert len(result) == 4 * 60
+    future = result[result['ds'] >= '2023-01-01']
+    expected = np.tile(season[:12], 4)
+    assert np.allclose(future['yhat'], expected, rtol=0.05)
+    assert (future['yhat_lower'] <= future['yhat']).all() and (future['yhat'] <= future['yhat_upper']).all()
+
+def test_backtest_scores_each_engine_and_fold():
+    # Two folds of six months for every series; a seasonal series is forecast almost exactly
+    months = pd.period_range('2020-01', periods=48, freq='M')
+    season = 100 + 20 * np.sin(2 * np.pi * months.month / 12)
+    df = pd.concat([pd.DataFrame({'country': 'France', 'month': months.strftime('%Y-%m'), 'Balance': 'Net Electricity Production',
+                                  'production_type': production_type, 'value_gwh': season * scale,
+                                  'avg_temp_c': 10.0, 'precip_mm': 50.0, 'wind_kmh': 15.0})
+                    for production_type, scale in [('Solar', 1), ('Wind', 2)]], ignore_index=True)
+    results, summary = run_backtest(df, engines=['seasonal_naive', 'ridge'], folds=2, horizon=6, min_train=24,
+                                    output_csv=None, summary_csv=None)
+    assert len(results) == 2 * 2 * 2
+    assert set(results['cutoff']) == {'2023-01', '2023-07'}
+    assert (results['months'] == 6).all()
+    assert summary.set_index('engine').loc['seasonal_naive', 'mape'] < 1
+    assert summary['coverage'].between(0, 1).all()
+    assert (results['timing'] == 'amortized').all() and results['predict_seconds'].isna().all()
+    assert np.allclose(summary['total_seconds'], summary['fit_seconds'])
+
+def test_add_aggregates_sums_leaves_through_nested_totals():
+    # Electricity includes the fuel total, which expands to its own leaves; interval half-widths add in quadrature
+    hierarchy = {'Electricity': ['Nuclear', 'Fuels'], 'Fuels': ['Gas', 'Coal']}
+    assert aggregate_leaves(hierarchy) == {'Electricity': ['Coal', 'Gas', 'Nuclear'], 'Fuels': ['Coal', 'Gas']}
+    ds = pd.to_datetime(['2025-01-01', '2025-02-01'])
+    leaves = pd.concat([pd.DataFrame({'country': 'France', 'ds': ds, 'yhat': [yhat, yhat], 'yhat_lower': [yhat - 3, yhat - 3],
+                                      'yhat_upper': [yhat + 4, yhat + 4], 'production_type': production_type})
+                        for production_type, yhat in [('Nuclear', 100.0), ('Gas', 20.0), ('Coal', 5.0)]])
+    result = add_aggregates(leaves, hierarchy)
+    electricity = result[result['production_type'] == 'Electricity']
+    assert electricity['yhat'].tolist() == [125.0, 125.0]
+    assert np.allclose(electricity['yhat_upper'] - electricity['yhat'], np.sqrt(3 * 16))
+    assert np.allclose(electricity['yhat'] - electricity['yhat_lower'], np.sqrt(3 * 9))
+    assert result[result['production_type'] == 'Fuels']['yhat'].tolist() == [25.0, 25.0]
+    assert len(result) == 10
+
+def test_carbon_cube_uses_most_specific_factor():
+    # Country and year rows override the per-type factor; aggregates and other balances stay out of the cube
+    df = pd.DataFrame({'country': ['France', 'France', 'Italy', 'France', 'France'],
+                       'month': ['2023-01', '2024-01', '2024-01', '2024-01', '2024-01'],
+                       'Balance': ['Net Electricity Production'] * 4 + ['Final Consumption (Calculated)'],
+                       'production_type': ['Coal', 'Coal', 'Coal', 'Electricity', 'Electricity'],
+                       'value_gwh': [1.0, 1.0, 1.0, 3.0, 2.0]})
+    table = pd.DataFrame({'country': [None, 'France', 'France'], 'production_type': ['Coal'] * 3,
+                          'year': [np.nan, np.nan, 2024], 'kg_per_mwh': [1000.0, 900.0, 800.0]})
+    cube = build_carbon_cube(df, table)
+    assert cube['production_type'].astype(str).tolist() == ['Coal'] * 3
+    assert cube['kg_per_mwh'].tolist() == [900.0, 800.0, 1000.0]
+    assert cube['carbon_kg'].tolist() == [900000.0, 800000.0, 1000000.0]
+
+def test_cached_fit_reuses_warm_starts_and_evicts(tmp_path):
+    # Same data is a hit, appended months warm-start from the last fit, and only the newest versions are kept
+    history = pd.DataFrame({'ds': pd.date_range('2018-01-01', periods=60, freq='MS'),
+                            'y': 100 + np.arange(60) + 10 * np.sin(np.arange(60) * np.pi / 6)
+                                 + np.random.default_rng(0).normal(0, 2, 60)})
+    _, status = cached_fit('France/Solar', history.iloc[:48], Prophet, cache_dir=tmp_path, keep=2)
+    assert status == 'cold'
+    _, status = cached_fit('France/Solar', history.iloc[:48], Prophet, cache_dir=tmp_path, keep=2)
+    assert status == 'hit'
+    revised = history.iloc[:51].copy()
+    revised.loc[47, 'y'] += 5.0
+    _, status = cached_fit('France/Solar', revised, Prophet, cache_dir=tmp_path, keep=2)
+    assert status == 'warm'
+    _, status = cached_fit('France/Solar', history.iloc[:36], Prophet, cache_dir=tmp_path, keep=2)
+    assert status == 'cold'
+    directory = series_dir(tmp_path, 'France/Solar')
+    assert len(load_index(directory)) == 2
+    assert len([name for name in os.listdir(directory) if name != 'index.json']) == 2
+
+def test_forecast_plots_skip_unchanged_slices(tmp_path):
+    # Only the series whose data changed is redrawn; a series dropped from the forecast loses its plot
+    ds = pd.date_range('2024-01-01', periods=6, freq='MS')
+    forecast = pd.concat([pd.DataFrame({'country': 'France', 'ds': ds, 'yhat': 100.0 + i, 'yhat_lower': 90.0,
+                                        'yhat_upper': 120.0, 'production_type': production_type})
+                          for i, production_type in enumerate(['Hydro', 'Nuclear', 'Wind'])])
+    assert len(plot_forecasts_by_type(output_dir=tmp_path, forecast=forecast, max_workers=1)) == 3
+    assert plot_forecasts_by_type(output_dir=tmp_path, forecast=forecast, max_workers=1) == []
+    changed = forecast[forecast['production_type'] != 'Wind'].copy()
+    changed.loc[changed['production_type'] == 'Hydro', 'yhat'] += 1
+    assert plot_forecasts_by_type(output_dir=tmp_path, forecast=changed, max_workers=1) == [str(tmp_path / 'forecast_Hydro.png')]
+    assert sorted(p.name for p in tmp_path.glob('*.png')) == ['forecast_Hydro.png', 'forecast_Nuclear.png']
+
+def test_cached_prophet_forecasts_redraw_nothing(tmp_path, monkeypatch):
+    # A second Prophet pass over unchanged series hits the model cache and reproduces the sampled bounds exactly
+    import functools
+    import analytics.forecasting as forecasting
+    monkeypatch.setattr(forecasting, 'cached_fit', functools.partial(cached_fit, cache_dir=tmp_path / 'models'))
+    ds = pd.date_range('2020-01-01', periods=36, freq='MS')
+    rng = np.random.default_rng(2)
+    groups = {('France', production_type): pd.DataFrame({'ds': ds, 'y': scale * (100 + np.arange(36)) + rng.normal(0, 5, 36)})
+              for production_type, scale in [('Solar', 1), ('Wind', 2)]}
+    first = forecasting.forecast_series(groups, forecasting.fit_prophet, periods=6, max_workers=1)
+    plots = tmp_path / 'plots'
+    assert len(plot_forecasts_by_type(output_dir=plots, forecast=first, max_workers=1)) == 2
+    second = forecasting.forecast_series(groups, forecasting.fit_prophet, periods=6, max_workers=1)
+    pd.testing.assert_frame_equal(first, second)
+    assert plot_forecasts_by_type(output_dir=plots, forecast=second, max_workers=1) == []
+
+def test_prebuilt_figures_are_served_until_their_source_changes(tmp_path):
+    # The figure round-trips through its JSON spec; a rewritten source makes it stale
+    source = tmp_path / 'forecast_by_type.csv'
+    ds = pd.date_range('2024-01-01', periods=4, freq='MS').strftime('%Y-%m-%d')
+    pd.concat([pd.DataFrame({'ds': ds, 'yhat': 10.0, 'yhat_lower': 8.0, 'yhat_upper': 12.0, 'production_type': t})
+               for t in ['Hydro', 'Wind']]).to_csv(source, index=False)
+    registry = {'forecast_type': (forecast_type_figure, (str(source),))}
+    assert build_figures(tmp_path / 'figures', registry) == ['forecast_type']
+    fig = load_figure('forecast_type', tmp_path / 'figures', registry)
+    assert [trace.name for trace in fig.data] == ['Hydro', 'Wind', 'Hydro Upper Bound', 'Hydro Lower Bound',
+                                                  'Wind Upper Bound', 'Wind Lower Bound']
+    os.utime(source, (0, 0))
+    assert load_figure('forecast_type', tmp_path / 'figures', registry) is None
@@ -0,0 +1,153 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import pytest
+import pandas as pd
+from sqlalchemy import create_engine, inspect, text
+import db.db_schema as db_schema
+from db.db_schema import metadata
+from db.load_to_db import split_merged, load_tables
+from db.rollups import refresh
+from db.engine import get_engine, read_query
+from db.queries import read_filtered, read_power_page, POWER_KEYS
+
+def _merged_sample(value=100.0):
+    return pd.DataFrame({
+        'country': ['France', 'France', 'France'],
+        'month': ['2023-01', '2023-01', '2023-02'],
+        'Balance': ['Net Electricity Production', 'Final Consumption (Calculated)', 'Net Electricity Production'],
+        'production_type': ['Solar', 'Electricity', 'Solar'],
+        'value_gwh': [value, 400.0, 120.0],
+        'avg_temp_c': [5.0, 5.0, 6.0],
+        'precip_mm': [10.0, 10.0, 12.0],
+        'wind_kmh': [15.0, 15.0, 14.0],
+    })
+
+def test_load_tables_is_idempotent(tmp_path):
+    # Loading the same months twice replaces them instead of appending duplicates
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    metadata.create_all(engine)
+    load_tables(engine, *split_merged(_merged_sample()))
+    load_tables(engine, *split_merged(_merged_sample(value=150.0)))
+    power = pd.read_sql("SELECT * FROM power_data ORDER BY month", engine)
+    assert len(power) == 2
+    assert power['value_gwh'].iloc[0] == 150.0
+    assert len(pd.read_sql("SELECT * FROM consumption_data", engine)) == 1
+    assert len(pd.read_sql("SELECT * FROM weather_data", engine)) == 2
+
+def test_upsert_table_keeps_other_months(tmp_path):
+    # Only the months present in the new batch are replaced; missing values load as NULL
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    metadata.create_all(engine)
+    load_tables(engine, *split_merged(_merged_sample()))
+    update = _merged_sample().iloc[[2]].assign(value_gwh=130.0, wind_kmh=float('nan'))
+    load_tables(engine, *split_merged(update))
+    power = pd.read_sql("SELECT * FROM power_data ORDER BY month", engine)
+    assert power['value_gwh'].tolist() == [100.0, 130.0]
+    weather = pd.read_sql("SELECT * FROM weather_data ORDER BY month", engine)
+    assert weather['wind_kmh'].isna().tolist() == [False, True]
+    assert len(pd.read_sql("SELECT * FROM consumption_data", engine)) == 1
+
+def test_migrate_tables_converts_legacy_schema(tmp_path, monkeypatch):
+    # Setting up the schema rebuilds old text-month tables with date keys; duplicate appends collapse onto one row
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setattr(db_schema, "engine", engine)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE power_data (country TEXT, month TEXT, production_type TEXT, value_gwh FLOAT)"))
+        conn.execute(text("INSERT INTO power_data VALUES ('France', '2023-01', 'Solar', 100.0), "
+                          "('France', '2023-01', 'Solar', 100.0), ('France', '2023-02', 'Solar', 120.0)"))
+    db_schema.setup_schema()
+    assert inspect(engine).get_pk_constraint("power_data")["constrained_columns"] == ["country", "month", "production_type"]
+    power = pd.read_sql("SELECT * FROM power_data ORDER BY month", engine)
+    assert power['month'].tolist() == ['2023-01-01', '2023-02-01']
+    assert inspect(engine).has_table("weather_data")
+    assert not inspect(engine).has_table("power_data_legacy")
+
+def test_setup_schema_reports_state_and_resets_watermark_of_empty_database(tmp_path, monkeypatch):
+    # A database emptied since the last load drops the db watermark; the returned state changes with its rows
+    import functools
+    from ingestion import watermarks
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    monkeypatch.setattr(db_schema, "engine", engine)
+    path = str(tmp_path / 'watermarks.json')
+    monkeypatch.setattr(db_schema, "load_watermarks", functools.partial(watermarks.load_watermarks, path=path))
+    monkeypatch.setattr(db_schema, "save_watermarks", functools.partial(watermarks.save_watermarks, path=path))
+    watermarks.save_watermarks({'db': {'France': '2023-02'}, 'iea': {'France': '2023-02'}}, path=path)
+    empty = db_schema.setup_schema()
+    assert watermarks.load_watermarks(path) == {'iea': {'France': '2023-02'}}
+    assert empty['rows'] == {'power_data': 0, 'consumption_data': 0, 'weather_data': 0}
+    load_tables(engine, *split_merged(_merged_sample()))
+    watermarks.save_watermarks({'db': {'France': '2023-02'}}, source='db', path=path)
+    loaded = db_schema.setup_schema()
+    assert loaded['uri'] == empty['uri'] and loaded['rows']['power_data'] == 2
+    assert watermarks.load_watermarks(path)['db'] == {'France': '2023-02'}
+
+def _merged_with_total(value=100.0):
+    # Wind next to Solar, and the Electricity total of the two as the IEA reports it
+    sample = _merged_sample(value)
+    production = sample[sample['Balance'] == 'Net Electricity Production']
+    wind = production.assign(production_type='Wind', value_gwh=[50.0, 60.0])
+    total = production.assign(production_type='Electricity', value_gwh=production['value_gwh'].values + [50.0, 60.0])
+    return pd.concat([sample, wind, total], ignore_index=True)
+
+def test_refresh_rollups_only_touched_months(tmp_path):
+    # An incremental refresh re-sums the loaded months and leaves the other rollup rows alone;
+    # monthly totals count the leaf types once, not the Electricity total on top of them
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    metadata.create_all(engine)
+    load_tables(engine, *split_merged(_merged_with_total()))
+    refresh(engine)
+    update = split_merged(_merged_with_total(value=150.0).iloc[[0, 1, 3, 5]])
+    load_tables(engine, *update)
+    refresh(engine, set(update[0]['month']))
+    monthly = pd.read_sql("SELECT * FROM rollup_monthly ORDER BY month", engine)
+    assert monthly['production_gwh'].tolist() == [200.0, 180.0]
+    assert monthly['carbon_kg'].tolist() == [(150.0 * 45 + 50.0 * 11) * 1000, (120.0 * 45 + 60.0 * 11) * 1000]
+    assert monthly['consumption_gwh'].tolist()[0] == 400.0
+    yearly = pd.read_sql("SELECT * FROM rollup_yearly WHERE production_type = 'Solar'", engine)
+    assert yearly[['year', 'value_gwh', 'months']].values.tolist() == [[2023, 270.0, 2]]
+
+def test_refresh_replaces_per_type_emission_factors_table(tmp_path):
+    # A factor table from the old schema (one row per type) is rebuilt per country, type and year
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    metadata.create_all(engine, tables=[t for t in metadata.sorted_tables if t.name != 'emission_factors'])
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE emission_factors (production_type VARCHAR PRIMARY KEY, kg_per_mwh FLOAT NOT NULL)"))
+    load_tables(engine, *split_merged(_merged_sample()))
+    refresh(engine)
+    factors = pd.read_sql("SELECT * FROM emission_factors", engine)
+    assert factors[['country', 'production_type', 'year', 'kg_per_mwh']].values.tolist() == [['France', 'Solar', 2023, 45.0]]
+    assert pd.read_sql("SELECT carbon_kg FROM rollup_monthly ORDER BY month", engine)['carbon_kg'].tolist() == \
+        [100.0 * 1000 * 45, 120.0 * 1000 * 45]
+
+def test_read_query_binds_parameters(tmp_path):
+    # Values are bound, not formatted into the SQL, and the engine is built once per URI
+    uri = f"sqlite:///{tmp_path / 'test.db'}"
+    engine = get_engine(uri)
+    assert get_engine(uri) is engine
+    metadata.create_all(engine)
+    load_tables(engine, *split_merged(_merged_sample()))
+    result = read_query("SELECT value_gwh FROM power_data WHERE country = :country ORDER BY month",
+                        {"country": "France"}, engine=engine)
+    assert result['value_gwh'].tolist() == [100.0, 120.0]
+    assert read_query("SELECT * FROM power_data WHERE country = :country",
+                      {"country": "France' OR '1'='1"}, engine=engine).empty
+
+def test_keyset_pages_cover_filtered_rows_once(tmp_path):
+    # Walking the pages returns every filtered row exactly once, in key order
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    metadata.create_all(engine)
+    sample = pd.concat([_merged_sample().assign(production_type=kind) for kind in ['Solar', 'Wind', 'Hydro']])
+    load_tables(engine, *split_merged(sample))
+    filters = {"countries": ["France"], "production_types": ["Solar", "Wind"]}
+    pages, after = [], None
+    while True:
+        page = read_power_page(after=after, limit=2, engine=engine, **filters)
+        if page.empty:
+            break
+        pages.append(page)
+        after = tuple(page.iloc[-1][list(POWER_KEYS)])
+    rows = pd.concat(pages)
+    expected = read_filtered("power_data", order_by="country, month, production_type", engine=engine, **filters)
+    assert rows.reset_index(drop=True).equals(expected)
+    assert len(rows) == 4
@@ -42,3 +42,199 @@ def test_weather_csv_load():
     df = pd.read_csv(path)
     assert not df.empty
     assert 'avg_temp_c' in df.columns
+
+def _start_weather_server(fail_first=0, fail_starts=()):
+    # Local stand-in for the Open-Meteo archive API serving constant daily values; ranges starting on a date in
+    # fail_starts get an API error the first time they are requested
+    import json
+    import threading
+    from datetime import date, timedelta
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlparse, parse_qs
+
+    state = {"requests": 0, "failures": fail_first, "fail_starts": set(fail_starts), "starts": []}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            state["requests"] += 1
+            if state["failures"] > 0:
+                state["failures"] -= 1
+                self.send_response(503)
+                self.end_headers()
+                return
+            query = parse_qs(urlparse(self.path).query)
+            state["starts"].append(query["start_date"][0])
+            if query["start_date"][0] in state["fail_starts"]:
+                state["fail_starts"].discard(query["start_date"][0])
+                body = json.dumps({"error": True, "reason": "Internal error"}).encode()
+                self.send_response(400)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                self.wfile.write(body)
+                return
+            day = date.fromisoformat(query["start_date"][0])
+            end = date.fromisoformat(query["end_date"][0])
+            days = []
+            while day <= end:
+                days.append(day.isoformat())
+                day += timedelta(days=1)
+            body = json.dumps({"daily": {
+                "time": days,
+                "temperature_2m_max": [10.0] * len(days),
+                "temperature_2m_min": [4.0] * len(days),
+                "precipitation_sum": [1.0] * len(days),
+                "wind_speed_10m_max": [20.0] * len(days),
+            }}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/v1/archive", state
+
+def test_fetch_weather_batches_months():
+    # Adjacent months are merged into range requests; the partial current month is fetched on its own
+    from datetime import datetime
+    from ingestion.ingest_weather import fetch_all_weather
+    server, url, state = _start_weather_server()
+    try:
+        locations = {"France": {"lat": 48.8566, "lon": 2.3522}, "Spain": {"lat": 40.4168, "lon": -3.7038}}
+        results = fetch_all_weather(locations, start_year=2023, end_year=2023,
+                                    current_date=datetime(2023, 7, 13), base_url=url, cache_dir=None)
+    finally:
+        server.shutdown()
+    assert state["requests"] == 4
+    france = results["France"]
+    assert list(france['month']) == [f"2023-{m:02d}" for m in range(1, 8)]
+    assert france['avg_temp_c'].eq(7.0).all()
+    assert france.loc[france['month'] == '2023-07', 'precip_mm'].iloc[0] == 13.0
+
+def test_fetch_weather_retries_server_errors():
+    # A transient 503 is retried on the pooled session
+    from datetime import datetime
+    from ingestion.ingest_weather import fetch_weather, get_session
+    server, url, state = _start_weather_server(fail_first=1)
+    try:
+        df = fetch_weather("France", 48.8566, 2.3522, start_year=2023, end_year=2023,
+                           current_date=datetime(2023, 12, 31), base_url=url,
+                           session=get_session(backoff_factor=0), cache_dir=None)
+    finally:
+        server.shutdown()
+    assert state["requests"] == 2
+    assert len(df) == 12
+
+def test_failed_weather_batch_is_fetched_again():
+    # The watermark stops at a batch that failed, so the next incremental run fetches it instead of leaving a gap
+    from datetime import datetime
+    from ingestion.ingest_weather import fetch_all_weather, advance_weather_watermarks
+    from ingestion.watermarks import get_watermark
+    server, url, state = _start_weather_server(fail_starts={"2023-04-01"})
+    locations = {"France": {"lat": 48.8566, "lon": 2.3522}}
+    kwargs = dict(start_year=2023, end_year=2023, current_date=datetime(2023, 12, 31), base_url=url,
+                  batch_months=3, cache_dir=None)
+    try:
+        failed = {}
+        first = fetch_all_weather(locations, failed=failed, **kwargs)["France"]
+        assert failed == {"France": [("2023-04-01", "2023-06-30")]}
+        assert "2023-05" not in set(first["month"]) and "2023-12" in set(first["month"])
+        watermarks = advance_weather_watermarks({}, first, failed)
+        assert get_watermark(watermarks, "weather", "France") == "2023-04"
+        failed = {}
+        second = fetch_all_weather(locations, since={"France": "2023-04"}, failed=failed, **kwargs)["France"]
+    finally:
+        server.shutdown()
+    assert state["starts"].count("2023-04-01") == 2
+    assert failed == {}
+    assert list(second["month"]) == [f"2023-{m:02d}" for m in range(4, 13)]
+    assert get_watermark(advance_weather_watermarks(watermarks, second, failed), "weather", "France") == "2023-12"
+
+def test_weather_cache_offline_replay(tmp_path):
+    # Completed months are replayed from the cache; only the open-ended current month is refetched online
+    from datetime import datetime
+    from ingestion.ingest_weather import fetch_weather
+    server, url, state = _start_weather_server()
+    kwargs = dict(start_year=2023, end_year=2023, current_date=datetime(2023, 7, 13), base_url=url,
+                  cache_dir=str(tmp_path))
+    try:
+        first = fetch_weather("France", 48.8566, 2.3522, **kwargs)
+        assert state["requests"] == 2
+        fetch_weather("France", 48.8566, 2.3522, **kwargs)
+        assert state["requests"] == 3
+    finally:
+        server.shutdown()
+    replayed = fetch_weather("France", 48.8566, 2.3522, offline=True, **kwargs)
+    assert state["requests"] == 3
+    pd.testing.assert_frame_equal(first, replayed)
+
+def test_weather_cache_eviction(tmp_path):
+    # Least recently used responses are evicted once the cache exceeds its size budget
+    from ingestion.weather_cache import cache_key, store_cached, load_cached, evict
+    keys = [cache_key(48.8566, 2.3522, f"2023-{m:02d}-01", f"2023-{m:02d}-28") for m in range(1, 4)]
+    for key in keys:
+        store_cached(key, {"time": ["2023-01-01"] * 50}, cache_dir=str(tmp_path))
+    entry_size = os.path.getsize(os.path.join(str(tmp_path), keys[0][:2], f"{keys[0]}.json"))
+    os.utime(os.path.join(str(tmp_path), keys[1][:2], f"{keys[1]}.json"), (0, 0))
+    evict(str(tmp_path), max_bytes=2 * entry_size)
+    assert load_cached(keys[1], str(tmp_path)) is None
+    assert load_cached(keys[0], str(tmp_path)) is not None
+
+def test_watermark_incremental_upsert():
+    # Only rows at or after the watermark are reprocessed and replace their (country, month) slice
+    from ingestion.watermarks import since_watermark, advance_watermark, upsert_rows
+    history = pd.DataFrame({'country': ['France'] * 3, 'month': ['2023-01', '2023-02', '2023-03'], 'value_gwh': [1.0, 2.0, 3.0]})
+    watermarks = advance_watermark({}, 'iea', history)
+    assert watermarks == {'iea': {'France': '2023-03'}}
+    update = pd.DataFrame({'country': ['France'] * 3, 'month': ['2023-02', '2023-03', '2023-04'], 'value_gwh': [2.0, 3.5, 4.0]})
+    new = since_watermark(update, watermarks, 'iea')
+    assert list(new['month']) == ['2023-03', '2023-04']
+    merged = upsert_rows(history, new).sort_values('month')
+    assert list(merged['value_gwh']) == [1.0, 2.0, 3.5, 4.0]
+    assert advance_watermark(watermarks, 'iea', new)['iea']['France'] == '2023-04'
+
+def test_read_iea_csv_streams_and_filters(tmp_path):
+    # Chunks are filtered by country and balance with compact dtypes, and months parse through a lookup
+    from ingestion.ingest_iea import read_iea_csv
+    from analytics.utils import parse_iea_months
+    path = tmp_path / "iea.csv"
+    rows = ["Country,Time,Balance,Product,Value,Unit"]
+    for country in ["France", "Germany", "Spain"]:
+        for month in ["23-Jan", "23-Feb", "24-Dec"]:
+            rows.append(f"{country},{month},Net Electricity Production,Solar,100.5,GWh")
+            rows.append(f"{country},{month},Total Imports,Electricity,20,GWh")
+    path.write_text("\n".join(rows) + "\n")
+    df = read_iea_csv(str(path), ["France", "Spain"], balances=["Net Electricity Production"], chunksize=4)
+    assert len(df) == 6
+    assert set(df['country']) == {"France", "Spain"}
+    assert str(df['Value'].dtype) == 'float32'
+    assert str(df['Balance'].dtype) == 'category'
+    assert list(parse_iea_months(df['Time'])[:3]) == ['2023-01', '2023-02', '2024-12']
+
+def test_merged_store_projection_and_upsert(tmp_path):
+    # Partitions are rewritten only where months changed; reads project columns and push filters down
+    from ingestion.store import write_merged, upsert_merged, read_merged
+    root = str(tmp_path / "merged")
+    df = pd.DataFrame({
+        'country': ['France', 'France', 'Spain', 'France'],
+        'month': ['2023-12', '2024-01', '2024-01', '2024-01'],
+        'Balance': ['Net Electricity Production', 'Net Electricity Production',
+                    'Net Electricity Production', 'Final Consumption (Calculated)'],
+        'production_type': ['Solar', 'Solar', 'Solar', 'Electricity'],
+        'value_gwh': [10.0, 20.0, 30.0, 40.0],
+        'avg_temp_c': [3.0, 4.0, 9.0, 4.0],
+    })
+    write_merged(df, root)
+    assert sorted(os.listdir(os.path.join(root, 'country=France'))) == ['year=2023', 'year=2024']
+    solar = read_merged(root, columns=['month', 'value_gwh'], countries=['France'],
+                        balances=['Net Electricity Production'], start_month='2024-01')
+    assert list(solar.columns) == ['month', 'value_gwh']
+    assert solar['value_gwh'].tolist() == [20.0]
+    update = df.iloc[[1]].assign(value_gwh=25.0)
+    upsert_merged(update, root)
+    result = read_merged(root, balances=['Net Electricity Production'])
+    assert result['value_gwh'].tolist() == [10.0, 25.0, 30.0]
+    assert len(read_merged(root)) == 3
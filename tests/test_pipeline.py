@@ -0,0 +1,86 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import threading
+import pytest
+from pipeline.dag import Stage, run_dag, topological_order
+from pipeline.run_marker import publish_run_marker, run_marker_version, read_run_marker
+
+def test_run_dag_passes_results_and_runs_branches_in_parallel():
+    # Both fetches must be running at the same time for the barrier to release
+    barrier = threading.Barrier(2, timeout=5)
+
+    def fetch(value):
+        def func(inputs):
+            barrier.wait()
+            return value
+        return func
+
+    stages = [
+        Stage("merge", "Merge", lambda inputs: inputs["a"] + inputs["b"], ("a", "b")),
+        Stage("a", "A", fetch(1)),
+        Stage("b", "B", fetch(2)),
+    ]
+    results, report = run_dag(stages, max_workers=2)
+    assert results["merge"] == 3
+    assert set(report) == {"a", "b", "merge"}
+
+def test_run_dag_stops_after_failure():
+    # Stages downstream of a failure are never started
+    ran = []
+
+    def fail(inputs):
+        raise RuntimeError("boom")
+
+    stages = [
+        Stage("bad", "Bad", fail),
+        Stage("after", "After", lambda inputs: ran.append("after"), ("bad",)),
+    ]
+    with pytest.raises(RuntimeError):
+        run_dag(stages)
+    assert ran == []
+
+def test_topological_order_rejects_cycles():
+    stages = [Stage("a", "A", None, ("b",)), Stage("b", "B", None, ("a",))]
+    with pytest.raises(ValueError):
+        topological_order(stages)
+
+def test_run_dag_skips_unchanged_stages(tmp_path):
+    # Second run reuses the cached result; a changed upstream result or --force recomputes
+    calls = []
+    source = {"value": 1}
+
+    def produce(inputs):
+        return source["value"]
+
+    def consume(inputs):
+        calls.append(inputs["produce"])
+        return inputs["produce"] * 10
+
+    stages = [
+        Stage("produce", "Produce", produce, volatile=True),
+        Stage("consume", "Consume", consume, ("produce",)),
+    ]
+    cache_dir = str(tmp_path)
+    results, report = run_dag(stages, cache_dir=cache_dir)
+    assert report["consume"]["status"] == "miss"
+    results, report = run_dag(stages, cache_dir=cache_dir)
+    assert report["consume"]["status"] == "hit"
+    assert results["consume"] == 10
+    assert calls == [1]
+    run_dag(stages, cache_dir=cache_dir, force=("consume",))
+    assert calls == [1, 1]
+    source["value"] = 2
+    results, report = run_dag(stages, cache_dir=cache_dir)
+    assert report["consume"]["status"] == "miss"
+    assert results["consume"] == 20
+
+def test_publish_run_marker_changes_version(tmp_path):
+    # Every publish yields a new version, and each source keeps its own timestamp
+    path = tmp_path / "run_marker.json"
+    assert run_marker_version(path) == ""
+    publish_run_marker("db", path)
+    first = run_marker_version(path)
+    publish_run_marker("pipeline", path)
+    assert first and run_marker_version(path) != first
+    assert set(read_run_marker(path)["sources"]) == {"db", "pipeline"}